@@ -1,7 +1,12 @@
 import os
+import tempfile
 from flask import Flask
 from flask_cors import CORS
 from .extensions import db
+from . import instrumentation
+
+# Flask-CORS options, also applied by the async read endpoints (asgi.py)
+CORS_OPTIONS = {'expose_headers': ['Server-Timing']}
 
 def create_app():
     app = Flask(__name__)
@@ -18,23 +23,72 @@ def create_app():
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Async mode (asgi.py): engine of the async read endpoints (default: DATABASE_URL with its async driver),
+    # its pool per worker, and threads running the Flask app for every other endpoint
+    app.config['ASYNC_DATABASE_URL'] = os.getenv("ASYNC_DATABASE_URL") or None
+    app.config['ASYNC_DB_POOL_SIZE'] = int(os.getenv("ASYNC_DB_POOL_SIZE", 20))
+    app.config['ASYNC_DB_MAX_OVERFLOW'] = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 10))
+    app.config['ASYNC_DB_POOL_TIMEOUT'] = int(os.getenv("ASYNC_DB_POOL_TIMEOUT", 30))
+    app.config['ASGI_WSGI_THREADS'] = int(os.getenv("ASGI_WSGI_THREADS", 8))
+    
+    # XML ingestion: files above this size (bytes) are parsed with the streaming engine
+    app.config['XML_STREAMING_THRESHOLD'] = int(os.getenv("XML_STREAMING_THRESHOLD", 5 * 1024 * 1024))
+    # Processes used to parse multi-file uploads (0/1 = parse on the request thread)
+    app.config['XML_PARSE_WORKERS'] = int(os.getenv("XML_PARSE_WORKERS", min(4, os.cpu_count() or 1)))
+    # Parsed invoices written per bulk insert / transaction
+    app.config['XML_INGEST_CHUNK_SIZE'] = int(os.getenv("XML_INGEST_CHUNK_SIZE", 500))
+    # Invoices removed per DELETE / transaction by /api/xml/bulk-delete
+    app.config['XML_DELETE_CHUNK_SIZE'] = int(os.getenv("XML_DELETE_CHUNK_SIZE", 500))
+    # Seconds the invoice total of /api/xml/list is cached
+    app.config['XML_LIST_COUNT_TTL'] = int(os.getenv("XML_LIST_COUNT_TTL", 30))
+    # Largest XML accepted from inside a .zip / .tar.gz upload
+    app.config['XML_MAX_MEMBER_BYTES'] = int(os.getenv("XML_MAX_MEMBER_BYTES", 50 * 1024 * 1024))
+    # Keep the original XML of each invoice, compressed (zstd when installed, else zlib)
+    app.config['XML_STORE_ORIGINAL'] = os.getenv("XML_STORE_ORIGINAL", "1").lower() in ("1", "true", "yes")
+    app.config['XML_COMPRESSION'] = os.getenv("XML_COMPRESSION", "auto").lower()
+    # Async uploads (/api/xml/upload?async=1): where files wait (shared, persistent; unset: uploads run
+    # synchronously), job threads per worker process (0: only `flask xml run-jobs`), queue polling
+    # and heartbeat timeout (seconds)
+    app.config['XML_JOBS_DIR'] = os.getenv("XML_JOBS_DIR") or None
+    app.config['XML_JOB_WORKERS'] = int(os.getenv("XML_JOB_WORKERS", 2))
+    app.config['XML_JOB_POLL_INTERVAL'] = float(os.getenv("XML_JOB_POLL_INTERVAL", 2))
+    app.config['XML_JOB_STALE_AFTER'] = int(os.getenv("XML_JOB_STALE_AFTER", 120))
+    # Processed ledgers of /api/excel/process: where they are kept and for how long (seconds)
+    app.config['EXCEL_RESULTS_DIR'] = os.getenv("EXCEL_RESULTS_DIR", os.path.join(tempfile.gettempdir(), 'newlisted_excel_results'))
+    app.config['EXCEL_RESULT_TTL'] = int(os.getenv("EXCEL_RESULT_TTL", 3600))
+    # Re-uploads of the same file: in-memory LRU budget (bytes) and reuse of stored results across workers
+    app.config['EXCEL_CACHE_MAX_BYTES'] = int(os.getenv("EXCEL_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    app.config['EXCEL_CACHE_DISK'] = os.getenv("EXCEL_CACHE_DISK", "1").lower() in ("1", "true", "yes")
+    # Instrumentation: /metrics (Prometheus), Server-Timing header, per-worker snapshots shared through METRICS_DIR
+    app.config['METRICS_ENABLED'] = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+    app.config['SERVER_TIMING'] = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes")
+    app.config['METRICS_DIR'] = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), 'newlisted_metrics'))
+    app.config['METRICS_FLUSH_INTERVAL'] = int(os.getenv("METRICS_FLUSH_INTERVAL", 5))
     
     # Initialize Extensions
     db.init_app(app)
-    CORS(app)
+    CORS(app, **CORS_OPTIONS)
+    instrumentation.init_app(app)
     
     # Register Blueprints
     from .modules.xml.routes import xml_bp
     from .modules.excel.routes import excel_bp
+    from .modules.reconcile.routes import reconcile_bp
     
     app.register_blueprint(xml_bp, url_prefix='/api/xml')
     app.register_blueprint(excel_bp, url_prefix='/api/excel')
+    app.register_blueprint(reconcile_bp, url_prefix='/api/reconcile')
+    
+    # Async upload job threads (started per worker process, with its first request)
+    from .modules.xml import jobs
+    jobs.init_app(app)
+    
+    # Register CLI commands (flask xml ..., flask schema ...)
+    from .modules.xml.commands import xml_cli
+    from .schema import schema_cli
+    app.cli.add_command(xml_cli)
+    app.cli.add_command(schema_cli)
     
-    # Create DB Tables (Simple approach for step 1)
-    with app.app_context():
-        # Import models to ensure they are registered
-        from .modules.xml.models import Invoice, InvoiceItem
-        from .modules.excel.models import ExcelReport
-        db.create_all()
-        
+    # No database access at boot: tables and migrations are handled once per
+    # deploy by `flask schema upgrade` (see Dockerfile), not by every worker
     return app
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+ASGI - Async serving mode for the I/O-bound read endpoints
+
+In sync mode (wsgi.py under gunicorn, the default) a container serves as
+many requests at once as it has worker threads, even though the read
+endpoints spend nearly all their time waiting on the database. In async
+mode (asgi.py under uvicorn, SERVER_MODE=async in the Dockerfile):
+
+- GET /api/xml/list, /api/xml/search, /api/xml/summary and /api/xml/<id>
+  run on the event loop with an async SQLAlchemy engine (aiomysql, or
+  aiosqlite in development), so each worker keeps hundreds of them in
+  flight with a bounded connection pool (ASYNC_DB_POOL_SIZE +
+  ASYNC_DB_MAX_OVERFLOW connections; requests beyond that wait for one).
+- Every other endpoint is the unchanged Flask app, run in a thread pool
+  (ASGI_WSGI_THREADS) through a WSGI adapter: uploads, exports, deletes,
+  the Excel module, /metrics. Exports are CPU-bound file building and stay
+  on the sync path.
+
+The async views execute the same statements as the Flask routes (see
+queries.py, search.py, summary.py) and render JSON with Flask's provider,
+so both modes return identical bodies.
+"""
+import logging
+import time
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from flask_cors.core import get_cors_headers, get_cors_options
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from . import CORS_OPTIONS, create_app, instrumentation
+from .modules.xml.queries import (
+    invoice_count_statement, invoice_detail_statement, list_response, list_statement, parse_list_args
+)
+from .modules.xml.search import count_search_statement, parse_search_request, search_response, search_statements
+from .modules.xml.summary import assemble_summary, parse_summary_args, summary_statements
+from .modules.xml.services import DEFAULT_LIST_COUNT_TTL, cached_invoice_count, store_invoice_count
+
+logger = logging.getLogger(__name__)
+
+# Sync driver -> async driver of the same database
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'mysql+pymysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+    'sqlite+pysqlite': 'sqlite+aiosqlite',
+}
+
+# Async connections per worker: pool + overflow, and seconds a request waits for one
+DEFAULT_POOL_SIZE = 20
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT = 30
+
+# Seconds before a pooled connection is replaced (below MySQL's default wait_timeout)
+POOL_RECYCLE = 280
+
+# Threads running the Flask app for the endpoints not served natively
+DEFAULT_WSGI_THREADS = 8
+
+
+def async_database_url(url):
+    """The async-driver URL for a sync SQLALCHEMY_DATABASE_URI (URLs already async are kept)."""
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    return url.set(drivername=driver) if driver else url
+
+
+def create_engine_for(config):
+    url = config.get('ASYNC_DATABASE_URL') or async_database_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {}
+    if make_url(url).get_backend_name() != 'sqlite':
+        options = {
+            'pool_size': config.get('ASYNC_DB_POOL_SIZE', DEFAULT_POOL_SIZE),
+            'max_overflow': config.get('ASYNC_DB_MAX_OVERFLOW', DEFAULT_MAX_OVERFLOW),
+            'pool_timeout': config.get('ASYNC_DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT),
+            'pool_recycle': POOL_RECYCLE,
+            'pool_pre_ping': True,
+        }
+    return create_async_engine(url, **options)
+
+
+def _json(request, body, status=200):
+    """JSON response rendered exactly like Flask's jsonify, with the CORS headers Flask-CORS would add."""
+    rendered = request.app.state.flask_app.json.response(body)
+    response = Response(rendered.get_data(), status_code=status, media_type=rendered.mimetype)
+    for name, value in get_cors_headers(request.app.state.cors_options, request.headers, request.method).items():
+        response.headers[name] = value
+    return response
+
+
+def _endpoint(rule):
+    """Wraps an async view with the request metrics and Server-Timing header of the Flask hooks."""
+    def decorator(view):
+        async def endpoint(request):
+            flask_app = request.app.state.flask_app
+            if not flask_app.config.get('METRICS_ENABLED', True):
+                return await view(request)
+
+            start = time.perf_counter()
+            token = instrumentation.start_request(rule)
+            try:
+                response = await view(request)
+                labels = {'method': request.method, 'endpoint': rule}
+                server_timing = instrumentation.record_request(labels, response.status_code, time.perf_counter() - start)
+                if flask_app.config.get('SERVER_TIMING', True):
+                    response.headers['Server-Timing'] = server_timing
+            finally:
+                instrumentation.end_request(token)
+            with flask_app.app_context():
+                instrumentation.flush_metrics()
+            return response
+        return endpoint
+    return decorator
+
+
+@_endpoint('/api/xml/list')
+async def list_invoices(request):
+    try:
+        options = parse_list_args(request.query_params)
+    except ValueError as e:
+        return _json(request, {"error": str(e)}, 400)
+
+    config = request.app.state.flask_app.config
+    async with request.app.state.sessions() as session:
+        invoices = (await session.execute(list_statement(options))).scalars().all()
+        total = None
+        if options['with_count']:
+            total = cached_invoice_count(config.get('XML_LIST_COUNT_TTL', DEFAULT_LIST_COUNT_TTL))
+            if total is None:
+                total = (await session.execute(invoice_count_statement())).scalar()
+                store_invoice_count(total)
+        body = list_response(options, invoices, total)
+    return _json(request, body)
+
+
+@_endpoint('/api/xml/search')
+async def search(request):
+    try:
+        params, per_page, cursor, with_count = parse_search_request(request.query_params)
+    except ValueError as e:
+        return _json(request, {"error": str(e)}, 400)
+
+    dialect = request.app.state.engine.dialect.name
+    async with request.app.state.sessions() as session:
+        limit = per_page + 1
+        invoices = []
+        for stmt in search_statements(params, cursor, dialect):
+            invoices += (await session.execute(stmt.limit(limit - len(invoices)))).scalars().all()
+            if len(invoices) >= limit:
+                break
+        total = (await session.execute(count_search_statement(params, dialect))).scalar() if with_count else None
+        body = search_response(invoices[:per_page], len(invoices) > per_page, total)
+    return _json(request, body)
+
+
+@_endpoint('/api/xml/summary')
+async def invoice_summary(request):
+    try:
+        arguments = parse_summary_args(request.query_params)
+    except ValueError as e:
+        return _json(request, {"error": str(e)}, 400)
+
+    totals_stmt, taxes_stmt = summary_statements(**arguments)
+    async with request.app.state.sessions() as session:
+        total_rows = (await session.execute(totals_stmt)).all()
+        tax_rows = (await session.execute(taxes_stmt)).all()
+    return _json(request, assemble_summary(arguments['group_by'], total_rows, tax_rows))
+
+
+@_endpoint('/api/xml/<int:invoice_id>')
+async def get_invoice(request):
+    async with request.app.state.sessions() as session:
+        invoice = (await session.execute(invoice_detail_statement(request.path_params['invoice_id']))).scalar_one_or_none()
+        if not invoice:
+            return _json(request, {"error": "Factura no encontrada"}, 404)
+        body = invoice.to_dict()
+    return _json(request, body)
+
+
+def create_asgi_app(flask_app=None):
+    """
+    The async app: the read endpoints above, everything else forwarded to
+    the Flask app (GET-only routes let other methods, e.g. DELETE
+    /api/xml/<id> and CORS preflights, fall through to Flask).
+    """
+    flask_app = flask_app or create_app()
+    engine = create_engine_for(flask_app.config)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        await engine.dispose()
+
+    app = Starlette(
+        routes=[
+            Route('/api/xml/list', list_invoices, methods=['GET']),
+            Route('/api/xml/search', search, methods=['GET']),
+            Route('/api/xml/summary', invoice_summary, methods=['GET']),
+            Route('/api/xml/{invoice_id:int}', get_invoice, methods=['GET']),
+            Mount('/', WSGIMiddleware(flask_app, workers=flask_app.config.get('ASGI_WSGI_THREADS', DEFAULT_WSGI_THREADS))),
+        ],
+        lifespan=lifespan,
+    )
+    app.state.flask_app = flask_app
+    app.state.cors_options = get_cors_options(flask_app, CORS_OPTIONS)
+    app.state.engine = engine
+    app.state.sessions = async_sessionmaker(engine, expire_on_commit=False)
+    return app
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation - Stage timings, SQL query counts and Prometheus metrics
+
+Pipelines wrap their steps in `stage(pipeline, name)`; every SQL statement is
+timed through SQLAlchemy cursor events. Both feed:
+- process-wide counters and histograms, exposed at GET /metrics in the
+  Prometheus text format, and
+- the current request's totals, sent back in a `Server-Timing` header.
+
+Each gunicorn worker keeps its own metrics in memory and writes a snapshot
+to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds (and when scraped);
+/metrics sums the snapshots of all live workers, so any worker can answer
+the scrape. Recording a value costs a perf_counter call and a dict update.
+"""
+import contextvars
+import json
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'newlisted_metrics')
+DEFAULT_FLUSH_INTERVAL = 5
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+# name -> (type, help)
+METRICS = {
+    'newlisted_http_requests_total': ('counter', 'HTTP requests by endpoint and status.'),
+    'newlisted_http_request_duration_seconds': ('histogram', 'HTTP request latency by endpoint.'),
+    'newlisted_stage_duration_seconds': ('histogram', 'Time spent per pipeline stage.'),
+    'newlisted_db_queries_total': ('counter', 'SQL statements executed, by endpoint.'),
+    'newlisted_db_query_seconds_total': ('counter', 'Time spent executing SQL statements, by endpoint.'),
+}
+
+# Endpoint label of work done outside a request (async ingest jobs, CLI commands)
+BACKGROUND_ENDPOINT = 'background'
+
+# Totals of the request being served: {'stages': {name: seconds}, 'queries': n, 'query_time': seconds}
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class _Registry:
+    """Counters and histograms of this process, keyed by (metric name, sorted label pairs)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}  # key -> [bucket counts..., sum, count]
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, seconds):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(DURATION_BUCKETS) + 2)
+            for position, bound in enumerate(DURATION_BUCKETS):
+                if seconds <= bound:
+                    values[position] += 1
+                    break
+            values[-2] += seconds
+            values[-1] += 1
+
+    def snapshot(self):
+        """JSON-ready copy: lists of [name, [[label, value], ...], value(s)]."""
+        with self.lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+
+_registry = _Registry()
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _labels_for_request():
+    rule = request.url_rule.rule if request.url_rule is not None else '<unmatched>'
+    return {'method': request.method, 'endpoint': rule}
+
+
+def _current_endpoint():
+    timings = _request_timings.get()
+    return timings['endpoint'] if timings is not None else BACKGROUND_ENDPOINT
+
+
+def observe_stage(pipeline, name, seconds):
+    """Records `seconds` spent in a stage (for steps that cannot use `stage`, e.g. generators)."""
+    _registry.observe('newlisted_stage_duration_seconds', {'pipeline': pipeline, 'stage': name}, seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        stages = timings['stages']
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(pipeline, name):
+    """Times the enclosed block as stage `name` of `pipeline` ('xml', 'excel', 'reconcile')."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, name, time.perf_counter() - start)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    labels = {'endpoint': _current_endpoint()}
+    _registry.inc('newlisted_db_queries_total', labels)
+    _registry.inc('newlisted_db_query_seconds_total', labels, elapsed)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings['queries'] += 1
+        timings['query_time'] += elapsed
+
+
+def _handle_error(exception_context):
+    # The failed statement never reaches after_cursor_execute: drop its start
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_start'):
+        connection.info['query_start'].pop()
+
+
+def _metrics_dir():
+    return current_app.config.get('METRICS_DIR', DEFAULT_METRICS_DIR)
+
+
+def flush_metrics(force=False):
+    """Writes this process's snapshot to METRICS_DIR (at most once per flush interval unless forced)."""
+    global _last_flush
+    directory = _metrics_dir()
+    if not directory:
+        return
+    now = time.monotonic()
+    interval = current_app.config.get('METRICS_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+    with _flush_lock:
+        if not force and now - _last_flush < interval:
+            return
+        _last_flush = now
+    try:
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+            json.dump(_registry.snapshot(), fh)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot: {str(e)}")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _collect_snapshots():
+    """Snapshots of every live worker (files of dead workers are removed), or just this process."""
+    directory = _metrics_dir()
+    if not directory:
+        return [_registry.snapshot()]
+
+    flush_metrics(force=True)
+    snapshots = []
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            pid = int(name[:-len('.json')])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path, encoding='utf-8') as fh:
+                snapshots.append(json.load(fh))
+        except (OSError, ValueError):
+            continue  # Being replaced right now: next scrape gets it
+    return snapshots
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in pairs) + '}'
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == math.inf else repr(float(bound))
+
+
+def render_metrics(snapshots):
+    """Sums worker snapshots and renders them in the Prometheus text exposition format."""
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in snapshot.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            current = histograms.setdefault(key, [0] * len(values))
+            histograms[key] = [a + b for a, b in zip(current, values)]
+
+    lines = []
+    for metric, (metric_type, help_text) in METRICS.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        if metric_type == 'counter':
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_format_labels(labels)} {value}")
+        else:
+            for (name, labels), values in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, count in zip(DURATION_BUCKETS, values):
+                    cumulative += count
+                    lines.append(f"{metric}_bucket{_format_labels(labels, [('le', _format_bound(bound))])} {cumulative}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {values[-2]}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {values[-1]}")
+    return '\n'.join(lines) + '\n'
+
+
+def _server_timing(timings, total):
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings['stages'].items()]
+    parts.append(f'db;dur={timings["query_time"] * 1000:.1f};desc="{timings["queries"]} queries"')
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+def start_request(endpoint):
+    """Starts the current request's totals; returns the token to pass to `end_request`."""
+    return _request_timings.set({'endpoint': endpoint, 'stages': {}, 'queries': 0, 'query_time': 0.0})
+
+
+def record_request(labels, status_code, seconds):
+    """Counts one served request. Returns its Server-Timing header value (None outside a request)."""
+    _registry.observe('newlisted_http_request_duration_seconds', labels, seconds)
+    _registry.inc('newlisted_http_requests_total', dict(labels, status=str(status_code)))
+    timings = _request_timings.get()
+    return _server_timing(timings, seconds) if timings is not None else None
+
+
+def end_request(token):
+    _request_timings.reset(token)
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    g.request_timings_token = start_request(_labels_for_request()['endpoint'])
+
+
+def _after_request(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    server_timing = record_request(_labels_for_request(), response.status_code, time.perf_counter() - start)
+    if server_timing is not None and current_app.config.get('SERVER_TIMING', True):
+        response.headers['Server-Timing'] = server_timing
+
+    flush_metrics()
+    return response
+
+
+def _teardown_request(exc):
+    # After streamed bodies too, so their stages still count for the request
+    token = g.pop('request_timings_token', None)
+    if token is not None:
+        end_request(token)
+
+
+def metrics_view():
+    """GET /metrics: Prometheus text format, summed over all workers."""
+    return Response(render_metrics(_collect_snapshots()), mimetype='text/plain; version=0.0.4')
+
+
+_engine_events_registered = False
+
+
+def init_app(app):
+    """Registers request hooks, SQL events and the /metrics endpoint (unless METRICS_ENABLED is off)."""
+    global _engine_events_registered
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view, methods=['GET'])
+
+    if not _engine_events_registered:
+        # On the Engine class: covers every engine Flask-SQLAlchemy creates, once per process
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Engine, 'handle_error', _handle_error)
+        _engine_events_registered = True
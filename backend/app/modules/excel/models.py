@@ -12,6 +12,11 @@ class ExcelReport(db.Model):
     
     # Path inside the container/volume
     file_path = db.Column(db.String(500), nullable=True)
+    
+    # Result cache: SHA-256 of the uploaded bytes + version of the audit rules
+    content_hash = db.Column(db.String(64), index=True, nullable=True)
+    rules_version = db.Column(db.String(20), nullable=True)
+    result_id = db.Column(db.String(32), nullable=True)  # /api/excel/results/<result_id>
 
     def to_dict(self):
         return {
@@ -20,5 +25,8 @@ class ExcelReport(db.Model):
             'report_type': self.report_type,
             'row_count': self.row_count,
             'generated_at': self.generated_at.isoformat(),
-            'file_path': self.file_path
+            'file_path': self.file_path,
+            'content_hash': self.content_hash,
+            'rules_version': self.rules_version,
+            'result_id': self.result_id
         }
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Excel Module Readers - Load only the audited columns of a ledger (.xlsx, .xls, .csv)"""
+import csv
+import io
+import logging
+import re
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ['Fecha', 'Folio', 'Tipo', 'Total', 'Impuesto']
+
+# Identifier columns are read as text; amounts and dates are coerced by the audit rules
+TEXT_COLUMNS = ('Folio', 'Tipo')
+
+SUPPORTED_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+CSV_DELIMITERS = ',;\t|'
+
+# Name of the index of read_ledger() frames: the row number in the sheet / CSV (header row counted)
+ROW_INDEX = 'row'
+
+# An empty line after the header (skipped by the CSV readers, but still a row of the sheet)
+_CSV_BLANK_LINE = re.compile(rb'\n\r?\n')
+
+
+def _check_columns(columns):
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in columns]
+    if missing_cols:
+        raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
+
+
+def _required_names(header):
+    """
+    {name as written in the header: required column} for REQUIRED_COLUMNS,
+    matching header names without their surrounding spaces (' Folio ').
+    Raises ValueError on missing columns.
+    """
+    stripped = [str(name).strip() for name in header]
+    _check_columns(stripped)
+    return {header[stripped.index(col)]: col for col in REQUIRED_COLUMNS}
+
+
+def _cell_text(value):
+    """Text value of an identifier cell, like read_excel(dtype=str): 1001.0 -> '1001', blank -> None."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _frame_from_rows(rows):
+    """
+    DataFrame with REQUIRED_COLUMNS from an iterator of row tuples (the
+    first one being row 1 of the sheet) whose first non-blank row is the
+    header. Only the required cells of each row are kept; the index holds
+    each row's number in the sheet.
+    """
+    rows = enumerate(rows, start=1)
+    header = None
+    for _, row in rows:
+        if any(value not in (None, '') for value in row):
+            header = [str(value).strip() if value is not None else '' for value in row]
+            break
+    if header is None:
+        raise ValueError("The spreadsheet is empty")
+    _check_columns(header)
+
+    positions = [header.index(col) for col in REQUIRED_COLUMNS]
+    width = max(positions) + 1
+    columns = {col: [] for col in REQUIRED_COLUMNS}
+    numbers = []
+    for number, row in rows:
+        if all(value in (None, '') for value in row):
+            continue  # Blank line (read_excel skips them too)
+        numbers.append(number)
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        values = [row[pos] for pos in positions]
+        for col, value in zip(REQUIRED_COLUMNS, values):
+            if col in TEXT_COLUMNS:
+                value = _cell_text(value)
+            elif value == '':
+                value = None
+            columns[col].append(value)
+
+    return pd.DataFrame(columns, columns=REQUIRED_COLUMNS, index=pd.Index(numbers, name=ROW_INDEX))
+
+
+def _read_with_calamine(file_stream):
+    """Rust-based reader (python-calamine): several times faster than openpyxl. None if not installed."""
+    try:
+        from python_calamine import CalamineWorkbook
+    except ImportError:
+        return None
+
+    workbook = CalamineWorkbook.from_filelike(file_stream)
+    sheet = workbook.get_sheet_by_index(0)
+    rows = sheet.iter_rows() if hasattr(sheet, 'iter_rows') else iter(sheet.to_python(skip_empty_area=False))
+    return _frame_from_rows(rows)
+
+
+def _read_with_openpyxl(file_stream):
+    """openpyxl in read-only mode: rows are streamed and only the required cells are kept."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file_stream, read_only=True, data_only=True)
+    try:
+        return _frame_from_rows(workbook.worksheets[0].iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _read_csv_arrow(raw, delimiter, encoding, names):
+    """
+    pyarrow's multi-threaded CSV reader, converting only the header columns
+    `names` (as written in the file). None if not installed.
+    """
+    try:
+        import pyarrow as pa
+        from pyarrow import csv as pa_csv
+    except ImportError:
+        return None
+
+    try:
+        table = pa_csv.read_csv(
+            io.BytesIO(raw),
+            read_options=pa_csv.ReadOptions(encoding='utf8' if encoding == 'utf-8-sig' else encoding),
+            parse_options=pa_csv.ParseOptions(delimiter=delimiter),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=list(names),
+                column_types={name: pa.string() for name, col in names.items() if col in TEXT_COLUMNS},
+                strings_can_be_null=True
+            )
+        )
+    except pa.ArrowException as e:
+        # Malformed rows, or a header pyarrow reads differently than the sniffed one
+        raise ValueError(f"Could not read the CSV file: {e}")
+    return table.to_pandas()
+
+
+def _csv_row_numbers(raw, encoding, delimiter, count):
+    """
+    Line numbers (header = 1) of the `count` records the CSV readers
+    returned. Only empty lines are skipped by them, so records are numbered
+    one after the other unless the file has some; then the records are
+    counted with the csv module (quoted line breaks stay in their record).
+    """
+    numbers = range(2, count + 2)
+    if _CSV_BLANK_LINE.search(raw, raw.find(b'\n')):
+        reader = csv.reader(io.StringIO(raw.decode(encoding), newline=''), delimiter=delimiter)
+        next(reader, None)
+        found = [number for number, record in enumerate(reader, start=2) if record]
+        if len(found) == count:
+            numbers = found
+        else:
+            logger.warning(f"CSV row numbers not recovered ({len(found)} records, {count} rows read)")
+    return pd.Index(numbers, name=ROW_INDEX)
+
+
+def _read_csv(file_stream):
+    """
+    CSV through pyarrow's reader, or pandas' C engine when pyarrow is
+    missing, reading only REQUIRED_COLUMNS (header names may be padded with
+    spaces). Delimiter is sniffed from the header line (',' ';' tab or '|');
+    UTF-8 (with or without BOM) or Latin-1.
+    """
+    raw = file_stream.read()
+    encoding = 'utf-8-sig'
+    try:
+        raw.decode(encoding)
+    except UnicodeDecodeError:
+        encoding = 'latin-1'
+
+    header_line = raw.split(b'\n', 1)[0].decode(encoding).rstrip('\r')
+    try:
+        delimiter = csv.Sniffer().sniff(header_line, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        delimiter = ','
+    names = _required_names(next(csv.reader([header_line], delimiter=delimiter), []))
+
+    df = _read_csv_arrow(raw, delimiter, encoding, names)
+    if df is None:
+        df = pd.read_csv(
+            io.BytesIO(raw), engine='c', sep=delimiter, encoding=encoding, usecols=list(names),
+            dtype={name: str for name, col in names.items() if col in TEXT_COLUMNS}
+        )
+    df = df[list(names)].rename(columns=names)
+    df.index = _csv_row_numbers(raw, encoding, delimiter, len(df))
+    return df
+
+
+def read_ledger(file_stream, filename):
+    """
+    Loads the REQUIRED_COLUMNS of the first sheet of a ledger into a DataFrame
+    (Folio and Tipo as text, the rest as read), indexed by the row number
+    each row has in the sheet (ROW_INDEX; blank rows are skipped but still
+    counted). Raises ValueError on missing columns or unsupported file types.
+    """
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return _read_csv(file_stream)
+    if not name.endswith(('.xlsx', '.xls')):
+        raise ValueError("Invalid file type. Only .xlsx, .xls or .csv allowed.")
+
+    df = _read_with_calamine(file_stream)
+    if df is not None:
+        return df
+
+    if name.endswith('.xls'):
+        # Legacy binary workbooks: pandas' own reader (xlrd). It drops blank
+        # rows without a trace, so rows are numbered as if there were none
+        df = pd.read_excel(file_stream, dtype={col: str for col in TEXT_COLUMNS})
+        names = _required_names(list(df.columns))
+        df = df[list(names)].rename(columns=names)
+        df.index = pd.RangeIndex(2, len(df) + 2, name=ROW_INDEX)
+        return df
+
+    return _read_with_openpyxl(file_stream)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Excel Module Results - Processed ledgers kept server-side and served by pages"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import pandas as pd
+from flask import current_app
+from app.extensions import db
+from app.instrumentation import stage
+from .models import ExcelReport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULTS_DIR = os.path.join(tempfile.gettempdir(), 'newlisted_excel_results')
+DEFAULT_RESULT_TTL = 3600
+
+DEFAULT_PER_PAGE = 500
+MAX_PER_PAGE = 5000
+
+# Bytes of processed frames kept unpickled in this process (least recently used evicted)
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Content hashes remembered in this process (hash -> result_id)
+HASH_INDEX_SIZE = 1024
+
+RESULT_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Statuses that can be used in ?filter=, matched against Verif or COMCON
+STATUS_COLUMNS = ('Verif', 'COMCON')
+
+_frames = OrderedDict()  # result_id -> (DataFrame, size in bytes)
+_frames_bytes = 0
+_hash_index = OrderedDict()  # "<sha256>:<rules version>" -> result_id
+_frames_lock = threading.Lock()
+
+
+def _results_dir():
+    return current_app.config.get('EXCEL_RESULTS_DIR', DEFAULT_RESULTS_DIR)
+
+
+def _paths(result_id):
+    base = os.path.join(_results_dir(), result_id)
+    return base + '.pkl', base + '.json'
+
+
+def _cache_frame(result_id, df):
+    """Adds a frame to the in-process LRU, evicting the oldest ones above EXCEL_CACHE_MAX_BYTES."""
+    global _frames_bytes
+    max_bytes = current_app.config.get('EXCEL_CACHE_MAX_BYTES', DEFAULT_CACHE_MAX_BYTES)
+    size = int(df.memory_usage(deep=True).sum())
+    with _frames_lock:
+        if result_id in _frames:
+            _frames_bytes -= _frames.pop(result_id)[1]
+        if size > max_bytes:
+            return
+        _frames[result_id] = (df, size)
+        _frames_bytes += size
+        while _frames_bytes > max_bytes:
+            _frames_bytes -= _frames.popitem(last=False)[1][1]
+
+
+def summarize_result(df):
+    """Row count plus counts by Verif and COMCON status."""
+    return {
+        "processed_rows": len(df),
+        "errors": 0,  # Placeholder if we track specific row errors later
+        "verif": {str(k): int(v) for k, v in df['Verif'].value_counts().items()},
+        "comcon": {str(k): int(v) for k, v in df['COMCON'].value_counts().items()},
+    }
+
+
+def _purge_expired(directory, ttl):
+    cutoff = time.time() - ttl
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def save_result(df):
+    """
+    Stores a processed ledger on disk (shared by every worker of the host)
+    and returns (result_id, summary). Results older than EXCEL_RESULT_TTL
+    seconds are purged on each save.
+    """
+    directory = _results_dir()
+    os.makedirs(directory, exist_ok=True)
+    _purge_expired(directory, current_app.config.get('EXCEL_RESULT_TTL', DEFAULT_RESULT_TTL))
+
+    result_id = uuid.uuid4().hex
+    frame_path, summary_path = _paths(result_id)
+    summary = summarize_result(df)
+
+    df.reset_index(drop=True, inplace=True)
+    df.to_pickle(frame_path)
+    with open(summary_path, 'w', encoding='utf-8') as fh:
+        json.dump(summary, fh)
+
+    _cache_frame(result_id, df)
+
+    logger.info(f"Stored Excel result {result_id} with {len(df)} rows")
+    return result_id, summary
+
+
+def load_result(result_id):
+    """Processed DataFrame of a result, or None if unknown or expired."""
+    if not RESULT_ID_PATTERN.match(result_id or ''):
+        return None
+
+    with _frames_lock:
+        if result_id in _frames:
+            _frames.move_to_end(result_id)
+            return _frames[result_id][0]
+
+    frame_path, _ = _paths(result_id)
+    try:
+        df = pd.read_pickle(frame_path)
+    except FileNotFoundError:
+        return None
+
+    _cache_frame(result_id, df)
+    return df
+
+
+def load_summary(result_id):
+    if not RESULT_ID_PATTERN.match(result_id or ''):
+        return None
+    _, summary_path = _paths(result_id)
+    try:
+        with open(summary_path, encoding='utf-8') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def parse_status_filter(value):
+    """'CHECK|JUMP DETECTED' -> ['CHECK', 'JUMP DETECTED'] (empty -> no filter)."""
+    return [status.strip() for status in (value or '').split('|') if status.strip()]
+
+
+def filter_result(df, statuses):
+    """Rows whose Verif or COMCON is one of `statuses` (all rows if none given)."""
+    if not statuses:
+        return df
+    mask = pd.Series(False, index=df.index)
+    for column in STATUS_COLUMNS:
+        mask |= df[column].isin(statuses)
+    return df[mask]
+
+
+def to_records(df):
+    """JSON-ready records, formatted as /api/excel/process always returned them."""
+    with stage('excel', 'serialize'):
+        # Replace NaNs/NaT with None for JSON serialization (object dtype, so float
+        # columns such as Diff really hold None instead of NaN)
+        df = df.astype(object).where(pd.notnull(df), None)
+
+        # Format Date strings
+        df['Fecha'] = df['Fecha'].apply(lambda x: x.isoformat() if x else None)
+        return df.to_dict(orient='records')
+
+
+def page_of(df, page, per_page):
+    """One page of records plus pagination info."""
+    total = len(df)
+    start = (page - 1) * per_page
+    return {
+        "data": to_records(df.iloc[start:start + per_page]),
+        "total": total,
+        "page": page,
+        "per_page": per_page,
+        "pages": (total + per_page - 1) // per_page,
+    }
+
+
+def iter_ndjson(df, rows_per_chunk=DEFAULT_PER_PAGE):
+    """Streams every record as newline-delimited JSON, a slice at a time."""
+    for start in range(0, len(df), rows_per_chunk):
+        lines = [json.dumps(record, default=str) for record in to_records(df.iloc[start:start + rows_per_chunk])]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def cache_key(content_hash, rules_version):
+    return f"{content_hash}:{rules_version}"
+
+
+def find_cached_result(content_hash, rules_version):
+    """
+    result_id of a stored result for the same file bytes and rules version,
+    or None. Looks in this process first, then in excel_reports (shared by
+    every worker). Hits refresh the files' age so the TTL counts from last use.
+    """
+    key = cache_key(content_hash, rules_version)
+    with _frames_lock:
+        result_id = _hash_index.get(key)
+        if result_id:
+            _hash_index.move_to_end(key)
+
+    if result_id is None and current_app.config.get('EXCEL_CACHE_DISK', True):
+        report = ExcelReport.query.filter_by(
+            content_hash=content_hash, rules_version=rules_version
+        ).order_by(ExcelReport.id.desc()).first()
+        result_id = report.result_id if report else None
+
+    if result_id is None:
+        return None
+
+    touched = 0
+    for path in _paths(result_id):
+        try:
+            os.utime(path)
+            touched += 1
+        except OSError:
+            pass
+    if touched < 2:
+        # Expired on disk: forget it, the caller recomputes
+        with _frames_lock:
+            _hash_index.pop(key, None)
+        return None
+
+    _remember_hash(key, result_id)
+    return result_id
+
+
+def _remember_hash(key, result_id):
+    with _frames_lock:
+        _hash_index[key] = result_id
+        _hash_index.move_to_end(key)
+        while len(_hash_index) > HASH_INDEX_SIZE:
+            _hash_index.popitem(last=False)
+
+
+def record_report(result_id, filename, row_count, content_hash, rules_version):
+    """Indexes a stored result by content hash (in-process and, if enabled, in excel_reports)."""
+    _remember_hash(cache_key(content_hash, rules_version), result_id)
+    if not current_app.config.get('EXCEL_CACHE_DISK', True):
+        return None
+
+    frame_path, _ = _paths(result_id)
+    report = ExcelReport(
+        filename=filename or 'ledger',
+        report_type='audit',
+        row_count=row_count,
+        file_path=frame_path,
+        content_hash=content_hash,
+        rules_version=rules_version,
+        result_id=result_id
+    )
+    try:
+        db.session.add(report)
+        db.session.commit()
+    except Exception as e:
+        # The cache is an optimization: a failed write must not fail the upload
+        db.session.rollback()
+        logger.warning(f"Could not record Excel report {result_id}: {str(e)}")
+        return None
+    return report
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
-"""Excel Module Routes"""
-from flask import Blueprint, request, jsonify
-from .services import process_excel_dataframe
+"""Excel Module Routes
+
+The Excel modules pull in pandas and NumPy, so the views import them on
+first use instead of at worker boot.
+"""
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 
 excel_bp = Blueprint('excel', __name__)
 
@@ -11,6 +14,15 @@ def index():
 
 @excel_bp.route('/process', methods=['POST'])
 def process_excel():
+    """
+    Processes a ledger and keeps the result server-side.
+    Returns result_id, summary and the first page (?per_page=, default 500);
+    the rest is read through /results/<result_id>.
+    """
+    from .readers import SUPPORTED_EXTENSIONS
+    from .results import DEFAULT_PER_PAGE, MAX_PER_PAGE
+    from .services import process_excel_dataframe
+
     if 'file' not in request.files:
         return jsonify({"error": "No file part"}), 400
     
@@ -19,12 +31,14 @@ def process_excel():
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
         
-    if not (file.filename.endswith('.xlsx') or file.filename.endswith('.xls')):
-        return jsonify({"error": "Invalid file type. Only .xlsx or .xls allowed."}), 400
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        return jsonify({"error": "Invalid file type. Only .xlsx, .xls or .csv allowed."}), 400
+
+    per_page = min(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), MAX_PER_PAGE)
 
     try:
         # Process the file stream directly
-        result = process_excel_dataframe(file.stream)
+        result = process_excel_dataframe(file.stream, file.filename, per_page=max(per_page, 1))
         return jsonify(result), 200
         
     except ValueError as ve:
@@ -33,3 +47,42 @@ def process_excel():
     except Exception as e:
         # Unexpected error
         return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
+
+@excel_bp.route('/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """
+    Rows of a processed ledger.
+    ?page=1&per_page=500 (max 5000)
+    ?filter=CHECK|JUMP DETECTED  rows whose Verif or COMCON is any of the statuses
+    ?format=ndjson               streams every (filtered) row as NDJSON instead
+    """
+    from .results import (
+        DEFAULT_PER_PAGE, MAX_PER_PAGE, filter_result, iter_ndjson, load_result, page_of, parse_status_filter
+    )
+
+    df = load_result(result_id)
+    if df is None:
+        return jsonify({"error": "Result not found or expired"}), 404
+
+    df = filter_result(df, parse_status_filter(request.args.get('filter')))
+
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(iter_ndjson(df)),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': f'attachment; filename=excel_result_{result_id}.ndjson'}
+        )
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', DEFAULT_PER_PAGE, type=int), 1), MAX_PER_PAGE)
+    return jsonify(page_of(df, page, per_page)), 200
+
+@excel_bp.route('/results/<result_id>/summary', methods=['GET'])
+def get_result_summary(result_id):
+    """Row count and counts by Verif / COMCON status of a processed ledger."""
+    from .results import load_summary
+
+    summary = load_summary(result_id)
+    if summary is None:
+        return jsonify({"error": "Result not found or expired"}), 404
+    return jsonify(summary), 200
@@ -1,9 +1,18 @@
+import hashlib
+import io
 import pandas as pd
 import numpy as np
 import re
 from datetime import datetime
+from app.instrumentation import stage
+from .readers import read_ledger
+from .results import (
+    DEFAULT_PER_PAGE, find_cached_result, load_result, load_summary, page_of, record_report, save_result
+)
 
-REQUIRED_COLUMNS = ['Fecha', 'Folio', 'Tipo', 'Total', 'Impuesto']
+# Bump whenever Base / Verif / COMCON rules or the reader change: cached results
+# computed with another version are not reused
+RULES_VERSION = '2'
 
 def extract_numeric_folio(folio_val):
     """
@@ -24,107 +33,175 @@ def extract_numeric_folio(folio_val):
             return 0
     return 0
 
-def process_excel_dataframe(file_stream):
+def calculate_verif(row):
     """
-    Reads an Excel file stream/buffer and applies business logic.
-    Returns a dictionary with summary and data.
+    Row-wise reference of the Verif rule (tax audit): Impuesto / Base must be
+    19%. apply_audit_rules() applies the same rule vectorized.
+    """
+    base = row['Base']
+    tax = row['Impuesto']
+    
+    if base == 0:
+        if tax == 0: return "OK" # 0/0 is technically OK for this audit context (exempt)
+        return "CHECK" # Tax with no base is suspicious
+    
+    ratio = tax / base
+    # 19% can be slightly off due to float math, so we compare with a tolerance
+    if 0.18 <= ratio <= 0.20:
+        if abs(ratio - 0.19) < 0.001:
+            return "OK"
+    
+    return "CHECK"
+
+def calculate_comcon(diff_val):
+    """Row-wise reference of the COMCON rule (consecutive folio control)."""
+    if pd.isna(diff_val):
+        return "START" # First item in the group
+    if diff_val == 1:
+        return "OK"
+    if diff_val == 0:
+        return "DUPLICATE"
+    if diff_val > 1:
+        return "JUMP DETECTED"
+    return "ERROR" # Negative diff? Out of order? (Should be covered by sort but data might be weird)
+
+def _folio_digits_arrow(values):
+    """
+    Digits-only folios parsed to int64 with pyarrow's regex kernel (RE2, much
+    faster than Python's re). Returns None when pyarrow is missing or some
+    value is non-ASCII, where RE2's \\d would differ from Python's.
     """
     try:
-        # 1. Read Excel
-        df = pd.read_excel(file_stream)
-        
-        # 2. Check Columns
-        missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
-        if missing_cols:
-            raise ValueError(f"Missing required columns: {', '.join(missing_cols)}")
-            
-        # 3. Data Cleaning & Filtering
-        # Remove rows where crucial data is completely NaN (optional, but good practice)
-        df.dropna(how='all', inplace=True)
-        
-        # Ensure numeric types
-        for col in ['Total', 'Impuesto']:
-            df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return None
 
-        # A. Logical Segregation (Emitidos vs Recibidos)
-        # Assuming 'Tipo' column dictates this. For now, we normalize it if needed.
-        # We perform the operations on the whole set, but the frontend might display them separated.
-        
-        # B. Calculation of "Base"
-        # Logic: Base = Total - Impuesto
-        df['Base'] = df['Total'] - df['Impuesto']
-        
-        # C. Validation Column "Verif" (Tax Audit)
-        # Logic: Impuesto / Base. If 0.19 -> OK.
-        # Avoid division by zero
-        def calculate_verif(row):
-            base = row['Base']
-            tax = row['Impuesto']
-            
-            if base == 0:
-                if tax == 0: return "OK" # 0/0 is technically OK for this audit context (exempt)
-                return "CHECK" # Tax with no base is suspicious
-            
-            ratio = tax / base
-            # Round to 2 decimals for comparison or check close strictness? 
-            # 19% can be slightly off due to float math, so we use np.isclose or round.
-            if 0.18 <= ratio <= 0.20: # Loosened slightly for rounding errors, usually it's exact math but floating point safety.
-                # If specifically looking for exactly 0.19 as per requirements:
-                if abs(ratio - 0.19) < 0.001:
-                    return "OK"
-            
-            return "CHECK"
+    array = pa.array(values.to_numpy(), type=pa.string())
+    if not pc.all(pc.string_is_ascii(array)).as_py():
+        return None
+    digits = pc.replace_substring_regex(array, pattern=r'\D+', replacement='')
+    digits = pc.if_else(pc.equal(digits, ''), '0', digits)
+    try:
+        return pc.cast(digits, pa.int64()).to_numpy()
+    except pa.ArrowInvalid:
+        return None
 
-        df['Verif'] = df.apply(calculate_verif, axis=1)
+def extract_numeric_folios(folios):
+    """
+    Vectorized extract_numeric_folio over a Series: keeps the digits of each
+    value (str() of it, like the scalar version) and parses them as int64.
+    Falls back to the scalar version if some value does not fit in int64.
+    """
+    present = folios.notna()
+    values = folios.astype(str)
 
-        # D. "COMCON" (Consecutive Control)
-        # 1. Extract numeric folio for sorting/diffing
-        df['Folio_Num'] = df['Folio'].apply(extract_numeric_folio)
-        
-        # 2. Sort by Fecha (ensure custom date parsing if needed) and Folio_Num
-        # Ensure Fecha is datetime
-        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-        df.sort_values(by=['Tipo', 'Fecha', 'Folio_Num'], inplace=True)
-        
-        # 3. Group by 'Tipo' and calculate Diff
-        # We need to perform this distinct per group
-        df['Diff'] = df.groupby('Tipo')['Folio_Num'].diff()
-        
-        def calculate_comcon(diff_val):
-            if pd.isna(diff_val):
-                return "START" # First item in the group
-            if diff_val == 1:
-                return "OK"
-            if diff_val == 0:
-                return "DUPLICATE"
-            if diff_val > 1:
-                return "JUMP DETECTED"
-            return "ERROR" # Negative diff? Out of order? (Should be covered by sort but data might be weird)
+    numbers = _folio_digits_arrow(values)
+    if numbers is not None:
+        return pd.Series(np.where(present.to_numpy(), numbers, 0), index=folios.index)
 
-        df['COMCON'] = df['Diff'].apply(calculate_comcon)
-        
-        # Cleanup temporary columns if not needed for display
-        # keeping Folio_Num might be useful for debugging, but let's drop it from final JSON if cleaner
-        # df.drop(columns=['Folio_Num', 'Diff'], inplace=True) 
-        # Actually, let's keep them or just 'Diff' for debug in frontend if needed. Let's keep data rich.
-        
-        # Replace NaNs/NaT with None/Str for JSON serialization
-        df = df.where(pd.notnull(df), None)
-        
-        # Format Date strings
-        df['Fecha'] = df['Fecha'].apply(lambda x: x.isoformat() if x else None)
+    digits = values.str.replace(r'\D+', '', regex=True)
+    digits = digits.where(present & (digits != ''), '0')
+    try:
+        return digits.astype('int64')
+    except (ValueError, OverflowError):
+        return folios.apply(extract_numeric_folio)
 
-        records = df.to_dict(orient='records')
-        
-        summary = {
-            "processed_rows": len(records),
-            "errors": 0 # Placeholder if we track specific row errors later
-        }
+def apply_audit_rules(df):
+    """
+    Adds Base, Verif, Folio_Num, Diff and COMCON to a ledger DataFrame that
+    has the readers.REQUIRED_COLUMNS, sorted by Tipo, Fecha and Folio_Num.
+    Every rule runs as a NumPy/pandas column operation (no per-row Python
+    calls); results are identical to calculate_verif / calculate_comcon.
+    """
+    # Remove rows where crucial data is completely NaN (optional, but good practice)
+    df.dropna(how='all', inplace=True)
+    
+    # Ensure numeric types
+    for col in ['Total', 'Impuesto']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
 
-        return {
-            "summary": summary,
-            "data": records
-        }
+    # A. Logical Segregation (Emitidos vs Recibidos)
+    # Assuming 'Tipo' column dictates this. We perform the operations on the
+    # whole set, but the frontend might display them separated.
+    
+    # B. Calculation of "Base"
+    # Logic: Base = Total - Impuesto
+    df['Base'] = df['Total'] - df['Impuesto']
+    
+    # C. Validation Column "Verif" (Tax Audit)
+    # Logic: Impuesto / Base. If 0.19 -> OK. Base 0 is OK only without tax.
+    base = df['Base'].to_numpy()
+    tax = df['Impuesto'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = tax / base
+    ratio_ok = (ratio >= 0.18) & (ratio <= 0.20) & (np.abs(ratio - 0.19) < 0.001)
+    df['Verif'] = np.select(
+        [base == 0, ratio_ok],
+        [np.where(tax == 0, 'OK', 'CHECK'), 'OK'],
+        default='CHECK'
+    ).astype(object)
+
+    # D. "COMCON" (Consecutive Control)
+    # 1. Extract numeric folio for sorting/diffing
+    df['Folio_Num'] = extract_numeric_folios(df['Folio'])
+    
+    # 2. Sort by Tipo, Fecha and Folio_Num (Fecha as datetime)
+    df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+    df.sort_values(by=['Tipo', 'Fecha', 'Folio_Num'], inplace=True)
+    
+    # 3. Diff per 'Tipo' group
+    df['Diff'] = df.groupby('Tipo')['Folio_Num'].diff()
+    
+    diff = df['Diff'].to_numpy(dtype='float64')
+    df['COMCON'] = np.select(
+        [np.isnan(diff), diff == 1, diff == 0, diff > 1],
+        ['START', 'OK', 'DUPLICATE', 'JUMP DETECTED'],
+        default='ERROR'
+    ).astype(object)
+    
+    return df
+
+def process_excel_dataframe(file_stream, filename='ledger.xlsx', per_page=DEFAULT_PER_PAGE):
+    """
+    Reads an Excel/CSV file stream/buffer and applies business logic.
+    The processed rows stay server-side (see results.py); returns the result
+    id, the summary (counts by Verif / COMCON) and the first page of data.
+    Re-uploading the same bytes reuses the stored result ("cached": true).
+    """
+    with stage('excel', 'read'):
+        raw = file_stream.read()
+    with stage('excel', 'cache'):
+        content_hash = hashlib.sha256(raw).hexdigest()
+        result_id = find_cached_result(content_hash, RULES_VERSION)
+    if result_id:
+        with stage('excel', 'cache'):
+            df = load_result(result_id)
+            summary = load_summary(result_id)
+        if df is not None and summary is not None:
+            return {
+                "result_id": result_id,
+                "summary": summary,
+                "cached": True,
+                **page_of(df, 1, per_page)
+            }
+
+    # 1-2. Read only the required columns (raises ValueError if some are missing)
+    with stage('excel', 'read'):
+        df = read_ledger(io.BytesIO(raw), filename)
+        
+    # 3. Business rules (Base, Verif, COMCON)
+    with stage('excel', 'compute'):
+        df = apply_audit_rules(df)
+    
+    # 4. Keep the result for the paged / streamed endpoints and for re-uploads
+    with stage('excel', 'store'):
+        result_id, summary = save_result(df)
+        record_report(result_id, filename, len(df), content_hash, RULES_VERSION)
 
-    except Exception as e:
-        raise e
+    return {
+        "result_id": result_id,
+        "summary": summary,
+        "cached": False,
+        **page_of(df, 1, per_page)
+    }
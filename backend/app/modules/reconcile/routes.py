@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Reconcile Module Routes
+
+Like the Excel module, the views import pandas-based services on first use
+instead of at worker boot.
+"""
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+
+reconcile_bp = Blueprint('reconcile', __name__)
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 5000
+
+
+@reconcile_bp.route('/', methods=['GET'])
+def index():
+    return {"message": "Reconcile Module Ready"}
+
+
+def _parse_options(args):
+    """Matching options from the query string; raises ValueError on bad values."""
+    from .services import DEFAULT_AMOUNT_TOLERANCE, DEFAULT_DATE_TOLERANCE, MAX_DATE_TOLERANCE
+
+    try:
+        amount_tolerance = float(args.get('amount_tolerance', DEFAULT_AMOUNT_TOLERANCE))
+        date_tolerance = int(args.get('date_tolerance', DEFAULT_DATE_TOLERANCE))
+    except ValueError:
+        raise ValueError("amount_tolerance must be a number and date_tolerance a whole number of days")
+    if not 0 <= amount_tolerance < float('inf'):
+        raise ValueError("amount_tolerance must be zero or positive")
+    if not 0 <= date_tolerance <= MAX_DATE_TOLERANCE:
+        raise ValueError(f"date_tolerance must be between 0 and {MAX_DATE_TOLERANCE} days")
+    return {
+        'amount_tolerance': amount_tolerance,
+        'date_tolerance': date_tolerance,
+        'issuer_nit': args.get('issuer_nit') or None,
+        'receiver_nit': args.get('receiver_nit') or None,
+    }
+
+
+@reconcile_bp.route('', methods=['POST'])
+def reconcile():
+    """
+    Matches an uploaded ledger (same columns as /api/excel/process) against
+    the stored invoices by normalized folio / invoice_number, date and amount.
+    ?issuer_nit= / ?receiver_nit=  only invoices of that issuer / receiver
+    ?amount_tolerance=1.0           Total / Impuesto difference still matched
+    ?date_tolerance=0               days Fecha may differ from issue_date (max 31)
+    ?limit=100                      rows returned per status (max 5000)
+    ?format=ndjson                  streams every report row as NDJSON instead
+    Returns the counts per status (matched, amount_mismatch, missing_in_db,
+    missing_in_ledger) and the first rows of each.
+    """
+    from app.modules.excel.readers import SUPPORTED_EXTENSIONS
+    from .services import iter_report_ndjson, reconcile_ledger, rows_by_status
+
+    if 'file' not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files['file']
+
+    if file.filename == '':
+        return jsonify({"error": "No selected file"}), 400
+
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
+        return jsonify({"error": "Invalid file type. Only .xlsx, .xls or .csv allowed."}), 400
+
+    limit = min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 0), MAX_LIMIT)
+
+    try:
+        options = _parse_options(request.args)
+        report, summary = reconcile_ledger(file.stream, file.filename, **options)
+    except ValueError as ve:
+        # Bad options or unreadable ledger (e.g. missing columns)
+        return jsonify({"error": str(ve)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Internal Server Error: {str(e)}"}), 500
+
+    if request.args.get('format') == 'ndjson':
+        return Response(
+            stream_with_context(iter_report_ndjson(report)),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=reconciliation.ndjson'}
+        )
+
+    rows, truncated = rows_by_status(report, limit)
+    return jsonify({"summary": summary, "rows": rows, "truncated": truncated}), 200
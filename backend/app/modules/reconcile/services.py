@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Reconcile Module Services - Ledger rows vs stored DIAN invoices
+
+A ledger (the same .xlsx/.xls/.csv the Excel module audits) is matched
+against the invoices table in three vectorized steps:
+
+1. One indexed query pulls the candidate invoices: issue_date within the
+   ledger's date range (plus the date tolerance), optionally narrowed to an
+   issuer / receiver NIT. Only the columns needed to match are fetched.
+2. Folios and invoice numbers are normalized (upper case, alphanumerics
+   only: 'fe-0012' -> 'FE0012') and hash joined in pandas, keeping pairs whose
+   dates are within the tolerance.
+3. Pairs are made one-to-one, best first (amounts agreeing, then closest
+   date, then closest total), and every row is classified as matched,
+   amount_mismatch, missing_in_db or missing_in_ledger.
+"""
+import json
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import Float, String, literal_column, select, type_coerce
+from app.extensions import db
+from app.instrumentation import stage
+from app.modules.excel.readers import read_ledger
+from app.modules.xml.export import build_export_filters
+from app.modules.xml.models import Invoice
+
+logger = logging.getLogger(__name__)
+
+MATCHED = 'matched'
+AMOUNT_MISMATCH = 'amount_mismatch'
+MISSING_IN_DB = 'missing_in_db'
+MISSING_IN_LEDGER = 'missing_in_ledger'
+STATUSES = (MATCHED, AMOUNT_MISMATCH, MISSING_IN_DB, MISSING_IN_LEDGER)
+
+# Largest difference (in currency units) between ledger and invoice Total / Impuesto
+# still reported as matched: ledgers are often kept in whole pesos
+DEFAULT_AMOUNT_TOLERANCE = 1.0
+
+# Days a ledger Fecha may differ from the invoice issue_date
+DEFAULT_DATE_TOLERANCE = 0
+MAX_DATE_TOLERANCE = 31
+
+REPORT_COLUMNS = [
+    'status', 'row', 'fecha', 'folio', 'tipo', 'total', 'impuesto',
+    'invoice_id', 'invoice_number', 'issuer_nit', 'receiver_nit', 'issue_date', 'total_amount', 'tax_amount',
+    'total_diff', 'tax_diff', 'date_diff_days',
+]
+
+LEDGER_COLUMNS = ['row', 'fecha', 'folio', 'tipo', 'total', 'impuesto']
+INVOICE_COLUMNS = ['invoice_id', 'invoice_number', 'issuer_nit', 'receiver_nit', 'issue_date', 'total_amount', 'tax_amount']
+DATE_COLUMNS = ('fecha', 'issue_date')
+
+
+def _normalize_arrow(values):
+    """normalize_folios() with pyarrow's kernels. None when pyarrow is missing or some value is non-ASCII."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+    except ImportError:
+        return None
+
+    array = pa.array(values.to_numpy(), type=pa.string(), from_pandas=True)
+    if not pc.all(pc.string_is_ascii(array)).as_py():
+        return None
+    keys = pc.replace_substring_regex(pc.ascii_upper(array), pattern=r'[^0-9A-Z]+', replacement='')
+    keys = pc.if_else(pc.equal(keys, ''), pa.scalar(None, pa.string()), keys)
+    return pd.Series(keys.to_numpy(zero_copy_only=False), index=values.index, dtype=object)
+
+
+def normalize_folios(folios):
+    """
+    Join key of folios / invoice numbers: upper case, alphanumerics only
+    ('fe-0012' -> 'FE0012'). Blank or symbol-only values -> None.
+    """
+    values = folios.where(folios.notna(), None).astype(object)
+    values = values.where(values.isna(), values.astype(str))
+    keys = _normalize_arrow(values)
+    if keys is not None:
+        return keys
+
+    keys = values.str.upper().str.replace(r'[^0-9A-Z]+', '', regex=True)
+    return keys.where(keys.notna() & (keys != ''), None)
+
+
+def prepare_ledger(df):
+    """
+    Ledger columns used to reconcile, from a read_ledger() DataFrame: row
+    (the row number in the spreadsheet), fecha (day), folio, tipo, total,
+    impuesto, key.
+    """
+    return pd.DataFrame({
+        'row': df.index.to_numpy(dtype='int64'),
+        'fecha': pd.to_datetime(df['Fecha'], errors='coerce').dt.normalize().to_numpy(),
+        'folio': df['Folio'].to_numpy(dtype=object),
+        'tipo': df['Tipo'].to_numpy(dtype=object),
+        'total': pd.to_numeric(df['Total'], errors='coerce').fillna(0).to_numpy(dtype='float64'),
+        'impuesto': pd.to_numeric(df['Impuesto'], errors='coerce').fillna(0).to_numpy(dtype='float64'),
+        'key': normalize_folios(df['Folio']).to_numpy(),
+    })
+
+
+def _as_double(column):
+    """
+    Numeric column read as a float: multiplying by a DOUBLE literal makes the
+    database return floats (MySQL ignores CAST AS FLOAT), sparing a Decimal
+    per value.
+    """
+    return type_coerce(column * literal_column('1e0'), Float())
+
+
+def candidate_statement(date_from, date_to, issuer_nit=None, receiver_nit=None):
+    """
+    The invoices a ledger can match, in one query on ix_invoices_issue_date
+    (or the NIT + issue_date indexes when a NIT is given). Only the columns
+    needed to match and report are read.
+    """
+    invoices = Invoice.__table__
+    return select(
+        invoices.c.id.label('invoice_id'),
+        invoices.c.invoice_number,
+        invoices.c.issuer_nit,
+        invoices.c.receiver_nit,
+        # Parsed by pandas in one pass instead of a date object per row (SQLite stores text)
+        type_coerce(invoices.c.issue_date, String).label('issue_date'),
+        _as_double(invoices.c.total_amount).label('total_amount'),
+        _as_double(invoices.c.tax_amount).label('tax_amount'),
+    ).where(*build_export_filters(
+        date_from=date_from, date_to=date_to, issuer_nit=issuer_nit, receiver_nit=receiver_nit
+    ))
+
+
+def load_candidates(ledger, date_tolerance=DEFAULT_DATE_TOLERANCE, issuer_nit=None, receiver_nit=None):
+    """Candidate invoices of a prepare_ledger() frame as a DataFrame (INVOICE_COLUMNS + key)."""
+    dates = ledger['fecha'].dropna()
+    if dates.empty:
+        candidates = pd.DataFrame(columns=INVOICE_COLUMNS)
+    else:
+        margin = pd.Timedelta(days=date_tolerance)
+        stmt = candidate_statement(
+            (dates.min() - margin).date(), (dates.max() + margin).date(), issuer_nit, receiver_nit
+        )
+        result = db.session.execute(stmt)
+        candidates = pd.DataFrame(result.all(), columns=list(result.keys()))
+
+    candidates['issue_date'] = pd.to_datetime(candidates['issue_date'])
+    for column in ('total_amount', 'tax_amount'):
+        candidates[column] = pd.to_numeric(candidates[column]).fillna(0)
+    candidates['key'] = normalize_folios(candidates['invoice_number']).to_numpy()
+    return candidates
+
+
+def _pair(ledger, candidates, amount_tolerance, date_tolerance):
+    """
+    One-to-one (ledger position, candidate position) pairs: hash join on the
+    normalized folio, dates within the tolerance, then greedily best first.
+    """
+    left = ledger.loc[ledger['key'].notna() & ledger['fecha'].notna(), ['key', 'fecha', 'total', 'impuesto']]
+    right = candidates.loc[candidates['key'].notna(), ['key', 'issue_date', 'total_amount', 'tax_amount']]
+    pairs = left.reset_index(names='lpos').merge(right.reset_index(names='cpos'), on='key')
+
+    date_gap = (pairs['fecha'] - pairs['issue_date']).dt.days.abs()
+    pairs = pairs.assign(date_gap=date_gap)[date_gap <= date_tolerance]
+
+    total_gap = np.round(np.abs(pairs['total'].to_numpy() - pairs['total_amount'].to_numpy()), 2)
+    tax_gap = np.round(np.abs(pairs['impuesto'].to_numpy() - pairs['tax_amount'].to_numpy()), 2)
+    pairs = pairs.assign(
+        amounts_agree=(total_gap <= amount_tolerance) & (tax_gap <= amount_tolerance),
+        total_gap=total_gap
+    ).sort_values(
+        ['amounts_agree', 'date_gap', 'total_gap', 'lpos', 'cpos'],
+        ascending=[False, True, True, True, True], kind='stable'
+    )[['lpos', 'cpos', 'amounts_agree']]
+
+    # Each round keeps the best remaining pair of every ledger row and invoice
+    # (at least one pair, so rounds run out); more than one round only happens
+    # for folios repeated on both sides
+    matched = []
+    while not pairs.empty:
+        best = pairs.drop_duplicates('lpos').drop_duplicates('cpos')
+        matched.append(best)
+        pairs = pairs[~pairs['lpos'].isin(best['lpos']) & ~pairs['cpos'].isin(best['cpos'])]
+
+    if not matched:
+        return pairs  # No pair at all (empty, same columns)
+    return pd.concat(matched).sort_values('lpos')
+
+
+def match_ledger(ledger, candidates, amount_tolerance=DEFAULT_AMOUNT_TOLERANCE, date_tolerance=DEFAULT_DATE_TOLERANCE):
+    """
+    Report DataFrame (REPORT_COLUMNS) of a prepare_ledger() frame against
+    load_candidates(): one row per ledger row, in ledger order, followed by
+    the invoices of the ledger's period that no ledger row matched.
+    """
+    pairs = _pair(ledger, candidates, amount_tolerance, date_tolerance)
+    lpos = pairs['lpos'].to_numpy()
+    cpos = pairs['cpos'].to_numpy()
+
+    # Ledger side: every row, with its invoice when paired
+    report = ledger[LEDGER_COLUMNS].copy()
+    report['status'] = MISSING_IN_DB
+    report.loc[lpos, 'status'] = np.where(pairs['amounts_agree'].to_numpy(), MATCHED, AMOUNT_MISMATCH)
+    invoice_side = candidates[INVOICE_COLUMNS].iloc[cpos].set_axis(lpos)
+    report = report.join(invoice_side)
+    report['invoice_id'] = report['invoice_id'].astype('Int64')
+
+    # Invoice side: unpaired invoices dated within the ledger's period (the
+    # tolerance margin only widens the search, it is not the ledger's period)
+    dates = ledger['fecha'].dropna()
+    unpaired = candidates[INVOICE_COLUMNS].drop(candidates.index[cpos])
+    if not dates.empty:
+        unpaired = unpaired[unpaired['issue_date'].between(dates.min(), dates.max())]
+    else:
+        unpaired = unpaired.iloc[0:0]
+    unpaired = unpaired.sort_values(['issue_date', 'invoice_id']).assign(status=MISSING_IN_LEDGER)
+    unpaired['invoice_id'] = unpaired['invoice_id'].astype('Int64')
+
+    report = pd.concat([report, unpaired], ignore_index=True)
+    report['row'] = report['row'].astype('Int64')
+    report['total_diff'] = np.round(report['total'] - report['total_amount'], 2)
+    report['tax_diff'] = np.round(report['impuesto'] - report['tax_amount'], 2)
+    report['date_diff_days'] = (report['fecha'] - report['issue_date']).dt.days.astype('Int64')
+    return report[REPORT_COLUMNS]
+
+
+def summarize_report(report, candidate_count):
+    counts = report['status'].value_counts()
+    return {
+        "ledger_rows": int(report['row'].notna().sum()),
+        "candidate_invoices": candidate_count,
+        **{status: int(counts.get(status, 0)) for status in STATUSES},
+    }
+
+
+def report_records(report):
+    """JSON-ready records of report rows (NaN/NaT -> None, dates as YYYY-MM-DD)."""
+    with stage('reconcile', 'serialize'):
+        report = report.copy()
+        for column in DATE_COLUMNS:
+            report[column] = report[column].dt.strftime('%Y-%m-%d')
+        report = report.astype(object).where(pd.notnull(report), None)
+        return report.to_dict(orient='records')
+
+
+def rows_by_status(report, limit):
+    """Up to `limit` records per status, plus whether each list was cut short."""
+    rows, truncated = {}, {}
+    for status in STATUSES:
+        subset = report[report['status'] == status]
+        rows[status] = report_records(subset.head(limit))
+        truncated[status] = len(subset) > limit
+    return rows, truncated
+
+
+def reconcile_ledger(
+    file_stream, filename, amount_tolerance=DEFAULT_AMOUNT_TOLERANCE,
+    date_tolerance=DEFAULT_DATE_TOLERANCE, issuer_nit=None, receiver_nit=None
+):
+    """
+    Reconciles an uploaded ledger with the stored invoices.
+    Returns (report DataFrame, summary). Raises ValueError on unreadable
+    ledgers (missing columns, unsupported file type).
+    """
+    with stage('reconcile', 'read'):
+        ledger = prepare_ledger(read_ledger(file_stream, filename))
+
+    with stage('reconcile', 'query'):
+        candidates = load_candidates(ledger, date_tolerance, issuer_nit, receiver_nit)
+
+    with stage('reconcile', 'match'):
+        report = match_ledger(ledger, candidates, amount_tolerance, date_tolerance)
+        summary = summarize_report(report, len(candidates))
+
+    logger.info(
+        f"Reconciled {len(ledger)} ledger rows against {len(candidates)} invoices: "
+        f"{summary[MATCHED]} matched, {summary[AMOUNT_MISMATCH]} amount mismatches, "
+        f"{summary[MISSING_IN_DB]} missing in DB, {summary[MISSING_IN_LEDGER]} missing in ledger"
+    )
+    return report, summary
+
+
+def iter_report_ndjson(report, rows_per_chunk=5000):
+    """Streams every report row as newline-delimited JSON, a slice at a time."""
+    for start in range(0, len(report), rows_per_chunk):
+        lines = [json.dumps(record) for record in report_records(report.iloc[start:start + rows_per_chunk])]
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""XML Module Commands - Maintenance tasks run with `flask xml <command>`"""
+import logging
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from .jobs import DEFAULT_JOB_POLL_INTERVAL, process_queued_jobs
+from .services import backfill_item_taxes, reprocess_stored_invoices
+from .summary import rebuild_rollups
+
+logger = logging.getLogger(__name__)
+
+xml_cli = AppGroup('xml', help='XML invoice maintenance commands.')
+
+
+@xml_cli.command('backfill-taxes')
+@click.option('--batch-size', default=2000, show_default=True, help='Invoice items processed per transaction.')
+def backfill_taxes(batch_size):
+    """Fills invoice_item_taxes from invoice_items.json_taxes (safe to re-run)."""
+    total_items = 0
+    total_taxes = 0
+    for last_id, items, tax_rows in backfill_item_taxes(batch_size):
+        total_items += items
+        total_taxes += tax_rows
+        click.echo(f"Processed {total_items} items ({total_taxes} tax rows) up to item id {last_id}")
+
+    logger.info(f"Tax backfill done: {total_items} items, {total_taxes} tax rows")
+    click.echo(f"Done: {total_items} items, {total_taxes} tax rows")
+
+
+@xml_cli.command('rebuild-summary')
+def rebuild_summary():
+    """Recomputes the /api/xml/summary rollup tables from scratch."""
+    groups, tax_groups = rebuild_rollups()
+    click.echo(f"Done: {groups} groups, {tax_groups} tax groups")
+
+
+@xml_cli.command('reprocess')
+@click.option('--batch-size', default=200, show_default=True, help='Invoices re-parsed per transaction.')
+@click.option('--workers', type=int, default=None, help='Parse processes (default: XML_PARSE_WORKERS).')
+@click.option('--start-id', default=0, show_default=True, help='Resume after this invoice id.')
+def reprocess(batch_size, workers, start_id):
+    """Re-parses the stored original XML to refresh invoice fields, items and taxes."""
+    total = 0
+    total_failed = 0
+    for last_id, reprocessed, failed in reprocess_stored_invoices(batch_size, workers, start_id):
+        total += reprocessed
+        total_failed += failed
+        click.echo(f"Reprocessed {total} invoices ({total_failed} failed) up to invoice id {last_id}")
+
+    logger.info(f"Reprocess done: {total} invoices, {total_failed} failed")
+    click.echo(f"Done: {total} invoices reprocessed, {total_failed} failed")
+
+
+@xml_cli.command('run-jobs')
+@click.option('--once', is_flag=True, help='Exit when no queued job is left.')
+def run_jobs(once):
+    """Runs queued async upload jobs (and recovers stale ones) in this process."""
+    app = current_app._get_current_object()
+    poll_interval = app.config.get('XML_JOB_POLL_INTERVAL', DEFAULT_JOB_POLL_INTERVAL)
+    total = 0
+    while True:
+        ran = process_queued_jobs(app, recover_always=False)
+        total += ran
+        if ran:
+            click.echo(f"Ran {total} jobs")
+        if once:
+            break
+        time.sleep(poll_interval)
+    click.echo(f"Done: {total} jobs")
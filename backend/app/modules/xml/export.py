@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""XML Module Export - Streaming, memory-bounded invoice exports"""
+import csv
+import io
+import logging
+import json
+import os
+import tempfile
+from sqlalchemy import select
+from app.extensions import db
+from .models import Invoice, InvoiceItem, InvoiceItemTax
+
+logger = logging.getLogger(__name__)
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 2000
+
+# Bytes per chunk when streaming a generated file to the client
+STREAM_CHUNK_SIZE = 64 * 1024
+
+SHEET_NAME = 'Detalle Facturas'
+
+# Fixed columns first, then dynamic tax columns, then item details, then UUID
+FIXED_COLUMNS_PRE = [
+    'Número Factura', 'Fecha', 'Emisor NIT', 'Emisor Nombre',
+    'Receptor NIT', 'Receptor Nombre', 'Forma Pago', 'Medio Pago',
+    'Total Factura'
+]
+ITEM_COLUMNS = [
+    'Descripción Ítem', 'Cantidad', 'Precio Unitario', 'Total Línea'
+]
+FIXED_COLUMNS_POST = ['UUID (CUFE)']
+
+# Numeric (float) columns besides the dynamic "Valor <tax>" ones
+NUMERIC_COLUMNS = {'Total Factura', 'Cantidad', 'Precio Unitario', 'Total Línea'}
+
+EXPORT_FORMATS = ('xlsx', 'csv', 'ndjson', 'parquet')
+
+
+def build_export_filters(date_from=None, date_to=None, issuer_nit=None, receiver_nit=None):
+    """
+    WHERE conditions on the invoices table shared by every export format.
+    Dates are inclusive and compared against issue_date.
+    """
+    invoices = Invoice.__table__
+    filters = []
+    if date_from:
+        filters.append(invoices.c.issue_date >= date_from)
+    if date_to:
+        filters.append(invoices.c.issue_date <= date_to)
+    if issuer_nit:
+        filters.append(invoices.c.issuer_nit == issuer_nit)
+    if receiver_nit:
+        filters.append(invoices.c.receiver_nit == receiver_nit)
+    return filters
+
+
+def discover_tax_keys(filters=()):
+    """
+    Unique tax keys (e.g. "IVA 19%") across the exported ITEMS, sorted for a
+    stable column order. A single DISTINCT over the indexed
+    invoice_item_taxes.tax_key column, no JSON decoding.
+    """
+    invoices = Invoice.__table__
+    taxes = InvoiceItemTax.__table__
+    stmt = select(taxes.c.tax_key).distinct()
+    if filters:
+        stmt = stmt.join(invoices, taxes.c.invoice_id == invoices.c.id).where(*filters)
+
+    sorted_tax_keys = sorted(db.session.execute(stmt).scalars())
+    logger.info(f"Found {len(sorted_tax_keys)} unique tax types in ITEMS: {sorted_tax_keys}")
+    return sorted_tax_keys
+
+
+def export_columns(tax_keys):
+    tax_columns = [f"Valor {tax_key}" for tax_key in tax_keys]
+    return FIXED_COLUMNS_PRE + tax_columns + ITEM_COLUMNS + FIXED_COLUMNS_POST
+
+
+def _flatten_row(row, item_taxes, tax_keys):
+    # Base row data (common invoice header fields)
+    values = [
+        row.invoice_number or row.uuid[:12],
+        row.issue_date.isoformat() if row.issue_date else '',
+        row.issuer_nit or '',
+        row.issuer_name or '',
+        row.receiver_nit or '',
+        row.receiver_name or '',
+        row.payment_form or '',
+        row.payment_method or '',
+        float(row.total_amount) if row.total_amount else 0,
+    ]
+
+    if row.item_id is None:
+        # Invoice without items: one row with empty item fields
+        values.extend(0 for _ in tax_keys)
+        values.extend(['', 0, 0, 0])
+    else:
+        values.extend(float(item_taxes.get(tax_key, 0)) for tax_key in tax_keys)
+        values.extend([
+            row.description or '',
+            float(row.quantity) if row.quantity else 0,
+            float(row.unit_price) if row.unit_price else 0,
+            float(row.total_line) if row.total_line else 0,
+        ])
+
+    values.append(row.uuid)
+    return values
+
+
+def iter_export_rows(tax_keys, filters=()):
+    """
+    FLATTENED FORMAT: yields one list per LINE ITEM (invoice header repeated),
+    in export_columns() order. Invoices without items produce a single row
+    with empty item fields. Each row only carries the taxes of THAT item
+    (sparse matrix).
+
+    Rows come from a single invoices LEFT JOIN invoice_items LEFT JOIN
+    invoice_item_taxes query read with a server-side cursor, so no ORM objects
+    and no full result set are kept. The tax rows of one item arrive
+    consecutively and are folded into that item's row.
+    """
+    invoices = Invoice.__table__
+    items = InvoiceItem.__table__
+    taxes = InvoiceItemTax.__table__
+    stmt = (
+        select(
+            invoices.c.id,
+            invoices.c.uuid,
+            invoices.c.invoice_number,
+            invoices.c.issue_date,
+            invoices.c.issuer_nit,
+            invoices.c.issuer_name,
+            invoices.c.receiver_nit,
+            invoices.c.receiver_name,
+            invoices.c.payment_form,
+            invoices.c.payment_method,
+            invoices.c.total_amount,
+            items.c.id.label('item_id'),
+            items.c.description,
+            items.c.quantity,
+            items.c.unit_price,
+            items.c.total_line,
+            taxes.c.tax_key,
+            taxes.c.amount.label('tax_value'),
+        )
+        .select_from(
+            invoices
+            .outerjoin(items, items.c.invoice_id == invoices.c.id)
+            .outerjoin(taxes, taxes.c.item_id == items.c.id)
+        )
+        .where(*filters)
+        .order_by(invoices.c.issue_date.desc(), invoices.c.id, items.c.id)
+        .execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE)
+    )
+
+    current_key = None
+    current_row = None
+    item_taxes = {}
+
+    for row in db.session.execute(stmt):
+        key = (row.id, row.item_id)
+        if key != current_key:
+            if current_row is not None:
+                yield _flatten_row(current_row, item_taxes, tax_keys)
+            current_key = key
+            current_row = row
+            item_taxes = {}
+        if row.tax_key is not None:
+            item_taxes[row.tax_key] = row.tax_value
+
+    if current_row is not None:
+        yield _flatten_row(current_row, item_taxes, tax_keys)
+
+
+def export_invoices_to_excel(output, filters=()):
+    """
+    Export invoices from database to an Excel file, one row per LINE ITEM.
+
+    DYNAMIC TAX COLUMNS: one "Valor <tax>" column per tax rate found in the
+    items (no empty columns); each row shows only the taxes of its own item.
+
+    Example:
+    Item       | Base   | Valor IVA 19% | Valor IVA 5%
+    ------------------------------------------------
+    Gaseosa    | 2000   | 380           | 0
+    Papas      | 1000   | 0             | 50
+
+    Uses openpyxl's write-only workbook: rows are streamed from the database
+    straight into the sheet, so memory stays flat whatever the row count.
+    `output` is a file path or a binary file object; `filters` comes from
+    build_export_filters(). Returns the number of data rows written.
+    """
+    # openpyxl is imported on first use: it is not needed to boot a worker
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Alignment, Border, Font, Side
+
+    try:
+        tax_keys = discover_tax_keys(filters)
+        columns = export_columns(tax_keys)
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(SHEET_NAME)
+
+        # Header styled like pandas' to_excel (bold, thin border, centered)
+        thin = Side(style='thin')
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(sheet, value=column)
+            cell.font = Font(bold=True)
+            cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+            cell.alignment = Alignment(horizontal='center', vertical='top')
+            header.append(cell)
+        sheet.append(header)
+
+        row_count = 0
+        for values in iter_export_rows(tax_keys, filters):
+            sheet.append(values)
+            row_count += 1
+
+        workbook.save(output)
+
+        logger.info(f"Generated Excel with {row_count} rows and {len(columns)} columns")
+        return row_count
+
+    except Exception as e:
+        logger.error(f"Error exporting to Excel: {e}")
+        raise
+
+
+def iter_csv_export(filters=(), rows_per_chunk=EXPORT_BATCH_SIZE):
+    """Streams the flattened export as UTF-8 CSV, a few thousand rows per chunk."""
+    tax_keys = discover_tax_keys(filters)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(export_columns(tax_keys))
+
+    pending = 0
+    for values in iter_export_rows(tax_keys, filters):
+        writer.writerow(values)
+        pending += 1
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_ndjson_export(filters=()):
+    """Streams the flattened export as newline-delimited JSON, one object per row."""
+    tax_keys = discover_tax_keys(filters)
+    columns = export_columns(tax_keys)
+    for values in iter_export_rows(tax_keys, filters):
+        yield (json.dumps(dict(zip(columns, values)), ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def export_invoices_to_parquet(output, filters=()):
+    """
+    Writes the flattened export as Parquet in row groups of EXPORT_BATCH_SIZE
+    rows (pyarrow columnar writer). Returns the number of data rows written.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Parquet export requires the 'pyarrow' package")
+
+    tax_keys = discover_tax_keys(filters)
+    columns = export_columns(tax_keys)
+    numeric = NUMERIC_COLUMNS.union(columns[len(FIXED_COLUMNS_PRE):len(FIXED_COLUMNS_PRE) + len(tax_keys)])
+    schema = pa.schema([
+        (column, pa.float64() if column in numeric else pa.string()) for column in columns
+    ])
+
+    def write_batch(writer, rows):
+        arrays = [
+            pa.array([row[idx] for row in rows], type=field.type)
+            for idx, field in enumerate(schema)
+        ]
+        writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    row_count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        rows = []
+        for values in iter_export_rows(tax_keys, filters):
+            rows.append(values)
+            if len(rows) >= EXPORT_BATCH_SIZE:
+                write_batch(writer, rows)
+                row_count += len(rows)
+                rows = []
+        if rows or not row_count:
+            write_batch(writer, rows)
+            row_count += len(rows)
+
+    logger.info(f"Generated Parquet with {row_count} rows and {len(columns)} columns")
+    return row_count
+
+
+def create_export_file(suffix):
+    """Reserves a temporary file for an export; the caller streams and removes it."""
+    handle, path = tempfile.mkstemp(prefix='invoices_export_', suffix=suffix)
+    os.close(handle)
+    return path
+
+
+def stream_file_and_remove(path, chunk_size=STREAM_CHUNK_SIZE):
+    """Yields a generated export in chunks, deleting it once sent (or aborted)."""
+    try:
+        with open(path, 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+"""
+XML Module Jobs - Background ingestion of large uploads
+
+The ingest_jobs table is the queue, no broker needed. An upload stores its
+files under XML_JOBS_DIR and records a 'queued' row. Job threads in every
+worker process (XML_JOB_WORKERS each, or a dedicated `flask xml run-jobs`
+process) claim queued rows with a conditional UPDATE, so each job runs
+exactly once whichever worker gets it. A running job refreshes locked_at
+(its heartbeat) and records the files it has processed; when a worker dies
+or is redeployed mid-job, the row goes stale and is queued again (or failed
+after MAX_JOB_ATTEMPTS), and the next run resumes after the last recorded
+file.
+
+XML_JOBS_DIR must survive restarts and be shared by every process that
+claims jobs (a volume). There is no default: without it uploads are
+ingested synchronously (see jobs_enabled). A claimed job whose files are
+missing fails.
+"""
+import json
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+from app.extensions import db
+from .models import IngestJob
+from .services import iter_upload_entries, process_xml_uploads
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_WORKERS = 2
+
+# Seconds an idle job thread waits before looking for queued jobs again
+DEFAULT_JOB_POLL_INTERVAL = 2
+
+# Seconds without heartbeat after which a running job is considered lost
+DEFAULT_JOB_STALE_AFTER = 120
+
+# Runs of a job (the first one included) before a lost job is failed instead of queued again
+MAX_JOB_ATTEMPTS = 3
+
+# Queued jobs looked at per claim attempt
+CLAIM_BATCH = 10
+
+MANIFEST_NAME = 'manifest.json'
+
+# Minimum seconds between two progress writes of the same job
+PROGRESS_INTERVAL = 1.0
+
+LOST_FILES_MSG = "Uploaded files are no longer available (XML_JOBS_DIR must be shared and persistent)"
+LOST_WORKER_MSG = "Worker stopped while running the job (no heartbeat)"
+
+_workers_pid = None
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+
+# When this process last looked for stale jobs (time.monotonic())
+_last_recovery = None
+_recovery_lock = threading.Lock()
+
+
+def worker_id():
+    """Identifies this process in ingest_jobs.locked_by (host and pid: forked workers differ)."""
+    return f"{socket.gethostname()}:{os.getpid()}"[:64]
+
+
+def jobs_enabled(app=None):
+    """Async uploads need XML_JOBS_DIR (shared, persistent storage for the pending files)."""
+    return bool((app or current_app).config.get('XML_JOBS_DIR'))
+
+
+def init_app(app):
+    """Job threads start in each worker process with its first request (never at import or in CLI commands)."""
+    if jobs_enabled(app) and app.config.get('XML_JOB_WORKERS', DEFAULT_JOB_WORKERS) > 0:
+        app.before_request(lambda: start_job_workers(app))
+
+
+def start_job_workers(app):
+    """Starts XML_JOB_WORKERS job threads in this process, once (again in a forked child)."""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        for index in range(app.config.get('XML_JOB_WORKERS', DEFAULT_JOB_WORKERS)):
+            threading.Thread(target=_job_worker, args=(app,), name=f'xml-job-{index}', daemon=True).start()
+
+
+def _recover_if_due(app):
+    """
+    recover_stale_jobs() at most every XML_JOB_STALE_AFTER / 4 seconds per
+    process, instead of on every poll of every job thread.
+    """
+    global _last_recovery
+    interval = app.config.get('XML_JOB_STALE_AFTER', DEFAULT_JOB_STALE_AFTER) / 4
+    with _recovery_lock:
+        now = time.monotonic()
+        if _last_recovery is not None and now - _last_recovery < interval:
+            return
+        _last_recovery = now
+    recover_stale_jobs()
+
+
+def _job_worker(app):
+    poll_interval = app.config.get('XML_JOB_POLL_INTERVAL', DEFAULT_JOB_POLL_INTERVAL)
+    while True:
+        try:
+            with app.app_context():
+                _recover_if_due(app)
+                job_id = claim_next_job()
+            if job_id:
+                run_ingest_job(app, job_id)
+                continue
+        except Exception as e:
+            logger.error(f"Ingest job worker error: {str(e)}", exc_info=True)
+        _wakeup.wait(poll_interval)
+        _wakeup.clear()
+
+
+def create_ingest_job(files):
+    """
+    Stores the uploaded files on disk and records a queued IngestJob, which
+    the next free job thread claims. Returns the job right away.
+    Only called when jobs_enabled().
+    """
+    job_id = uuid.uuid4().hex
+    job_dir = os.path.join(current_app.config['XML_JOBS_DIR'], job_id)
+    os.makedirs(job_dir, exist_ok=True)
+
+    # Files are stored by position; the manifest keeps the original names and order
+    filenames = []
+    for idx, file in enumerate(files):
+        file.save(os.path.join(job_dir, f"{idx:06d}"))
+        filenames.append(file.filename)
+    with open(os.path.join(job_dir, MANIFEST_NAME), 'w', encoding='utf-8') as fh:
+        json.dump(filenames, fh)
+
+    job = IngestJob(id=job_id, status='queued', total_files=len(filenames), storage_dir=job_dir)
+    db.session.add(job)
+    db.session.commit()
+
+    _wakeup.set()
+    logger.info(f"Ingest job {job_id} queued with {len(filenames)} file(s)")
+    return job
+
+
+def recover_stale_jobs(stale_after=None):
+    """
+    Running jobs whose heartbeat is older than XML_JOB_STALE_AFTER seconds:
+    queued again, or failed once they used MAX_JOB_ATTEMPTS runs.
+    Returns (requeued, failed).
+    """
+    if stale_after is None:
+        stale_after = current_app.config.get('XML_JOB_STALE_AFTER', DEFAULT_JOB_STALE_AFTER)
+    jobs = IngestJob.__table__
+    now = datetime.utcnow()
+    stale = (
+        jobs.c.status == 'running',
+        or_(jobs.c.locked_at < now - timedelta(seconds=stale_after), jobs.c.locked_at.is_(None)),
+    )
+    requeued = db.session.execute(
+        update(jobs).where(*stale, func.coalesce(jobs.c.attempts, 0) < MAX_JOB_ATTEMPTS)
+        .values(status='queued', locked_by=None, locked_at=None)
+    ).rowcount
+    failed = db.session.execute(
+        update(jobs).where(*stale)
+        .values(status='failed', error_msg=LOST_WORKER_MSG, locked_by=None, finished_at=now)
+    ).rowcount
+    db.session.commit()
+    if requeued or failed:
+        logger.warning(f"Recovered stale ingest jobs: {requeued} queued again, {failed} failed")
+    return requeued, failed
+
+
+def claim_next_job():
+    """
+    Claims the oldest queued job for this process and returns its id (None
+    if there is nothing to do). The UPDATE only succeeds while the row is
+    still queued, so two workers never claim the same job. An empty queue
+    costs one indexed SELECT (ix_ingest_jobs_status_created).
+    """
+    jobs = IngestJob.__table__
+    candidates = db.session.execute(
+        select(jobs.c.id).where(jobs.c.status == 'queued').order_by(jobs.c.created_at).limit(CLAIM_BATCH)
+    ).scalars().all()
+    for job_id in candidates:
+        now = datetime.utcnow()
+        # Progress of earlier attempts is kept: the job resumes after it
+        claimed = db.session.execute(
+            update(jobs).where(jobs.c.id == job_id, jobs.c.status == 'queued').values(
+                status='running', locked_by=worker_id(), locked_at=now,
+                started_at=func.coalesce(jobs.c.started_at, now),
+                attempts=func.coalesce(jobs.c.attempts, 0) + 1
+            )
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+    return None
+
+
+def process_queued_jobs(app, recover_always=True):
+    """
+    Recovers stale jobs (with recover_always=False only when due, for
+    callers that poll), then runs queued jobs in the calling thread until
+    none is left; returns how many ran.
+    """
+    with app.app_context():
+        if recover_always:
+            recover_stale_jobs()
+        else:
+            _recover_if_due(app)
+    count = 0
+    while True:
+        with app.app_context():
+            job_id = claim_next_job()
+        if job_id is None:
+            return count
+        run_ingest_job(app, job_id)
+        count += 1
+
+
+# Job counter of each per-file status
+_COUNTERS = {'success': 'uploaded', 'skipped': 'skipped', 'error': 'errors'}
+
+
+def _resume_position(details, filenames):
+    """
+    Where a job resumes: (index of the first stored file to read, entries of
+    it to skip). Details follow upload order; an archive reports one detail
+    per member ("<archive>/<member>"), so one cut short mid-archive is read
+    again past the members already recorded.
+    """
+    position, members = 0, 0
+    for detail in details:
+        name = detail['filename']
+        if members and not name.startswith(filenames[position] + '/'):
+            position, members = position + 1, 0
+        if name == filenames[position]:
+            position += 1
+        else:
+            members += 1
+    return position, members
+
+
+def _stored_uploads(job_dir, filenames, start=0):
+    for idx, filename in enumerate(filenames[start:], start=start):
+        with open(os.path.join(job_dir, f"{idx:06d}"), 'rb') as fh:
+            yield filename, fh
+
+
+def _save_progress(job_id, **values):
+    db.session.execute(
+        update(IngestJob.__table__).where(IngestJob.__table__.c.id == job_id).values(**values)
+    )
+    db.session.commit()
+
+
+def _heartbeat(app, job_id, owner, stop, interval):
+    """Refreshes locked_at of a running job every `interval` seconds until `stop` is set."""
+    jobs = IngestJob.__table__
+    while not stop.wait(interval):
+        try:
+            with app.app_context():
+                db.session.execute(
+                    update(jobs).where(jobs.c.id == job_id, jobs.c.locked_by == owner)
+                    .values(locked_at=datetime.utcnow())
+                )
+                db.session.commit()
+        except Exception as e:
+            logger.warning(f"Heartbeat of ingest job {job_id} failed: {str(e)}")
+
+
+def _finish_job(job_id, **values):
+    """
+    Final status write. Returns False when it cannot be saved: the job then
+    stays 'running' and is recovered once its heartbeat goes stale.
+    """
+    try:
+        _save_progress(job_id, locked_by=None, finished_at=datetime.utcnow(), **values)
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Could not record the end of ingest job {job_id}: {str(e)}", exc_info=True)
+        return False
+
+
+def run_ingest_job(app, job_id):
+    """Processes a claimed job through the regular upload pipeline, reporting progress as it goes."""
+    with app.app_context():
+        job = db.session.get(IngestJob, job_id)
+        owner = worker_id()
+        if job is None or job.status != 'running' or job.locked_by != owner:
+            logger.error(f"Ingest job {job_id} is not claimed by this worker")
+            return
+
+        job_dir = job.storage_dir
+        # Files recorded by an earlier attempt are not ingested again
+        details = json.loads(job.details) if job.details else []
+        counts = {'processed': len(details), 'uploaded': 0, 'skipped': 0, 'errors': 0}
+        for detail in details:
+            counts[_COUNTERS.get(detail['status'], 'errors')] += 1
+        finished = False
+
+        stale_after = app.config.get('XML_JOB_STALE_AFTER', DEFAULT_JOB_STALE_AFTER)
+        stop = threading.Event()
+        threading.Thread(
+            target=_heartbeat, args=(app, job_id, owner, stop, max(1, stale_after / 4)),
+            name=f'xml-job-heartbeat-{job_id[:8]}', daemon=True
+        ).start()
+
+        try:
+            manifest = os.path.join(job_dir or '', MANIFEST_NAME)
+            if not os.path.isfile(manifest):
+                logger.error(f"Ingest job {job_id}: files not found in {job_dir}")
+                finished = _finish_job(job_id, status='failed', error_msg=LOST_FILES_MSG)
+                return
+
+            with open(manifest, encoding='utf-8') as fh:
+                filenames = json.load(fh)
+
+            if details:
+                logger.info(f"Ingest job {job_id} resumes after {len(details)} processed file(s)")
+            last_write = time.monotonic()
+            start, skip = _resume_position(details, filenames)
+            entries = islice(iter_upload_entries(_stored_uploads(job_dir, filenames, start)), skip, None)
+            for filename, res in process_xml_uploads(entries):
+                counts['processed'] += 1
+                counts[_COUNTERS.get(res['status'], 'errors')] += 1
+                details.append({"filename": filename, "status": res['status'], "msg": res['msg']})
+
+                if time.monotonic() - last_write >= PROGRESS_INTERVAL:
+                    _save_progress(job_id, locked_at=datetime.utcnow(), details=json.dumps(details), **counts)
+                    last_write = time.monotonic()
+
+            finished = _finish_job(job_id, status='done', details=json.dumps(details), **counts)
+            if finished:
+                logger.info(f"Ingest job {job_id} done: {counts['uploaded']} uploaded, {counts['skipped']} skipped, {counts['errors']} errors")
+
+        except Exception as e:
+            # The session may be unusable after the failure: roll back before the status write
+            db.session.rollback()
+            logger.error(f"Ingest job {job_id} failed: {str(e)}", exc_info=True)
+            finished = _finish_job(
+                job_id, status='failed', error_msg=str(e), details=json.dumps(details), **counts
+            )
+
+        finally:
+            stop.set()
+            # Unrecorded outcome: keep the files, the job will run again
+            if finished and job_dir:
+                shutil.rmtree(job_dir, ignore_errors=True)
@@ -1,11 +1,27 @@
 # -*- coding: utf-8 -*-
 """XML Module Data Models"""
+from sqlalchemy import DDL, event
 from app.extensions import db
 from datetime import datetime
 import json
 
 class Invoice(db.Model):
     __tablename__ = 'invoices'
+    __table_args__ = (
+        # Keyset pagination of /api/xml/list (newest first)
+        db.Index('ix_invoices_created_at_id', 'created_at', 'id'),
+        # /api/xml/search filters (results ordered by issue_date)
+        db.Index('ix_invoices_issue_date', 'issue_date'),
+        db.Index('ix_invoices_issuer_nit_issue_date', 'issuer_nit', 'issue_date'),
+        db.Index('ix_invoices_receiver_nit_issue_date', 'receiver_nit', 'issue_date'),
+        db.Index('ix_invoices_payment_form_issue_date', 'payment_form', 'issue_date'),
+        db.Index('ix_invoices_total_amount', 'total_amount'),
+        # /api/reconcile candidate query: a date range answered from the index alone
+        db.Index(
+            'ix_invoices_reconcile',
+            'issue_date', 'invoice_number', 'total_amount', 'tax_amount', 'issuer_nit', 'receiver_nit'
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     uuid = db.Column(db.String(255), unique=True, nullable=False)  # CUFE (UUID técnico)
@@ -29,24 +45,21 @@ class Invoice(db.Model):
     payment_method = db.Column(db.String(50), nullable=True)  # Code: "48", "10", etc.
     json_taxes = db.Column(db.Text, nullable=True)  # JSON: {"IVA 19%": 1000, "INC": 50}
     
-    xml_content = db.Column(db.Text, nullable=True)
+    # Original XML, compressed (see storage.py). Deferred: loaded only when accessed
+    xml_content = db.deferred(db.Column(db.LargeBinary(length=4294967295), nullable=True))
+    xml_codec = db.Column(db.String(10), nullable=True)  # "zstd" | "zlib" (NULL = not stored)
+    content_sha256 = db.Column(db.String(64), index=True, nullable=True)  # SHA-256 of the uploaded file (duplicate pre-filter)
     
     # Relationship: One Invoice -> Many Items
     items = db.relationship('InvoiceItem', backref='invoice', lazy=True, cascade='all, delete-orphan')
 
 
-    def to_dict(self):
-        taxes_dict = {}
-        if self.json_taxes:
-            try:
-                taxes_dict = json.loads(self.json_taxes)
-            except:
-                pass
-                
+    def to_summary_dict(self):
+        """Compact representation for listings: header fields only, no items, no tax JSON."""
         return {
             'id': self.id,
             'uuid': self.uuid,
-            'invoice_number': self.invoice_number,  # NEW: Human-readable ID
+            'invoice_number': self.invoice_number,
             'issuer_nit': self.issuer_nit,
             'issuer_name': self.issuer_name,
             'receiver_nit': self.receiver_nit,
@@ -57,14 +70,33 @@ class Invoice(db.Model):
             'issue_date': self.issue_date.isoformat() if self.issue_date else None,
             'payment_form': self.payment_form,
             'payment_method': self.payment_method,
-            'taxes': taxes_dict,
-            'items': [item.to_dict() for item in self.items],  # NEW: Include line items
             'created_at': self.created_at.isoformat()
         }
 
+    def to_dict(self, include_items=True, include_taxes=True):
+        data = self.to_summary_dict()
+
+        if include_taxes:
+            taxes_dict = {}
+            if self.json_taxes:
+                try:
+                    taxes_dict = json.loads(self.json_taxes)
+                except:
+                    pass
+            data['taxes'] = taxes_dict
+
+        if include_items:
+            data['items'] = [item.to_dict(include_taxes=include_taxes) for item in self.items]  # NEW: Include line items
+
+        return data
+
 
 class InvoiceItem(db.Model):
     __tablename__ = 'invoice_items'
+    __table_args__ = (
+        # Full-text search of /api/xml/search?q= (SQLite uses the FTS5 table below)
+        db.Index('ft_invoice_items_description', 'description', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
@@ -76,20 +108,170 @@ class InvoiceItem(db.Model):
     # NEW: Tax information at LINE level (not invoice level)
     json_taxes = db.Column(db.Text, nullable=True)  # JSON: {"IVA 19%": 380, "INC 8%": 50}
     
-    def to_dict(self):
-        taxes_dict = {}
-        if self.json_taxes:
-            try:
-                taxes_dict = json.loads(self.json_taxes)
-            except:
-                pass
-                
-        return {
+    # Normalized copy of json_taxes, one row per tax (queried with SQL)
+    taxes = db.relationship('InvoiceItemTax', backref='item', lazy=True, cascade='all, delete-orphan')
+    
+    def to_dict(self, include_taxes=True):
+        data = {
             'id': self.id,
             'invoice_id': self.invoice_id,
             'description': self.description,
             'quantity': float(self.quantity) if self.quantity else 0,
             'unit_price': float(self.unit_price) if self.unit_price else 0,
             'total_line': float(self.total_line) if self.total_line else 0,
-            'taxes': taxes_dict  # NEW: Tax breakdown per item
         }
+
+        if include_taxes:
+            taxes_dict = {}
+            if self.json_taxes:
+                try:
+                    taxes_dict = json.loads(self.json_taxes)
+                except:
+                    pass
+            data['taxes'] = taxes_dict  # NEW: Tax breakdown per item
+
+        return data
+
+
+# SQLite (development): external-content FTS5 table over invoice_items.description,
+# kept in sync by triggers, so bulk Core inserts and deletes are indexed too
+INVOICE_ITEMS_FTS_TABLE = 'invoice_items_fts'
+
+INVOICE_ITEMS_FTS_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {INVOICE_ITEMS_FTS_TABLE} "
+    "USING fts5(description, content='invoice_items', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ai AFTER INSERT ON invoice_items BEGIN "
+    f"INSERT INTO {INVOICE_ITEMS_FTS_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_items_fts_ad AFTER DELETE ON invoice_items BEGIN "
+    f"INSERT INTO {INVOICE_ITEMS_FTS_TABLE}({INVOICE_ITEMS_FTS_TABLE}, rowid, description) "
+    "VALUES ('delete', old.id, old.description); END",
+    f"CREATE TRIGGER IF NOT EXISTS invoice_items_fts_au AFTER UPDATE OF description ON invoice_items BEGIN "
+    f"INSERT INTO {INVOICE_ITEMS_FTS_TABLE}({INVOICE_ITEMS_FTS_TABLE}, rowid, description) "
+    "VALUES ('delete', old.id, old.description); "
+    f"INSERT INTO {INVOICE_ITEMS_FTS_TABLE}(rowid, description) VALUES (new.id, new.description); END",
+)
+
+for _statement in INVOICE_ITEMS_FTS_DDL:
+    event.listen(InvoiceItem.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+
+
+class InvoiceItemTax(db.Model):
+    """One tax of one line item; normalized form of InvoiceItem.json_taxes."""
+    __tablename__ = 'invoice_item_taxes'
+    __table_args__ = (
+        db.Index('ix_invoice_item_taxes_tax_key', 'tax_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('invoice_items.id'), index=True, nullable=False)
+    invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), index=True, nullable=False)  # Denormalized for per-invoice queries
+
+    scheme_name = db.Column(db.String(100), nullable=False)  # "IVA", "INC"
+    percent = db.Column(db.Numeric(7, 3), nullable=True)  # 19.000 (NULL when the XML has no percent)
+    tax_key = db.Column(db.String(120), nullable=False)  # Same key as in json_taxes: "IVA 19.00%"
+    amount = db.Column(db.Numeric(18, 4), default=0.0)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'item_id': self.item_id,
+            'invoice_id': self.invoice_id,
+            'scheme_name': self.scheme_name,
+            'percent': float(self.percent) if self.percent is not None else None,
+            'tax_key': self.tax_key,
+            'amount': float(self.amount) if self.amount else 0
+        }
+
+
+class InvoiceRollup(db.Model):
+    """
+    Pre-aggregated invoice totals per (month, issuer, receiver), kept up to
+    date on ingest and delete. Empty string = no date / no NIT.
+    """
+    __tablename__ = 'invoice_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('period', 'issuer_nit', 'receiver_nit', name='uq_invoice_rollups_group'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, default='')  # "2024-03"
+    issuer_nit = db.Column(db.String(50), nullable=False, default='')
+    receiver_nit = db.Column(db.String(50), nullable=False, default='')
+
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    base_amount = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    tax_amount = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+    total_amount = db.Column(db.Numeric(20, 2), nullable=False, default=0)
+
+
+class InvoiceTaxRollup(db.Model):
+    """Pre-aggregated item taxes per (month, issuer, receiver, tax_key)."""
+    __tablename__ = 'invoice_tax_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('period', 'issuer_nit', 'receiver_nit', 'tax_key', name='uq_invoice_tax_rollups_group'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, default='')
+    issuer_nit = db.Column(db.String(50), nullable=False, default='')
+    receiver_nit = db.Column(db.String(50), nullable=False, default='')
+    tax_key = db.Column(db.String(120), nullable=False)  # "IVA 19.00%"
+
+    tax_count = db.Column(db.Integer, nullable=False, default=0)  # Item taxes aggregated
+    amount = db.Column(db.Numeric(20, 4), nullable=False, default=0)
+
+
+class IngestJob(db.Model):
+    """Background XML ingestion job (async uploads). Progress lives here, no broker needed."""
+    __tablename__ = 'ingest_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued | running | done | failed
+
+    # Claim of a running job: the worker holding it and its last heartbeat
+    locked_by = db.Column(db.String(64), nullable=True)  # "host:pid"
+    locked_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0)  # Times the job was claimed
+
+    total_files = db.Column(db.Integer, default=0)
+    processed = db.Column(db.Integer, default=0)
+    uploaded = db.Column(db.Integer, default=0)
+    skipped = db.Column(db.Integer, default=0)
+    errors = db.Column(db.Integer, default=0)
+
+    details = db.Column(db.Text(16777215), nullable=True)  # JSON list, same shape as the sync upload "details"
+    error_msg = db.Column(db.Text, nullable=True)  # Job-level failure
+    storage_dir = db.Column(db.String(500), nullable=True)  # Where the uploaded files wait to be processed
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_ingest_jobs_status_created', 'status', 'created_at'),  # Workers' claim query
+    )
+
+    def to_dict(self, include_details=True):
+        data = {
+            'id': self.id,
+            'status': self.status,
+            'total_files': self.total_files or 0,
+            'processed': self.processed or 0,
+            'uploaded': self.uploaded or 0,
+            'skipped': self.skipped or 0,
+            'errors': self.errors or 0,
+            'attempts': self.attempts or 0,
+            'error_msg': self.error_msg,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if include_details:
+            details = []
+            if self.details:
+                try:
+                    details = json.loads(self.details)
+                except:
+                    pass
+            data['details'] = details
+        return data
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""XML Module Parser - Single-pass DIAN UBL 2.1 engine
+
+The invoice is walked exactly once. Every field the old per-field XPath
+queries (`.//cbc:UUID`, `.//cac:TaxTotal/cac:TaxSubtotal`, ...) used to look
+up is matched against the current tag path while walking, keeping the same
+"first match in document order" semantics, so the output is identical to the
+query-per-field implementation but the cost is linear in the number of nodes.
+"""
+import logging
+import io
+import json
+from datetime import datetime
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Namespaces typically used in UBL 2.1 / DIAN
+NAMESPACES = {
+    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
+    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
+    'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2',
+    'ad': 'urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2',
+}
+
+# Mapping for payment form codes
+PAYMENT_FORM_MAP = {
+    '1': 'Contado',
+    '2': 'Crédito'
+}
+
+# The only lookup that still runs as an XPath query: it happens once per
+# AttachedDocument, before the inner invoice is walked.
+ATTACHED_DESCRIPTION_XPATH = etree.XPath(
+    ".//cac:Attachment/cac:ExternalReference/cbc:Description", namespaces=NAMESPACES
+)
+
+ATTACHED_DOCUMENT_LOCALNAME = 'AttachedDocument'
+
+# Characters of the embedded invoice fed to the pull parser per call
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def _clark(path):
+    """'cac:Price/cbc:PriceAmount' -> tuple of Clark-notation tags."""
+    tags = []
+    for step in path.split('/'):
+        prefix, local = step.split(':')
+        tags.append('{%s}%s' % (NAMESPACES[prefix], local))
+    return tuple(tags)
+
+
+def _compile(rules):
+    """
+    Index (slot, path, anchored) rules by their last tag so each element only
+    checks the rules that can possibly match it.
+    anchored=True means a direct child of the scope root ("./x"); otherwise
+    the path may start at any descendant (".//a/b/x").
+    """
+    index = {}
+    for slot, path, anchored in rules:
+        tags = _clark(path)
+        ancestors = tuple(reversed(tags[:-1]))  # nearest parent first
+        index.setdefault(tags[-1], []).append((slot, ancestors, anchored))
+    return index
+
+
+HEADER_FIELDS = _compile([
+    ('uuid', 'cbc:UUID', False),
+    ('invoice_number', 'cbc:ID', True),  # Direct child of Invoice root
+    ('any_id', 'cbc:ID', False),
+    ('issue_date', 'cbc:IssueDate', False),
+    ('total_amount', 'cac:LegalMonetaryTotal/cbc:PayableAmount', False),
+    ('tax_amount', 'cac:TaxTotal/cbc:TaxAmount', False),
+    ('base_amount', 'cac:LegalMonetaryTotal/cbc:LineExtensionAmount', False),
+    ('issuer_nit', 'cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', False),
+    ('issuer_name', 'cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName', False),
+    ('issuer_party_name', 'cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name', False),
+    ('receiver_nit', 'cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID', False),
+    ('receiver_name', 'cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName', False),
+    ('receiver_party_name', 'cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name', False),
+    ('payment_form_code', 'cac:PaymentMeans/cbc:ID', False),
+    ('payment_method', 'cac:PaymentMeans/cbc:PaymentMeansCode', False),
+])
+
+SUBTOTAL_FIELDS = _compile([
+    ('name', 'cac:TaxCategory/cac:TaxScheme/cbc:Name', False),
+    ('percent', 'cac:TaxCategory/cbc:Percent', False),
+    ('value', 'cbc:TaxAmount', False),
+])
+
+LINE_FIELDS = _compile([
+    ('description', 'cac:Item/cbc:Description', False),
+    ('quantity', 'cbc:InvoicedQuantity', False),
+    ('unit_price', 'cac:Price/cbc:PriceAmount', False),
+    ('total_line', 'cbc:LineExtensionAmount', False),
+])
+
+# AttachedDocument wrapper: where the embedded invoice is
+ATTACHED_FIELDS = _compile([
+    ('description', 'cac:Attachment/cac:ExternalReference/cbc:Description', False),
+])
+
+# Child scopes: a TaxSubtotal is opened from the header (all subtotals in the
+# document, including the ones inside lines) and from each InvoiceLine.
+SUBTOTAL_OPENER = _compile([('subtotals', 'cac:TaxTotal/cac:TaxSubtotal', False)])
+LINE_OPENER = _compile([('lines', 'cac:InvoiceLine', False)])
+
+# Tags that can match anything at all; every other element is only pushed/popped
+RELEVANT_TAGS = frozenset().union(
+    HEADER_FIELDS, SUBTOTAL_FIELDS, LINE_FIELDS, SUBTOTAL_OPENER, LINE_OPENER
+)
+
+
+def _matches(tags, root_depth, ancestors, anchored):
+    depth = len(tags) - 1
+    if anchored:
+        return depth == root_depth + 1
+    # The first step of the path must be a strict descendant of the scope root
+    if depth - len(ancestors) <= root_depth:
+        return False
+    for offset, tag in enumerate(ancestors, start=1):
+        if tags[depth - offset] != tag:
+            return False
+    return True
+
+
+class _Scope:
+    """Values collected below one element (invoice root, line or subtotal)."""
+    __slots__ = ('fields', 'openers', 'root_depth', 'values', 'subtotals', 'lines')
+
+    def __init__(self, fields, openers, root_depth):
+        self.fields = fields
+        self.openers = openers
+        self.root_depth = root_depth
+        self.values = {}
+        self.subtotals = []
+        self.lines = []
+
+
+class InvoiceCollector:
+    """
+    Consumes ('start', element) / ('end', element) events and fills the
+    invoice header, tax subtotals and lines in a single pass.
+    Works with any event source: etree.iterwalk() over an in-memory tree or
+    etree.iterparse() over a stream.
+    """
+
+    def __init__(self):
+        self.header = None
+        self._tags = []
+        self._claims = []
+        self._scopes = []
+
+    def start(self, element):
+        tag = element.tag
+        self._tags.append(tag)
+        tags = self._tags
+
+        if self.header is None:
+            self.header = _Scope(HEADER_FIELDS, (SUBTOTAL_OPENER, LINE_OPENER), len(tags) - 1)
+            self._scopes.append(self.header)
+            self._claims.append(None)
+            return
+
+        if tag not in RELEVANT_TAGS:
+            self._claims.append(None)
+            return
+
+        # 1. Claim first-in-document-order slots of every active scope
+        claims = None
+        for scope in self._scopes:
+            rules = scope.fields.get(tag)
+            if not rules:
+                continue
+            for slot, ancestors, anchored in rules:
+                if slot not in scope.values and _matches(tags, scope.root_depth, ancestors, anchored):
+                    scope.values[slot] = None
+                    if claims is None:
+                        claims = []
+                    claims.append((scope, slot))
+        self._claims.append(claims)
+
+        # 2. Open child scopes rooted at this element
+        new_scope = None
+        for scope in self._scopes:
+            for opener in scope.openers:
+                rules = opener.get(tag)
+                if not rules:
+                    continue
+                slot, ancestors, anchored = rules[0]
+                if not _matches(tags, scope.root_depth, ancestors, anchored):
+                    continue
+                if new_scope is None:
+                    depth = len(tags) - 1
+                    if slot == 'subtotals':
+                        new_scope = _Scope(SUBTOTAL_FIELDS, (), depth)
+                    else:
+                        new_scope = _Scope(LINE_FIELDS, (SUBTOTAL_OPENER,), depth)
+                getattr(scope, slot).append(new_scope)
+        if new_scope is not None:
+            self._scopes.append(new_scope)
+
+    def end(self, element):
+        claims = self._claims.pop()
+        if claims:
+            text = element.text
+            for scope, slot in claims:
+                scope.values[slot] = text
+
+        depth = len(self._tags) - 1
+        while self._scopes and self._scopes[-1].root_depth == depth:
+            self._scopes.pop()
+        self._tags.pop()
+
+    def feed(self, events):
+        for event, element in events:
+            if not isinstance(element.tag, str):
+                continue  # Comments / processing instructions
+            if event == 'start':
+                self.start(element)
+            else:
+                self.end(element)
+
+    def result(self):
+        """Builds the parse_xml_invoice dictionary (None if there is no UUID)."""
+        header = self.header
+        values = header.values if header is not None else {}
+
+        uuid = values.get('uuid')
+        if not uuid:
+            logger.warning("No UUID found in XML.")
+            return None
+
+        invoice_number = values.get('invoice_number') or values.get('any_id')
+        logger.info(f"Extracted Invoice Number: {invoice_number}, UUID: {uuid[:12]}...")
+
+        issue_date_str = values.get('issue_date')
+        issue_date = None
+        if issue_date_str:
+            try:
+                issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d').date()
+            except ValueError:
+                pass
+
+        total_amount = float(values.get('total_amount') or 0)
+        tax_amount = float(values.get('tax_amount') or 0)
+        base_amount = float(values.get('base_amount') or 0)
+
+        issuer_name = values.get('issuer_name') or values.get('issuer_party_name')
+        receiver_name = values.get('receiver_name') or values.get('receiver_party_name')
+
+        payment_form_code = values.get('payment_form_code')
+        payment_form = PAYMENT_FORM_MAP.get(payment_form_code, payment_form_code) if payment_form_code else None
+
+        taxes_dict = _taxes_from_subtotals(header.subtotals)
+        json_taxes = json.dumps(taxes_dict) if taxes_dict else None
+
+        items = []
+        for line in header.lines:
+            line_values = line.values
+            quantity = line_values.get('quantity')
+            unit_price = line_values.get('unit_price')
+            total_line = line_values.get('total_line')
+            line_taxes = _taxes_from_subtotals(line.subtotals)
+
+            items.append({
+                "description": line_values.get('description') or "Sin descripción",
+                "quantity": float(quantity) if quantity else 0,
+                "unit_price": float(unit_price) if unit_price else 0,
+                "total_line": float(total_line) if total_line else 0,
+                "json_taxes": json.dumps(line_taxes) if line_taxes else None
+            })
+
+        return {
+            "uuid": uuid,
+            "invoice_number": invoice_number,
+            "issue_date": issue_date,
+            "total_amount": total_amount,
+            "tax_amount": tax_amount,
+            "base_amount": base_amount,
+            "issuer_nit": values.get('issuer_nit'),
+            "issuer_name": issuer_name,
+            "receiver_nit": values.get('receiver_nit'),
+            "receiver_name": receiver_name,
+            "payment_form": payment_form,
+            "payment_method": values.get('payment_method'),
+            "json_taxes": json_taxes,
+            "items": items
+        }
+
+
+def _taxes_from_subtotals(subtotals):
+    taxes = {}
+    for subtotal in subtotals:
+        tax_name = subtotal.values.get('name')
+        tax_percent = subtotal.values.get('percent')
+        tax_value = subtotal.values.get('value')
+
+        if tax_name and tax_value:
+            # Create key like "IVA 19%" or just "IVA" if no percent
+            key = f"{tax_name} {tax_percent}%" if tax_percent else tax_name
+            taxes[key] = float(tax_value)
+    return taxes
+
+
+def parse_xml_invoice(file_content):
+    """
+    Parses a DIAN XML (Invoice or AttachedDocument) and returns a dictionary of fields.
+    Includes payment methods, tax breakdown, and line items.
+    Returns None if parsing fails or valid data isn't found.
+    """
+    try:
+        parser = etree.XMLParser(recover=True, huge_tree=True)
+        tree = etree.fromstring(file_content, parser)
+
+        # 1. Handle AttachedDocument (The "Trap")
+        root_tag = etree.QName(tree).localname
+
+        if root_tag == 'AttachedDocument':
+            logger.info("AttachedDocument detected. Extracting inner XML...")
+            description_nodes = ATTACHED_DESCRIPTION_XPATH(tree)
+
+            if not description_nodes:
+                logger.warning("AttachedDocument found but no Description node with CDATA.")
+                return None
+
+            inner_xml_str = description_nodes[0].text
+            if not inner_xml_str:
+                return None
+
+            tree = etree.fromstring(inner_xml_str.encode('utf-8'), parser)
+
+        # 2. Single walk over the invoice
+        collector = InvoiceCollector()
+        collector.feed(etree.iterwalk(tree, events=('start', 'end')))
+        return collector.result()
+
+    except Exception as e:
+        logger.error(f"Error parsing XML: {e}")
+        return None
+
+
+def _release(element):
+    """Frees an element (and the already processed siblings before it) once its 'end' event is consumed."""
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _stream_events(events, collector):
+    for event, element in events:
+        if event == 'start':
+            collector.start(element)
+        else:
+            collector.end(element)
+            _release(element)
+
+
+def _parse_embedded_invoice(inner_xml_str):
+    """
+    Streams the invoice embedded in an AttachedDocument.
+    The CDATA string is fed to a pull parser in slices, so it is never
+    re-encoded into a second full copy and never becomes a full tree.
+    """
+    parser = etree.XMLPullParser(events=('start', 'end'), recover=True, huge_tree=True)
+    collector = InvoiceCollector()
+    for offset in range(0, len(inner_xml_str), STREAM_CHUNK_SIZE):
+        parser.feed(inner_xml_str[offset:offset + STREAM_CHUNK_SIZE])
+        _stream_events(parser.read_events(), collector)
+    parser.close()
+    _stream_events(parser.read_events(), collector)
+    return collector.result()
+
+
+def parse_xml_invoice_stream(source):
+    """
+    Streaming variant of parse_xml_invoice for very large documents.
+    `source` is a binary file-like object (or bytes). Elements are cleared as
+    soon as they have been consumed, so peak memory does not grow with the
+    number of InvoiceLine elements. Returns the same dictionary (or None).
+    """
+    try:
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+
+        events = etree.iterparse(source, events=('start', 'end'), recover=True, huge_tree=True)
+        collector = None
+        attached = None
+        tags = []
+        claimed = False
+
+        for event, element in events:
+            if event == 'start':
+                tags.append(element.tag)
+                if collector is None and attached is None:
+                    # 1. Root element decides the mode
+                    if etree.QName(element).localname == ATTACHED_DOCUMENT_LOCALNAME:
+                        logger.info("AttachedDocument detected. Extracting inner XML (streaming)...")
+                        attached = True
+                    else:
+                        collector = InvoiceCollector()
+                        collector.start(element)
+                    continue
+                if collector is not None:
+                    collector.start(element)
+                elif not claimed:
+                    for slot, ancestors, anchored in ATTACHED_FIELDS.get(element.tag, ()):
+                        if _matches(tags, 0, ancestors, anchored):
+                            claimed = len(tags)
+                continue
+
+            # 'end' event
+            if collector is not None:
+                collector.end(element)
+            elif claimed and claimed == len(tags):
+                # 2. First cbc:Description: the outer document is not needed anymore
+                inner_xml_str = element.text
+                if not inner_xml_str:
+                    return None
+                return _parse_embedded_invoice(inner_xml_str)
+            tags.pop()
+            _release(element)
+
+        if attached:
+            logger.warning("AttachedDocument found but no Description node with CDATA.")
+            return None
+        if collector is None:
+            return None
+        return collector.result()
+
+    except Exception as e:
+        logger.error(f"Error parsing XML (streaming): {e}")
+        return None
+
+
+def parse_xml_content(content, streaming_threshold=None):
+    """
+    Parses raw XML bytes with the engine that fits their size.
+    Top-level (picklable) so it can run inside a process pool worker.
+    """
+    if streaming_threshold is not None and len(content) > streaming_threshold:
+        return parse_xml_invoice_stream(content)
+    return parse_xml_invoice(content)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+XML Module Queries - Read statements shared by the sync and async endpoints
+
+The Flask routes run these statements on db.session; the async endpoints
+(app/asgi.py) run the very same ones on an AsyncSession. Only execution
+differs, so both modes always answer identically.
+"""
+import math
+from datetime import datetime
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import defer, selectinload
+from .models import Invoice, InvoiceItem
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+
+def _int_arg(args, name, default):
+    """Integer query argument; malformed values fall back to `default` (like request.args.get(type=int))."""
+    try:
+        return int(args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _parse_include(value):
+    return {part.strip() for part in (value or '').split(',') if part.strip()}
+
+
+def parse_list_cursor(value):
+    """'<created_at ISO>,<id>' -> (datetime, int); raises ValueError if malformed."""
+    created_at, _, invoice_id = value.rpartition(',')
+    return datetime.fromisoformat(created_at), int(invoice_id)
+
+
+def make_list_cursor(invoice):
+    return f"{invoice.created_at.isoformat()},{invoice.id}"
+
+
+def _parse_list_cursor_arg(after):
+    if not after:
+        return None
+    try:
+        return parse_list_cursor(after)
+    except ValueError:
+        raise ValueError("Invalid cursor")
+
+
+def parse_list_args(args):
+    """
+    Options of /api/xml/list from a query string mapping; page is at least 1
+    and per_page within 1..MAX_PER_PAGE (like /api/xml/search).
+    Raises ValueError("Invalid cursor") for a malformed ?after=.
+    """
+    include = _parse_include(args.get('include'))
+    after = args.get('after')
+    return {
+        'page': max(_int_arg(args, 'page', 1), 1),
+        'per_page': min(max(_int_arg(args, 'per_page', DEFAULT_PER_PAGE), 1), MAX_PER_PAGE),
+        'after': after,
+        'cursor': _parse_list_cursor_arg(after),
+        'with_count': bool(_int_arg(args, 'count', 1)),
+        'include_items': 'items' in include,
+        'include_taxes': 'taxes' in include,
+    }
+
+
+def list_statement(options):
+    """
+    One page (+1 row to detect has_more) of invoices, newest first, for
+    parse_list_args() options. Keyset when a cursor is given, else offset.
+    """
+    per_page = options['per_page']
+    # Sort by created_at desc (id breaks ties so both modes are stable)
+    stmt = select(Invoice).order_by(Invoice.created_at.desc(), Invoice.id.desc())
+    if options['include_items']:
+        items_loader = selectinload(Invoice.items)
+        if not options['include_taxes']:
+            items_loader = items_loader.defer(InvoiceItem.json_taxes)
+        stmt = stmt.options(items_loader)
+    if not options['include_taxes']:
+        stmt = stmt.options(defer(Invoice.json_taxes))
+
+    if options['cursor'] is not None:
+        cursor_created_at, cursor_id = options['cursor']
+        stmt = stmt.where(or_(
+            Invoice.created_at < cursor_created_at,
+            and_(Invoice.created_at == cursor_created_at, Invoice.id < cursor_id)
+        ))
+        return stmt.limit(per_page + 1)
+    return stmt.offset((options['page'] - 1) * per_page).limit(per_page + 1)
+
+
+def list_response(options, invoices, total):
+    """JSON body of /api/xml/list from the rows of list_statement()."""
+    per_page = options['per_page']
+    has_more = len(invoices) > per_page
+    invoices = invoices[:per_page]
+
+    if options['include_items'] or options['include_taxes']:
+        data = [
+            inv.to_dict(include_items=options['include_items'], include_taxes=options['include_taxes'])
+            for inv in invoices
+        ]
+    else:
+        data = [inv.to_summary_dict() for inv in invoices]
+
+    return {
+        "items": data,
+        "total": total,
+        "pages": math.ceil(total / per_page) if total is not None else None,
+        "current_page": None if options['after'] else options['page'],
+        "has_more": has_more,
+        "next_cursor": make_list_cursor(invoices[-1]) if has_more and invoices else None
+    }
+
+
+def invoice_count_statement():
+    return select(func.count()).select_from(Invoice.__table__)
+
+
+def invoice_detail_statement(invoice_id):
+    """Full invoice (header, taxes and line items) without the stored XML."""
+    return select(Invoice).options(selectinload(Invoice.items)).where(Invoice.id == invoice_id)
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
 """XML Module Routes"""
-from flask import Blueprint, request, jsonify, send_file
-from .services import process_and_save_xml, export_invoices_to_excel
-from .models import Invoice
+import os
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from sqlalchemy.orm import undefer
+from app.extensions import db
+from .services import (
+    iter_upload_entries, process_xml_uploads, get_invoice_count, delete_invoices
+)
+from .models import Invoice, IngestJob
+from .jobs import create_ingest_job, jobs_enabled
+from .storage import decompress_xml
+from .queries import invoice_detail_statement, list_response, list_statement, parse_list_args
+from .search import count_search_statement, parse_search_request, search_invoices, search_response
+from .summary import build_summary, parse_summary_args
+from .export import (
+    EXPORT_FORMATS, build_export_filters, create_export_file, export_invoices_to_excel,
+    export_invoices_to_parquet, iter_csv_export, iter_ndjson_export, stream_file_and_remove
+)
 
 xml_bp = Blueprint('xml', __name__)
 
@@ -27,6 +42,16 @@ def upload_xmls():
             logger.error("Empty files list or no filename")
             return jsonify({"error": "No selected files"}), 400
 
+        # Async mode: store the files, answer with a job id and ingest in the background.
+        # Without XML_JOBS_DIR the upload is processed here and answered with its results (200)
+        if request.args.get('async', 0, type=int) and jobs_enabled():
+            job = create_ingest_job(files)
+            return jsonify({
+                "job_id": job.id,
+                "status": job.status,
+                "total_files": job.total_files
+            }), 202
+
         results = {
             "uploaded": 0,
             "skipped": 0,
@@ -34,37 +59,19 @@ def upload_xmls():
             "details": []
         }
 
-        for file in files:
-            logger.info(f"Processing file: {file.filename}")
+        # Parsing runs on the process pool; DB writes stay here, in upload order
+        uploads = ((file.filename, file) for file in files)
+        for filename, res in process_xml_uploads(iter_upload_entries(uploads)):
+            logger.info(f"File {filename} processed: {res['status']}")
             
-            if not file.filename.lower().endswith('.xml'):
-                logger.warning(f"File {file.filename} is not an XML file")
+            if res['status'] == 'success':
+                results["uploaded"] += 1
+            elif res['status'] == 'skipped':
+                results["skipped"] += 1
+            else:
                 results["errors"] += 1
-                results["details"].append({"filename": file.filename, "status": "error", "msg": "Not an XML file"})
-                continue
-                
-            # Process
-            try:
-                res = process_and_save_xml(file)
-                logger.info(f"File {file.filename} processed: {res['status']}")
                 
-                if res['status'] == 'success':
-                    results["uploaded"] += 1
-                elif res['status'] == 'skipped':
-                    results["skipped"] += 1
-                else:
-                    results["errors"] += 1
-                    
-                results["details"].append({"filename": file.filename, "status": res['status'], "msg": res['msg']})
-                
-            except Exception as file_error:
-                logger.error(f"Error processing file {file.filename}: {str(file_error)}", exc_info=True)
-                results["errors"] += 1
-                results["details"].append({
-                    "filename": file.filename, 
-                    "status": "error", 
-                    "msg": f"Processing error: {str(file_error)}"
-                })
+            results["details"].append({"filename": filename, "status": res['status'], "msg": res['msg']})
 
         logger.info(f"Upload complete: {results['uploaded']} uploaded, {results['skipped']} skipped, {results['errors']} errors")
         return jsonify(results), 200
@@ -73,40 +80,168 @@ def upload_xmls():
         logger.error(f"Unexpected error in upload_xmls: {str(e)}", exc_info=True)
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
+@xml_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_ingest_job(job_id):
+    """
+    Progress of an async upload. Per-file details are included once the job
+    has finished (or always with ?details=1).
+    """
+    job = db.session.get(IngestJob, job_id)
+    if not job:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    
+    include_details = job.status in ('done', 'failed') or request.args.get('details', 0, type=int)
+    return jsonify(job.to_dict(include_details=bool(include_details))), 200
+
 @xml_bp.route('/list', methods=['GET'])
 def list_invoices():
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 20, type=int)
+    """
+    Paginated invoice list, newest first. Returns compact summaries by default;
+    opt in to heavier data with ?include=items,taxes (items are loaded for the
+    whole page in a single selectinload query).
     
-    # Sort by created_at desc
-    pagination = Invoice.query.order_by(Invoice.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    Two paging modes:
+    - ?page=N (offset): kept for the UI page numbers.
+    - ?after=<created_at>,<id> (keyset): constant cost at any depth, driven by
+      the (created_at, id) index; the response carries next_cursor.
+    ?per_page= is clamped to 1..100 (default 20).
+    The total comes from a short-lived cached COUNT(*); ?count=0 skips it.
+    """
+    try:
+        options = parse_list_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    data = [item.to_dict() for item in pagination.items]
+    invoices = db.session.execute(list_statement(options)).scalars().all()
+    total = get_invoice_count() if options['with_count'] else None
+    return jsonify(list_response(options, invoices, total)), 200
+
+@xml_bp.route('/search', methods=['GET'])
+def search():
+    """
+    Filtered invoice search, newest issue_date first, keyset paged.
     
-    return jsonify({
-        "items": data,
-        "total": pagination.total,
-        "pages": pagination.pages,
-        "current_page": page
-    }), 200
+    Filters (all optional, combined with AND): issuer_nit, receiver_nit,
+    payment_form, date_from / date_to (issue date, YYYY-MM-DD), min_total /
+    max_total, number (invoice number prefix) and q (words in the line item
+    descriptions). Page with ?after=<next_cursor>; ?count=1 adds the total.
+    """
+    try:
+        params, per_page, cursor, with_count = parse_search_request(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    invoices, has_more = search_invoices(params, per_page=per_page, after=cursor)
+    total = db.session.execute(count_search_statement(params)).scalar() if with_count else None
+    return jsonify(search_response(invoices, has_more, total)), 200
+
+@xml_bp.route('/<int:invoice_id>', methods=['GET'])
+def get_invoice(invoice_id):
+    """Full invoice (header, taxes and line items)"""
+    invoice = db.session.execute(invoice_detail_statement(invoice_id)).scalar_one_or_none()
+    
+    if not invoice:
+        return jsonify({"error": "Factura no encontrada"}), 404
+    
+    return jsonify(invoice.to_dict()), 200
+
+@xml_bp.route('/<int:invoice_id>/xml', methods=['GET'])
+def get_invoice_xml(invoice_id):
+    """Original XML of an invoice, decompressed on request"""
+    invoice = Invoice.query.options(undefer(Invoice.xml_content)).filter_by(id=invoice_id).first()
+    
+    if not invoice:
+        return jsonify({"error": "Factura no encontrada"}), 404
+    if invoice.xml_content is None:
+        return jsonify({"error": "XML original no almacenado"}), 404
+    
+    content = decompress_xml(invoice.xml_content, invoice.xml_codec)
+    filename = f"{invoice.invoice_number or invoice.uuid[:12]}.xml"
+    return Response(content, mimetype='application/xml', headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    })
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').date()
 
 @xml_bp.route('/export', methods=['GET'])
 def export_excel():
     """
-    Export all invoices from database to Excel file
+    Export invoices, one row per line item with dynamic "Valor <tax>" columns.
+    ?format=xlsx (default) | csv | ndjson | parquet
+    Filters: ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD&issuer_nit=...&receiver_nit=...
+    CSV and NDJSON are streamed row by row; XLSX and Parquet are built on
+    disk with constant memory and streamed back.
     """
+    export_format = request.args.get('format', 'xlsx').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format '{export_format}'. Use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    
     try:
-        file_buffer = export_invoices_to_excel()
-        return send_file(
-            file_buffer,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name='invoices_export.xlsx'
+        filters = build_export_filters(
+            date_from=_parse_date_arg('date_from'),
+            date_to=_parse_date_arg('date_to'),
+            issuer_nit=request.args.get('issuer_nit'),
+            receiver_nit=request.args.get('receiver_nit')
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+    
+    if export_format == 'csv':
+        return Response(
+            stream_with_context(iter_csv_export(filters)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': 'attachment; filename=invoices_export.csv'}
         )
+    
+    if export_format == 'ndjson':
+        return Response(
+            stream_with_context(iter_ndjson_export(filters)),
+            mimetype='application/x-ndjson',
+            headers={'Content-Disposition': 'attachment; filename=invoices_export.ndjson'}
+        )
+    
+    if export_format == 'parquet':
+        path = create_export_file('.parquet')
+        writer, mimetype = export_invoices_to_parquet, 'application/vnd.apache.parquet'
+    else:
+        path = create_export_file('.xlsx')
+        writer, mimetype = export_invoices_to_excel, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    
+    try:
+        writer(path, filters)
+    except ValueError as ve:
+        os.remove(path)
+        return jsonify({"error": str(ve)}), 400
     except Exception as e:
+        os.remove(path)
         return jsonify({"error": str(e)}), 500
+    
+    return Response(
+        stream_file_and_remove(path),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename=invoices_export.{export_format}',
+            'Content-Length': str(os.path.getsize(path))
+        }
+    )
+
+@xml_bp.route('/summary', methods=['GET'])
+def invoice_summary():
+    """
+    Base, tax and total amounts plus a per-tax breakdown, read from the
+    pre-aggregated rollups (no scan of invoices / invoice_items).
+    ?group_by=period,issuer_nit,receiver_nit (any subset, default: period; empty = grand total)
+    Filters: ?period_from=YYYY-MM&period_to=YYYY-MM&issuer_nit=...&receiver_nit=...
+    """
+    try:
+        summary = build_summary(**parse_summary_args(request.args))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summary), 200
 
 @xml_bp.route('/<int:invoice_id>', methods=['DELETE'])
 def delete_invoice(invoice_id):
@@ -114,27 +249,63 @@ def delete_invoice(invoice_id):
     Delete an invoice by ID
     """
     import logging
-    from app.extensions import db
     
     logger = logging.getLogger(__name__)
     
     try:
-        invoice = Invoice.query.get(invoice_id)
+        # Set-based: one DELETE per table, no items loaded into the session
+        deleted = delete_invoices(invoice_ids=[invoice_id])
         
-        if not invoice:
+        if not deleted['invoices']:
             logger.warning(f"Invoice with ID {invoice_id} not found")
             return jsonify({"error": "Factura no encontrada"}), 404
         
-        logger.info(f"Deleting invoice ID {invoice_id} (UUID: {invoice.uuid[:12]}...)")
-        
-        # Delete invoice (cascade will delete related items automatically)
-        db.session.delete(invoice)
-        db.session.commit()
-        
         logger.info(f"Invoice {invoice_id} deleted successfully")
         return jsonify({"message": "Factura eliminada exitosamente"}), 200
         
     except Exception as e:
-        db.session.rollback()
         logger.error(f"Error deleting invoice {invoice_id}: {str(e)}", exc_info=True)
         return jsonify({"error": f"Error al eliminar: {str(e)}"}), 500
+
+@xml_bp.route('/bulk-delete', methods=['POST'])
+def bulk_delete_invoices():
+    """
+    Delete many invoices at once, e.g. to wipe a month before re-importing it.
+    JSON body, either {"ids": [1, 2, ...]} or filters
+    {"date_from": "YYYY-MM-DD", "date_to": "YYYY-MM-DD", "issuer_nit": ..., "receiver_nit": ...}
+    (at least one). Runs in chunked set-based transactions; rollups stay
+    consistent and the deleted files can be uploaded again (through any worker).
+    Returns the rows deleted per table.
+    """
+    import logging
+    
+    logger = logging.getLogger(__name__)
+    body = request.get_json(silent=True) or {}
+    
+    ids = body.get('ids')
+    if ids is not None:
+        if not isinstance(ids, list) or not all(isinstance(value, int) and not isinstance(value, bool) for value in ids):
+            return jsonify({"error": "ids must be a list of integers"}), 400
+        filters = None
+    else:
+        try:
+            date_from, date_to = (
+                datetime.strptime(body[name], '%Y-%m-%d').date() if body.get(name) else None
+                for name in ('date_from', 'date_to')
+            )
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid date, expected YYYY-MM-DD"}), 400
+        filters = build_export_filters(
+            date_from=date_from, date_to=date_to,
+            issuer_nit=body.get('issuer_nit'), receiver_nit=body.get('receiver_nit')
+        )
+        if not filters:
+            return jsonify({"error": "Provide ids or at least one filter (date_from, date_to, issuer_nit, receiver_nit)"}), 400
+    
+    try:
+        deleted = delete_invoices(invoice_ids=ids, filters=filters)
+    except Exception as e:
+        logger.error(f"Error in bulk delete: {str(e)}", exc_info=True)
+        return jsonify({"error": f"Error al eliminar: {str(e)}"}), 500
+    
+    return jsonify({"deleted": deleted}), 200
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+XML Module Search - Indexed invoice filters and full-text search on line items
+
+Every filter maps onto an index of the invoices table and results are paged
+newest issue_date first with a keyset cursor, so a page costs a bounded
+index range scan whatever the table size:
+
+    issuer_nit / receiver_nit / payment_form (+ dates)  (<column>, issue_date)
+    date range alone                                    (issue_date)
+    total amount range                                  (total_amount)
+    invoice_number prefix                               (invoice_number, MySQL; scan on SQLite)
+    q (line item text)                                  FULLTEXT on MySQL, FTS5 on SQLite
+"""
+import logging
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, func, inspect, or_, select, text
+from sqlalchemy.dialects.mysql import match
+from app.extensions import db
+from .models import INVOICE_ITEMS_FTS_DDL, INVOICE_ITEMS_FTS_TABLE, Invoice, InvoiceItem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PER_PAGE = 20
+MAX_PER_PAGE = 100
+
+# Words of ?q= shorter than this are ignored (MySQL's default innodb_ft_min_token_size)
+MIN_TOKEN_LENGTH = 3
+MAX_TOKENS = 8
+
+TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+def ensure_sqlite_fts():
+    """
+    Creates and fills the SQLite FTS5 table of a database created before it
+    existed (create_all only adds it together with invoice_items).
+    """
+    if inspect(db.engine).has_table(INVOICE_ITEMS_FTS_TABLE):
+        return False
+    for statement in INVOICE_ITEMS_FTS_DDL:
+        db.session.execute(text(statement))
+    db.session.execute(text(f"INSERT INTO {INVOICE_ITEMS_FTS_TABLE}({INVOICE_ITEMS_FTS_TABLE}) VALUES ('rebuild')"))
+    db.session.commit()
+    return True
+
+
+def parse_search_args(args):
+    """
+    Validated search parameters from a request's query string.
+    Raises ValueError with a user-facing message on malformed input.
+    """
+    params = {
+        'issuer_nit': args.get('issuer_nit') or None,
+        'receiver_nit': args.get('receiver_nit') or None,
+        'payment_form': args.get('payment_form') or None,
+        'number': args.get('number') or None,
+        'q': args.get('q') or None,
+    }
+    for name in ('date_from', 'date_to'):
+        value = args.get(name)
+        try:
+            params[name] = datetime.strptime(value, '%Y-%m-%d').date() if value else None
+        except ValueError:
+            raise ValueError(f"Invalid {name}, expected YYYY-MM-DD")
+    for name in ('min_total', 'max_total'):
+        value = args.get(name)
+        try:
+            params[name] = Decimal(value) if value else None
+        except InvalidOperation:
+            raise ValueError(f"Invalid {name}, expected a number")
+    if params['q'] is not None and not search_tokens(params['q']):
+        raise ValueError(f"q needs at least one word of {MIN_TOKEN_LENGTH} or more characters")
+    return params
+
+
+def search_tokens(q):
+    tokens = [token for token in TOKEN_PATTERN.findall(q or '') if len(token) >= MIN_TOKEN_LENGTH]
+    return tokens[:MAX_TOKENS]
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def fulltext_item_ids(q, dialect=None):
+    """
+    Subquery of invoice_items.id whose description contains every word of `q`
+    (prefix match on each word). MySQL FULLTEXT in boolean mode, FTS5 on
+    SQLite, LIKE on other databases. `dialect` defaults to the app's engine.
+    """
+    tokens = search_tokens(q)
+    dialect = dialect or db.engine.dialect.name
+    items = InvoiceItem.__table__
+
+    if dialect == 'mysql':
+        against = ' '.join(f'+{token}*' for token in tokens)
+        return select(items.c.id).where(match(items.c.description, against=against).in_boolean_mode())
+
+    if dialect == 'sqlite':
+        expression = ' '.join(f'"{token}"*' for token in tokens)
+        return select(text('rowid')).select_from(text(INVOICE_ITEMS_FTS_TABLE)).where(
+            text(f"{INVOICE_ITEMS_FTS_TABLE} MATCH :fts_query").bindparams(fts_query=expression)
+        )
+
+    logger.warning(f"No full-text index for dialect {dialect}, item search falls back to LIKE")
+    return select(items.c.id).where(and_(*(
+        items.c.description.ilike(f"%{_escape_like(token)}%", escape='\\') for token in tokens
+    )))
+
+
+def build_search_filters(params, dialect=None):
+    """WHERE conditions on the invoices table for parse_search_args() output."""
+    invoices = Invoice.__table__
+    filters = []
+    if params.get('issuer_nit'):
+        filters.append(invoices.c.issuer_nit == params['issuer_nit'])
+    if params.get('receiver_nit'):
+        filters.append(invoices.c.receiver_nit == params['receiver_nit'])
+    if params.get('payment_form'):
+        filters.append(invoices.c.payment_form == params['payment_form'])
+    if params.get('date_from'):
+        filters.append(invoices.c.issue_date >= params['date_from'])
+    if params.get('date_to'):
+        filters.append(invoices.c.issue_date <= params['date_to'])
+    if params.get('min_total') is not None:
+        filters.append(invoices.c.total_amount >= params['min_total'])
+    if params.get('max_total') is not None:
+        filters.append(invoices.c.total_amount <= params['max_total'])
+    if params.get('number'):
+        # Case-insensitive prefix: MySQL serves LIKE 'prefix%' from the
+        # invoice_number index under its _ci collation, and SQLite's LIKE folds
+        # ASCII case. A code-point range (>= prefix, < next prefix) is not used:
+        # collations do not sort by code point ('SETT9' would match nothing)
+        pattern = f"{_escape_like(params['number'])}%"
+        if (dialect or db.engine.dialect.name) in ('mysql', 'sqlite'):
+            filters.append(invoices.c.invoice_number.like(pattern, escape='\\'))
+        else:
+            filters.append(invoices.c.invoice_number.ilike(pattern, escape='\\'))
+    if params.get('q'):
+        items = InvoiceItem.__table__
+        filters.append(invoices.c.id.in_(
+            select(items.c.invoice_id).where(items.c.id.in_(fulltext_item_ids(params['q'], dialect)))
+        ))
+    return filters
+
+
+def parse_search_cursor(value):
+    """'<issue_date ISO or empty>,<id>' -> (date or None, int); raises ValueError if malformed."""
+    issue_date, _, invoice_id = value.rpartition(',')
+    return (datetime.strptime(issue_date, '%Y-%m-%d').date() if issue_date else None), int(invoice_id)
+
+
+def make_search_cursor(invoice):
+    return f"{invoice.issue_date.isoformat() if invoice.issue_date else ''},{invoice.id}"
+
+
+def parse_search_request(args):
+    """
+    parse_search_args() plus paging: (params, per_page, cursor, with_count).
+    Raises ValueError with a user-facing message on malformed input.
+    """
+    params = parse_search_args(args)
+    try:
+        per_page = int(args.get('per_page', DEFAULT_PER_PAGE))
+    except (TypeError, ValueError):
+        per_page = DEFAULT_PER_PAGE
+    after = args.get('after')
+    try:
+        cursor = parse_search_cursor(after) if after else None
+    except ValueError:
+        raise ValueError("Invalid cursor")
+    try:
+        with_count = bool(int(args.get('count', 0)))
+    except (TypeError, ValueError):
+        with_count = False
+    return params, min(max(per_page, 1), MAX_PER_PAGE), cursor, with_count
+
+
+def search_statements(params, after=None, dialect=None):
+    """
+    The statements whose results, concatenated, are the matches of `params`
+    after `after` (a parse_search_cursor() tuple) in result order: newest
+    issue_date first, invoices without a date last. The caller applies the
+    page limit to each in turn (see search_invoices).
+
+    Each statement reads a single range of the filter's index in order: the
+    dated rows after the cursor, then the undated ones. One OR-ed condition
+    covering both would make the database collect and sort every remaining
+    match on every page.
+    """
+    base = select(Invoice).where(*build_search_filters(params, dialect)).options(db.defer(Invoice.json_taxes))
+    undated = base.where(Invoice.issue_date.is_(None)).order_by(Invoice.id.desc())
+
+    if after is not None and after[0] is None:
+        return [undated.where(Invoice.id < after[1])]
+
+    dated = base.where(Invoice.issue_date.isnot(None)).order_by(Invoice.issue_date.desc(), Invoice.id.desc())
+    if after is not None:
+        issue_date, invoice_id = after
+        dated = dated.where(
+            Invoice.issue_date <= issue_date,
+            or_(Invoice.issue_date < issue_date, Invoice.id < invoice_id)
+        )
+    return [dated, undated]
+
+
+def search_invoices(params, per_page=DEFAULT_PER_PAGE, after=None):
+    """One page of invoices matching `params`. Returns (invoices, has_more)."""
+    limit = per_page + 1
+    invoices = []
+    for stmt in search_statements(params, after):
+        invoices += db.session.execute(stmt.limit(limit - len(invoices))).scalars().all()
+        if len(invoices) >= limit:
+            break
+    return invoices[:per_page], len(invoices) > per_page
+
+
+def search_response(invoices, has_more, total):
+    return {
+        "items": [inv.to_summary_dict() for inv in invoices],
+        "total": total,
+        "has_more": has_more,
+        "next_cursor": make_search_cursor(invoices[-1]) if has_more and invoices else None
+    }
+
+
+def count_search_statement(params, dialect=None):
+    """Total matches (one COUNT over the same indexed filters; only on request, it scans every match)."""
+    return select(func.count()).select_from(Invoice.__table__).where(*build_search_filters(params, dialect))
@@ -1,183 +1,381 @@
 # -*- coding: utf-8 -*-
 """XML Module Services - DIAN Parser"""
+import hashlib
 import logging
 import io
 import json
-from lxml import etree
-from datetime import datetime
-import pandas as pd
+import os
+import re
+import tarfile
+import threading
+import time
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
 from app.extensions import db
-from .models import Invoice, InvoiceItem
+from app.instrumentation import stage
+from .models import Invoice, InvoiceItem, InvoiceItemTax
+from .queries import invoice_count_statement
+from .summary import add_invoices_to_rollups, remove_invoices_from_rollups
+from .parser import parse_xml_invoice, parse_xml_invoice_stream
+from .storage import compress_stream, compress_xml, decompress_xml, parse_and_pack, resolve_codec
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Namespaces typically used in UBL 2.1 / DIAN
-NAMESPACES = {
-    'cac': 'urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2',
-    'cbc': 'urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2',
-    'ext': 'urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2',
-    'ad': 'urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2',
-}
+# Uploads larger than this are parsed with the streaming (iterparse) engine
+DEFAULT_STREAMING_THRESHOLD = 5 * 1024 * 1024
 
-# Mapping for payment form codes
-PAYMENT_FORM_MAP = {
-    '1': 'Contado',
-    '2': 'Crédito'
-}
+# Seconds the invoice COUNT(*) of the list endpoint is reused
+DEFAULT_LIST_COUNT_TTL = 30
 
-def parse_xml_invoice(file_content):
+# Largest single XML accepted from inside an archive (zip bomb guard)
+DEFAULT_MAX_MEMBER_BYTES = 50 * 1024 * 1024
+
+# Parsed invoices written per bulk insert / transaction
+DEFAULT_INGEST_CHUNK_SIZE = 500
+
+# Invoices removed per DELETE statement / transaction by delete_invoices
+DEFAULT_DELETE_CHUNK_SIZE = 500
+
+# Files handed to the parse pool at once, per worker (bounds memory of a batch)
+PARSE_WINDOW_PER_WORKER = 8
+
+# Header fields rewritten by `flask xml reprocess` (uuid and content hash are kept)
+REPROCESS_FIELDS = (
+    'invoice_number', 'issue_date', 'total_amount', 'tax_amount', 'base_amount',
+    'issuer_nit', 'issuer_name', 'receiver_nit', 'receiver_name',
+    'payment_form', 'payment_method', 'json_taxes',
+)
+
+# json_taxes keys are "<scheme> <percent>%" (or just "<scheme>" without percent)
+TAX_KEY_PATTERN = re.compile(r'^(.+) (\S+)%$')
+
+INVALID_XML_MSG = 'Invalid XML structure or missing critical fields'
+DUPLICATE_FILE_MSG = 'File already uploaded (same content)'
+
+# Bytes read at a time when hashing a streamed upload
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_parse_pool = None
+_parse_pool_workers = 0
+_parse_pool_lock = threading.Lock()
+
+# Cached COUNT(*) of invoices for the list endpoint: (value, monotonic timestamp)
+_invoice_count_cache = None
+_invoice_count_lock = threading.Lock()
+
+def cached_invoice_count(ttl=None):
+    """The cached invoice total if younger than `ttl` seconds, else None."""
+    if ttl is None:
+        ttl = current_app.config.get('XML_LIST_COUNT_TTL', DEFAULT_LIST_COUNT_TTL)
+    with _invoice_count_lock:
+        cached = _invoice_count_cache
+    if cached is not None and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+    return None
+
+def store_invoice_count(total):
+    global _invoice_count_cache
+    with _invoice_count_lock:
+        _invoice_count_cache = (total, time.monotonic())
+
+def get_invoice_count(ttl=None):
+    """
+    Total number of invoices, cached per process for `ttl` seconds so paging
+    does not run a full COUNT(*) on every request.
+    """
+    total = cached_invoice_count(ttl)
+    if total is None:
+        total = db.session.execute(invoice_count_statement()).scalar()
+        store_invoice_count(total)
+    return total
+
+def invalidate_invoice_count():
+    global _invoice_count_cache
+    with _invoice_count_lock:
+        _invoice_count_cache = None
+
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()
+
+def _stream_hash(stream):
+    """SHA-256 of a seekable stream read in chunks (pointer left at 0)."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def find_stored_hashes(hashes):
     """
-    Parses a DIAN XML (Invoice or AttachedDocument) and returns a dictionary of fields.
-    Now includes payment methods, tax breakdown, and line items.
-    Returns None if parsing fails or valid data isn't found.
+    Subset of `hashes` already stored in invoices.content_sha256, in ONE
+    indexed `IN (...)` query. Always asked to the database (never cached per
+    process), so files deleted by any worker can be uploaded again right away.
     """
+    hashes = list(set(hashes))
+    if not hashes:
+        return set()
+    column = Invoice.__table__.c.content_sha256
+    return set(db.session.execute(select(column).where(column.in_(hashes))).scalars())
+
+def storage_codec():
+    """Codec the original XML is stored with, or None when XML_STORE_ORIGINAL is off."""
+    if not current_app.config.get('XML_STORE_ORIGINAL', True):
+        return None
+    return resolve_codec(current_app.config.get('XML_COMPRESSION', 'auto'))
+
+def _stream_size(stream):
+    """Size in bytes of a seekable stream (pointer left at 0), or None if unknown."""
     try:
-        parser = etree.XMLParser(recover=True, huge_tree=True)
-        tree = etree.fromstring(file_content, parser)
-        
-        # 1. Handle AttachedDocument (The "Trap")
-        root_tag = etree.QName(tree).localname
-        
-        if root_tag == 'AttachedDocument':
-            logger.info("AttachedDocument detected. Extracting inner XML...")
-            xpath_expr = ".//cac:Attachment/cac:ExternalReference/cbc:Description"
-            description_nodes = tree.xpath(xpath_expr, namespaces=NAMESPACES)
-            
-            if not description_nodes:
-                logger.warning("AttachedDocument found but no Description node with CDATA.")
-                return None
-            
-            inner_xml_str = description_nodes[0].text
-            if not inner_xml_str: 
-                return None
-                
-            tree = etree.fromstring(inner_xml_str.encode('utf-8'), parser)
-        
-        # 2. Helper function for text extraction
-        def get_text(xpath, node=tree):
-            res = node.xpath(xpath, namespaces=NAMESPACES)
-            return res[0].text if res else None
-
-        # 3. Basic Invoice Data
-        # Extract UUID (CUFE - technical identifier)
-        uuid = get_text(".//cbc:UUID")
-        if not uuid:
-            logger.warning("No UUID found in XML.")
-            return None
-        
-        # NEW: Extract Invoice Number (human-readable ID like "BRZ2975")
-        # This is cbc:ID at the root level of Invoice (same level as cbc:IssueDate)
-        invoice_number = get_text("./cbc:ID")  # Direct child of Invoice root
-        if not invoice_number:
-            # Fallback: try with namespace prefix explicitly
-            invoice_number = get_text(".//cbc:ID")
-        
-        logger.info(f"Extracted Invoice Number: {invoice_number}, UUID: {uuid[:12]}...")
-            
-        issue_date_str = get_text(".//cbc:IssueDate")
-        issue_date = None
-        if issue_date_str:
-            try:
-                issue_date = datetime.strptime(issue_date_str, '%Y-%m-%d').date()
-            except ValueError:
-                pass
+        stream.seek(0, io.SEEK_END)
+        size = stream.tell()
+        stream.seek(0)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
 
-        total_amount = float(get_text(".//cac:LegalMonetaryTotal/cbc:PayableAmount") or 0)
-        tax_amount = float(get_text(".//cac:TaxTotal/cbc:TaxAmount") or 0)
-        base_amount = float(get_text(".//cac:LegalMonetaryTotal/cbc:LineExtensionAmount") or 0)
+def default_parse_workers():
+    return min(4, os.cpu_count() or 1)
 
-        # 4. Parties (Issuer & Receiver)
-        issuer_nit_xpath = ".//cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID"
-        issuer_name_xpath = ".//cac:AccountingSupplierParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName"
-        
-        issuer_nit = get_text(issuer_nit_xpath)
-        issuer_name = get_text(issuer_name_xpath)
-        if not issuer_name:
-             issuer_name = get_text(".//cac:AccountingSupplierParty/cac:Party/cac:PartyName/cbc:Name")
+def _get_parse_pool(workers):
+    """
+    Lazily creates the per-process parse pool. forkserver/spawn children never
+    inherit the gunicorn worker's threads, sockets or DB connections.
+    """
+    global _parse_pool, _parse_pool_workers
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool_workers != workers:
+            if _parse_pool is not None:
+                _parse_pool.shutdown(wait=False)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            _parse_pool_workers = workers
+        return _parse_pool
 
-        receiver_nit_xpath = ".//cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:CompanyID"
-        receiver_name_xpath = ".//cac:AccountingCustomerParty/cac:Party/cac:PartyTaxScheme/cbc:RegistrationName"
-        
-        receiver_nit = get_text(receiver_nit_xpath)
-        receiver_name = get_text(receiver_name_xpath)
-        if not receiver_name:
-             receiver_name = get_text(".//cac:AccountingCustomerParty/cac:Party/cac:PartyName/cbc:Name")
-
-        # 5. NEW: Payment Information
-        payment_form_code = get_text(".//cac:PaymentMeans/cbc:ID")
-        payment_form = PAYMENT_FORM_MAP.get(payment_form_code, payment_form_code) if payment_form_code else None
-        payment_method = get_text(".//cac:PaymentMeans/cbc:PaymentMeansCode")
-
-        # 6. NEW: Tax Breakdown (Discriminated)
-        taxes_dict = {}
-        tax_subtotals = tree.xpath(".//cac:TaxTotal/cac:TaxSubtotal", namespaces=NAMESPACES)
-        for subtotal in tax_subtotals:
-            tax_name = get_text(".//cac:TaxCategory/cac:TaxScheme/cbc:Name", node=subtotal)
-            tax_percent = get_text(".//cac:TaxCategory/cbc:Percent", node=subtotal)
-            tax_value = get_text(".//cbc:TaxAmount", node=subtotal)
-            
-            if tax_name and tax_value:
-                # Create key like "IVA 19%" or just "IVA" if no percent
-                key = f"{tax_name} {tax_percent}%" if tax_percent else tax_name
-                taxes_dict[key] = float(tax_value)
+def _reset_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False)
+        _parse_pool = None
+
+def _parse_many(contents, workers, streaming_threshold, codec=None):
+    """
+    Parses a list of XML payloads, in parallel when it pays off. Order is preserved.
+    With a codec, each payload is also compressed on the pool (see parse_and_pack).
+    """
+    if not contents:
+        return []
+    with stage('xml', 'parse'):
+        return _run_parse(contents, workers, partial(parse_and_pack, streaming_threshold=streaming_threshold, codec=codec))
+
+def _run_parse(contents, workers, parse):
+    if workers <= 1 or len(contents) < 2:
+        return [parse(content) for content in contents]
+    
+    try:
+        pool = _get_parse_pool(workers)
+        chunksize = max(1, len(contents) // (workers * 2))
+        return list(pool.map(parse, contents, chunksize=chunksize))
+    except BrokenProcessPool:
+        logger.error("Parse pool crashed, parsing this batch in-process", exc_info=True)
+        _reset_parse_pool()
+        return [parse(content) for content in contents]
+
+def _batched(iterable, size):
+    batch = []
+    for entry in iterable:
+        batch.append(entry)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _archive_kind(filename):
+    name = filename.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar.gz', '.tgz', '.tar')):
+        return 'tar'
+    return None
+
+def _read_member(member_stream, declared_size, max_bytes):
+    """Reads one archive member, refusing members above max_bytes (declared or actual)."""
+    if declared_size is not None and declared_size > max_bytes:
+        raise ValueError(f"Member too large ({declared_size} bytes, limit {max_bytes})")
+    with stage('xml', 'read'):
+        content = member_stream.read(max_bytes + 1)
+    if len(content) > max_bytes:
+        raise ValueError(f"Member too large (limit {max_bytes} bytes)")
+    return content
+
+def _iter_archive_entries(archive_name, stream, kind, max_bytes):
+    """
+    Streams the XML members of a .zip / .tar(.gz) archive, one member in memory
+    at a time, never extracting to disk. Non-XML members (PDF representations,
+    folders, __MACOSX metadata) are ignored; broken members become error entries.
+    """
+    if kind == 'zip':
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/') or not info.filename.lower().endswith('.xml'):
+                    continue
+                entry_name = f"{archive_name}/{info.filename}"
+                try:
+                    with archive.open(info) as member:
+                        yield entry_name, _read_member(member, info.file_size, max_bytes), None
+                except Exception as member_error:
+                    logger.error(f"Error reading {entry_name}: {str(member_error)}")
+                    yield entry_name, None, f"Processing error: {str(member_error)}"
+    else:
+        # 'r|*' is tarfile's streaming mode: members are read sequentially, no seeking
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for info in archive:
+                if not info.isfile() or not info.name.lower().endswith('.xml'):
+                    continue
+                entry_name = f"{archive_name}/{info.name}"
+                try:
+                    yield entry_name, _read_member(archive.extractfile(info), info.size, max_bytes), None
+                except Exception as member_error:
+                    logger.error(f"Error reading {entry_name}: {str(member_error)}")
+                    yield entry_name, None, f"Processing error: {str(member_error)}"
+
+def iter_upload_entries(uploads, max_member_bytes=None):
+    """
+    Turns uploaded files into pipeline entries.
+    uploads: iterable of (filename, binary file-like). Files are read lazily,
+    one at a time, as the pipeline asks for them. ZIP and tar(.gz) archives
+    are expanded member by member, each reported as "<archive>/<member>".
+    Yields (filename, content_bytes, error_msg).
+    """
+    if max_member_bytes is None:
+        max_member_bytes = current_app.config.get('XML_MAX_MEMBER_BYTES', DEFAULT_MAX_MEMBER_BYTES)
+    
+    for filename, stream in uploads:
+        logger.info(f"Processing file: {filename}")
         
-        json_taxes = json.dumps(taxes_dict) if taxes_dict else None
-
-        # 7. NEW: Line Items (Invoice Lines) - CRITICAL FIX: Extract taxes PER LINE
-        items = []
-        invoice_lines = tree.xpath(".//cac:InvoiceLine", namespaces=NAMESPACES)
-        for line in invoice_lines:
-            description = get_text(".//cac:Item/cbc:Description", node=line)
-            quantity = get_text(".//cbc:InvoicedQuantity", node=line)
-            unit_price = get_text(".//cac:Price/cbc:PriceAmount", node=line)
-            total_line = get_text(".//cbc:LineExtensionAmount", node=line)
-            
-            # CRITICAL FIX: Extract taxes for THIS specific line (not from invoice header)
-            line_taxes = {}
-            # Each InvoiceLine has its own cac:TaxTotal/cac:TaxSubtotal
-            line_tax_subtotals = line.xpath(".//cac:TaxTotal/cac:TaxSubtotal", namespaces=NAMESPACES)
-            for subtotal in line_tax_subtotals:
-                tax_name = get_text(".//cac:TaxCategory/cac:TaxScheme/cbc:Name", node=subtotal)
-                tax_percent = get_text(".//cac:TaxCategory/cbc:Percent", node=subtotal)
-                tax_value = get_text(".//cbc:TaxAmount", node=subtotal)
-                
-                if tax_name and tax_value:
-                    # Create key like "IVA 19%" or just tax name if no percent
-                    key = f"{tax_name} {tax_percent}%" if tax_percent else tax_name
-                    line_taxes[key] = float(tax_value)
-            
-            json_line_taxes = json.dumps(line_taxes) if line_taxes else None
-            
-            items.append({
-                "description": description or "Sin descripción",
-                "quantity": float(quantity) if quantity else 0,
-                "unit_price": float(unit_price) if unit_price else 0,
-                "total_line": float(total_line) if total_line else 0,
-                "json_taxes": json_line_taxes  # NEW: Tax info for this specific item
-            })
-
-        return {
-            "uuid": uuid,
-            "invoice_number": invoice_number,  # NEW: Human-readable ID
-            "issue_date": issue_date,
-            "total_amount": total_amount,
-            "tax_amount": tax_amount,
-            "base_amount": base_amount,
-            "issuer_nit": issuer_nit,
-            "issuer_name": issuer_name,
-            "receiver_nit": receiver_nit,
-            "receiver_name": receiver_name,
-            "payment_form": payment_form,
-            "payment_method": payment_method,
-            "json_taxes": json_taxes,
-            "items": items  # Array of line items
-        }
+        kind = _archive_kind(filename)
+        if kind:
+            members = 0
+            try:
+                for entry in _iter_archive_entries(filename, stream, kind, max_member_bytes):
+                    members += 1
+                    yield entry
+            except Exception as archive_error:
+                logger.error(f"Error reading archive {filename}: {str(archive_error)}", exc_info=True)
+                yield filename, None, f"Invalid archive: {str(archive_error)}"
+                continue
+            if not members:
+                yield filename, None, "Archive contains no XML files"
+            continue
+        
+        if not filename.lower().endswith('.xml'):
+            logger.warning(f"File {filename} is not an XML file")
+            yield filename, None, "Not an XML file"
+            continue
+        
+        try:
+            with stage('xml', 'read'):
+                content = stream.read()
+        except Exception as file_error:
+            logger.error(f"Error reading file {filename}: {str(file_error)}", exc_info=True)
+            yield filename, None, f"Processing error: {str(file_error)}"
+            continue
+        yield filename, content, None
 
-    except Exception as e:
-        logger.error(f"Error parsing XML: {e}")
-        return None
+def iter_parsed_xml(entries, workers=None, streaming_threshold=None):
+    """
+    Parses upload entries in windows on the parse pool.
+    entries: iterable of (filename, content_bytes, error_msg); error_msg is set
+    for entries rejected before parsing (content is then ignored).
+    Yields (filename, content, data, error_msg) in input order; data is None
+    whenever error_msg is set.
+    """
+    if workers is None:
+        workers = current_app.config.get('XML_PARSE_WORKERS', default_parse_workers())
+    if streaming_threshold is None:
+        streaming_threshold = current_app.config.get('XML_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD)
+    
+    codec = storage_codec()
+    window = max(1, workers) * PARSE_WINDOW_PER_WORKER
+    for batch in _batched(entries, window):
+        # Duplicate pre-filter: files already stored are never parsed. Copies
+        # repeated within this upload are parsed like the first one, so each
+        # gets the first copy's outcome (UUID check on save, or the same error)
+        with stage('xml', 'dedup'):
+            hashes = [content_hash(content) if error is None and content else None for _, content, error in batch]
+            stored = find_stored_hashes(value for value in hashes if value)
+        duplicate = [value is not None and value in stored for value in hashes]
+        
+        to_parse = [
+            content for (_, content, error), is_duplicate in zip(batch, duplicate)
+            if error is None and content and not is_duplicate
+        ]
+        parsed = iter(_parse_many(to_parse, workers, streaming_threshold, codec))
+        
+        for (filename, content, error), value, is_duplicate in zip(batch, hashes, duplicate):
+            if error is not None:
+                yield filename, content, None, error
+            elif not content:
+                logger.error(f"File {filename} is empty")
+                yield filename, content, None, 'Empty file'
+            elif is_duplicate:
+                logger.info(f"File {filename} already uploaded, skipping before parsing")
+                yield filename, content, None, DUPLICATE_FILE_MSG
+            else:
+                data = next(parsed)
+                if not data:
+                    logger.error(f"Failed to parse XML {filename}")
+                    yield filename, content, None, INVALID_XML_MSG
+                else:
+                    data['content_sha256'] = value
+                    yield filename, content, data, None
+
+def process_xml_uploads(entries, workers=None, chunk_size=None):
+    """
+    Multi-file pipeline: CPU-bound parsing runs on the process pool while the
+    DB writes stay on the calling thread, in upload order, one bulk insert per
+    chunk of parsed invoices.
+    Yields (filename, status dict) per entry, same statuses as process_and_save_xml.
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get('XML_INGEST_CHUNK_SIZE', DEFAULT_INGEST_CHUNK_SIZE)
+    
+    pending = []  # (filename, data, error) in upload order
+    parsed_count = 0
+    
+    def flush():
+        parsed = [data for _, data, error in pending if error is None]
+        saved = iter(save_parsed_invoices(parsed))
+        for filename, data, error in pending:
+            if error == DUPLICATE_FILE_MSG:
+                yield filename, {'status': 'skipped', 'msg': error}
+            elif error is not None:
+                yield filename, {'status': 'error', 'msg': error}
+            else:
+                yield filename, next(saved)
+    
+    for filename, content, data, error in iter_parsed_xml(entries, workers=workers):
+        pending.append((filename, data, error))
+        if error is None:
+            parsed_count += 1
+        if parsed_count >= chunk_size:
+            yield from flush()
+            pending = []
+            parsed_count = 0
+    
+    if pending:
+        yield from flush()
 
 def process_and_save_xml(file_storage):
     """
@@ -191,225 +389,413 @@ def process_and_save_xml(file_storage):
         # Reset file pointer to beginning (in case it was read before)
         if hasattr(file_storage, 'seek'):
             file_storage.seek(0)
-            
-        content = file_storage.read()
-        
-        if not content:
-            logger.error("File content is empty")
-            return {'status': 'error', 'msg': 'Empty file'}
         
-        logger.info(f"Parsing XML content ({len(content)} bytes)")
-        data = parse_xml_invoice(content)
+        stream = getattr(file_storage, 'stream', file_storage)
+        content = None
+        size = _stream_size(stream)
+        threshold = current_app.config.get('XML_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD)
+        
+        # Duplicate pre-filter: same bytes already stored -> skip without parsing
+        if size is None:
+            with stage('xml', 'read'):
+                content = file_storage.read()
+            stream = io.BytesIO(content)
+        with stage('xml', 'dedup'):
+            file_hash = _stream_hash(stream) if content is None else content_hash(content)
+            already_stored = find_stored_hashes([file_hash])
+        if already_stored:
+            logger.info(f"File content {file_hash[:12]}... already uploaded, skipping")
+            return {'status': 'skipped', 'msg': DUPLICATE_FILE_MSG}
+        
+        if size is not None and size > threshold:
+            # Big supplier invoices: never hold the whole document (or two trees) in memory
+            logger.info(f"Parsing XML content in streaming mode ({size} bytes)")
+            with stage('xml', 'parse'):
+                data = parse_xml_invoice_stream(stream)
+        else:
+            if content is None:
+                with stage('xml', 'read'):
+                    content = stream.read()
+            
+            if not content:
+                logger.error("File content is empty")
+                return {'status': 'error', 'msg': 'Empty file'}
+            
+            logger.info(f"Parsing XML content ({len(content)} bytes)")
+            with stage('xml', 'parse'):
+                data = parse_xml_invoice(content)
         
         if not data:
             logger.error("Failed to parse XML - parse_xml_invoice returned None")
-            return {'status': 'error', 'msg': 'Invalid XML structure or missing critical fields'}
+            return {'status': 'error', 'msg': INVALID_XML_MSG}
         
         logger.info(f"XML parsed successfully, UUID: {data.get('uuid', 'N/A')[:12]}...")
-            
-        existing = Invoice.query.filter_by(uuid=data['uuid']).first()
-        if existing:
-            logger.info(f"Invoice with UUID {data['uuid'][:12]}... already exists, skipping")
-            return {'status': 'skipped', 'msg': 'UUID already exists'}
-        
-        # Create Invoice with new fields
-        logger.info("Creating new Invoice record")
-        new_invoice = Invoice(
-            uuid=data['uuid'],
-            invoice_number=data.get('invoice_number'),  # NEW: Human-readable ID
-            issue_date=data['issue_date'],
-            total_amount=data['total_amount'],
-            tax_amount=data['tax_amount'],
-            base_amount=data['base_amount'],
-            issuer_nit=data['issuer_nit'],
-            issuer_name=data['issuer_name'],
-            receiver_nit=data['receiver_nit'],
-            receiver_name=data['receiver_name'],
-            payment_form=data.get('payment_form'),
-            payment_method=data.get('payment_method'),
-            json_taxes=data.get('json_taxes')
-        )
-        
-        db.session.add(new_invoice)
-        logger.info("Invoice added to session, flushing to get ID")
-        db.session.flush()  # Flush to get the invoice.id
-        
-        # Create InvoiceItem children
-        items_data = data.get('items', [])
-        logger.info(f"Creating {len(items_data)} invoice items")
-        for idx, item_dict in enumerate(items_data):
-            try:
-                new_item = InvoiceItem(
-                    invoice_id=new_invoice.id,
-                    description=item_dict['description'],
-                    quantity=item_dict['quantity'],
-                    unit_price=item_dict['unit_price'],
-                    total_line=item_dict['total_line'],
-                    json_taxes=item_dict.get('json_taxes')  # NEW: Tax info per item
-                )
-                db.session.add(new_item)
-            except Exception as item_error:
-                logger.error(f"Error creating item {idx}: {str(item_error)}")
-                raise
-        
-        logger.info("Committing transaction to database")
-        db.session.commit()
-        logger.info(f"Invoice saved successfully with {len(items_data)} items")
-        
-        return {'status': 'success', 'msg': f"Saved with {len(items_data)} items"}
+        data['content_sha256'] = file_hash
+        
+        codec = storage_codec()
+        if codec:
+            # Streamed uploads are compressed chunk by chunk too
+            with stage('xml', 'compress'):
+                data['xml_content'] = compress_stream(stream, codec) if content is None else compress_xml(content, codec)
+            data['xml_codec'] = codec
 
     except Exception as e:
-        db.session.rollback()
-        logger.error(f"Error saving invoice: {str(e)}", exc_info=True)
-        import traceback
-        error_details = traceback.format_exc()
-        logger.error(f"Full traceback: {error_details}")
+        logger.error(f"Error reading invoice: {str(e)}", exc_info=True)
         return {'status': 'error', 'msg': str(e)}
+    
+    return save_parsed_invoice(data)
 
-def export_invoices_to_excel():
+def save_parsed_invoice(data):
     """
-    Export all invoices from database to Excel file using pandas.
-    FLATTENED FORMAT: Each row represents a LINE ITEM (not an invoice).
-    Invoice header fields are repeated for each item.
-    
-    DYNAMIC TAX COLUMNS - CRITICAL FIX: Taxes are now extracted from ITEMS, not invoices.
-    1. Scans all ITEMS (not invoices) to identify unique tax rates in the dataset
-    2. Creates individual columns for each tax type found (e.g., "Valor IVA 19%", "Valor IVA 5%")
-    3. Only creates columns for taxes that exist - no empty columns
-    4. Each row shows ONLY the taxes for THAT specific item (sparse matrix)
-    
-    Example:
-    Item       | Base   | Valor IVA 19% | Valor IVA 5%
-    ------------------------------------------------
-    Gaseosa    | 2000   | 380           | 0
-    Papas      | 1000   | 0             | 50
-    
-    Returns a BytesIO buffer with the Excel file.
+    Saves one parsed invoice (parse_xml_invoice dict) with its line items.
+    Returns status dict: {'status': 'success'|'skipped'|'error', 'msg': ...}
+    """
+    return save_parsed_invoices([data])[0]
+
+def save_parsed_invoices(parsed):
     """
+    Batch ingest of parsed invoices (list of parse_xml_invoice dicts).
+    One `uuid IN (...)` duplicate check and executemany inserts for invoices
+    and items, all in a single transaction. If the chunk fails as a whole it
+    is retried invoice by invoice so each file gets its own status.
+    Returns one status dict per input, in order.
+    """
+    if not parsed:
+        return []
+    
     try:
-        # Fetch all invoices with their items (eager loading)
-        invoices = Invoice.query.order_by(Invoice.issue_date.desc()).all()
-        
-        # STEP 1: Collect all unique tax types across all ITEMS (not invoices)
-        all_tax_keys = set()
-        
-        for inv in invoices:
-            for item in inv.items:
-                if item.json_taxes:
-                    try:
-                        item_taxes_dict = json.loads(item.json_taxes)
-                        all_tax_keys.update(item_taxes_dict.keys())
-                    except:
-                        pass
-        
-        # Sort tax keys for consistent column ordering (e.g., IVA 0%, IVA 5%, IVA 19%)
-        sorted_tax_keys = sorted(all_tax_keys)
-        
-        logger.info(f"Found {len(sorted_tax_keys)} unique tax types in ITEMS: {sorted_tax_keys}")
-        
-        # STEP 2: Build data rows with dynamic tax columns PER ITEM
-        data_list = []
+        results = _bulk_insert_invoices(parsed)
+        with stage('xml', 'commit'):
+            db.session.commit()
+        invalidate_invoice_count()
+        return results
+    
+    except Exception as e:
+        db.session.rollback()
+        if len(parsed) == 1:
+            logger.error(f"Error saving invoice: {str(e)}", exc_info=True)
+            return [{'status': 'error', 'msg': str(e)}]
         
-        for inv in invoices:
-            # Base row data (common invoice header fields)
-            base_row = {
-                'Número Factura': inv.invoice_number or inv.uuid[:12],
-                'Fecha': inv.issue_date.isoformat() if inv.issue_date else '',
-                'Emisor NIT': inv.issuer_nit or '',
-                'Emisor Nombre': inv.issuer_name or '',
-                'Receptor NIT': inv.receptor_nit or '',
-                'Receptor Nombre': inv.receiver_name or '',
-                'Forma Pago': inv.payment_form or '',
-                'Medio Pago': inv.payment_method or '',
-                'Total Factura': float(inv.total_amount) if inv.total_amount else 0,
+        logger.warning(f"Bulk insert of {len(parsed)} invoices failed ({str(e)}), retrying one by one")
+        return [save_parsed_invoices([data])[0] for data in parsed]
+
+def _bulk_insert_invoices(parsed):
+    invoices_table = Invoice.__table__
+    
+    # 1. Duplicate check: one query for the whole chunk
+    uuids = list({data['uuid'] for data in parsed})
+    with stage('xml', 'dedup'):
+        existing = set(db.session.execute(
+            select(invoices_table.c.uuid).where(invoices_table.c.uuid.in_(uuids))
+        ).scalars())
+    
+    results = []
+    new_invoices = []
+    for data in parsed:
+        if data['uuid'] in existing:
+            logger.info(f"Invoice with UUID {data['uuid'][:12]}... already exists, skipping")
+            results.append({'status': 'skipped', 'msg': 'UUID already exists'})
+            continue
+        existing.add(data['uuid'])  # Same UUID twice in one upload
+        new_invoices.append(data)
+        results.append({'status': 'success', 'msg': f"Saved with {len(data.get('items', []))} items"})
+    
+    if not new_invoices:
+        return results
+    
+    with stage('xml', 'insert'):
+        # 2. Invoices (executemany), then fetch their ids back in one query
+        db.session.execute(insert(invoices_table), [
+            {
+                'uuid': data['uuid'],
+                'invoice_number': data.get('invoice_number'),
+                'issue_date': data['issue_date'],
+                'total_amount': data['total_amount'],
+                'tax_amount': data['tax_amount'],
+                'base_amount': data['base_amount'],
+                'issuer_nit': data['issuer_nit'],
+                'issuer_name': data['issuer_name'],
+                'receiver_nit': data['receiver_nit'],
+                'receiver_name': data['receiver_name'],
+                'payment_form': data.get('payment_form'),
+                'payment_method': data.get('payment_method'),
+                'json_taxes': data.get('json_taxes'),
+                'content_sha256': data.get('content_sha256'),
+                'xml_content': data.get('xml_content'),
+                'xml_codec': data.get('xml_codec'),
             }
-            
-            # If invoice has items, create one row per item
-            if inv.items:
-                for item in inv.items:
-                    # Parse THIS item's specific taxes
-                    item_taxes = {}
-                    if item.json_taxes:
-                        try:
-                            item_taxes = json.loads(item.json_taxes)
-                        except:
-                            pass
-                    
-                    row = base_row.copy()
-                    row.update({
-                        'Descripción Ítem': item.description or '',
-                        'Cantidad': float(item.quantity) if item.quantity else 0,
-                        'Precio Unitario': float(item.unit_price) if item.unit_price else 0,
-                        'Total Línea': float(item.total_line) if item.total_line else 0,
-                    })
-                    
-                    # CRITICAL FIX: Add tax columns for THIS ITEM ONLY (sparse matrix)
-                    for tax_key in sorted_tax_keys:
-                        column_name = f"Valor {tax_key}"
-                        # If this item has this tax, use its value; otherwise 0
-                        row[column_name] = float(item_taxes.get(tax_key, 0))
-                    
-                    # Add UUID at the end
-                    row['UUID (CUFE)'] = inv.uuid
-                    
-                    data_list.append(row)
-            else:
-                # Invoice without items: create one row with empty item fields
-                row = base_row.copy()
-                row.update({
-                    'Descripción Ítem': '',
-                    'Cantidad': 0,
-                    'Precio Unitario': 0,
-                    'Total Línea': 0,
-                })
-                
-                # Add empty tax columns
-                for tax_key in sorted_tax_keys:
-                    column_name = f"Valor {tax_key}"
-                    row[column_name] = 0
-                
-                row['UUID (CUFE)'] = inv.uuid
-                data_list.append(row)
+            for data in new_invoices
+        ])
+        ids_by_uuid = dict(db.session.execute(
+            select(invoices_table.c.uuid, invoices_table.c.id)
+            .where(invoices_table.c.uuid.in_([data['uuid'] for data in new_invoices]))
+        ).all())
         
-        # STEP 3: Define column order
-        # Fixed columns first, then dynamic tax columns, then item details, then UUID
-        fixed_columns_pre = [
-            'Número Factura', 'Fecha', 'Emisor NIT', 'Emisor Nombre',
-            'Receptor NIT', 'Receptor Nombre', 'Forma Pago', 'Medio Pago',
-            'Total Factura'
-        ]
+        invoices = [dict(data, id=ids_by_uuid[data['uuid']]) for data in new_invoices]
         
-        tax_columns = [f"Valor {tax_key}" for tax_key in sorted_tax_keys]
-        
-        item_columns = [
-            'Descripción Ítem', 'Cantidad', 'Precio Unitario', 'Total Línea'
-        ]
+        # 3-4. Items and their normalized taxes
+        item_rows, tax_rows = _insert_invoice_items(invoices)
         
-        fixed_columns_post = ['UUID (CUFE)']
-        
-        all_columns = fixed_columns_pre + tax_columns + item_columns + fixed_columns_post
-        
-        # STEP 4: Create DataFrame
-        if not data_list:
-            # Empty dataframe if no data
-            df = pd.DataFrame(columns=all_columns)
-        else:
-            df = pd.DataFrame(data_list)
-            # Ensure column order
-            df = df[all_columns]
-        
-        logger.info(f"Generated Excel with {len(df)} rows and {len(all_columns)} columns")
-        logger.info(f"Tax columns: {tax_columns}")
-        
-        # Create Excel file in memory
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Detalle Facturas', index=False)
-        
-        output.seek(0)
-        return output
+        # 5. Summary rollups, in the same transaction as the invoices
+        add_invoices_to_rollups(invoices, tax_rows)
+    
+    logger.info(f"Bulk inserted {len(new_invoices)} invoices with {len(item_rows)} items and {len(tax_rows)} item taxes")
+    return results
+
+def _insert_invoice_items(invoices):
+    """
+    Inserts the line items (executemany) and their invoice_item_taxes rows for
+    parsed invoices that already carry their 'id'. Returns (item_rows, tax_rows).
+    """
+    item_rows = [
+        {
+            'invoice_id': data['id'],
+            'description': item_dict['description'],
+            'quantity': item_dict['quantity'],
+            'unit_price': item_dict['unit_price'],
+            'total_line': item_dict['total_line'],
+            'json_taxes': item_dict.get('json_taxes'),
+        }
+        for data in invoices
+        for item_dict in data.get('items', [])
+    ]
+    if item_rows:
+        db.session.execute(insert(InvoiceItem.__table__), item_rows)
+    
+    # Normalized taxes: map the new item ids back (one query) and insert one row per tax
+    tax_rows = []
+    if any(row['json_taxes'] for row in item_rows):
+        tax_rows = _insert_item_taxes(item_rows)
+    return item_rows, tax_rows
+
+def _insert_item_taxes(item_rows):
+    items_table = InvoiceItem.__table__
+    invoice_ids = list({row['invoice_id'] for row in item_rows})
+    
+    ids_by_invoice = {}
+    for item_id, invoice_id in db.session.execute(
+        select(items_table.c.id, items_table.c.invoice_id)
+        .where(items_table.c.invoice_id.in_(invoice_ids))
+        .order_by(items_table.c.invoice_id, items_table.c.id)
+    ):
+        ids_by_invoice.setdefault(invoice_id, []).append(item_id)
+    
+    # Items of one invoice were inserted in order, so their ids ascend in that order
+    tax_rows = []
+    positions = {}
+    for row in item_rows:
+        invoice_id = row['invoice_id']
+        position = positions.get(invoice_id, 0)
+        positions[invoice_id] = position + 1
+        tax_rows.extend(tax_rows_for_item(ids_by_invoice[invoice_id][position], invoice_id, row['json_taxes']))
+    
+    if tax_rows:
+        db.session.execute(insert(InvoiceItemTax.__table__), tax_rows)
+    return tax_rows
+
+def split_tax_key(tax_key):
+    """
+    Splits a json_taxes key back into scheme name and percent:
+    'IVA 19.00%' -> ('IVA', Decimal('19.00')), 'INC' -> ('INC', None)
+    """
+    match = TAX_KEY_PATTERN.match(tax_key)
+    if match:
+        try:
+            return match.group(1), Decimal(match.group(2))
+        except InvalidOperation:
+            pass
+    return tax_key, None
+
+def tax_rows_for_item(item_id, invoice_id, json_taxes):
+    """invoice_item_taxes rows for one item's json_taxes (empty list if none/invalid)."""
+    if not json_taxes:
+        return []
+    try:
+        taxes = json.loads(json_taxes)
+    except ValueError:
+        return []
+    
+    rows = []
+    for tax_key, amount in taxes.items():
+        scheme_name, percent = split_tax_key(tax_key)
+        rows.append({
+            'item_id': item_id,
+            'invoice_id': invoice_id,
+            'scheme_name': scheme_name,
+            'percent': percent,
+            'tax_key': tax_key,
+            'amount': amount,
+        })
+    return rows
+
+def backfill_item_taxes(batch_size=2000):
+    """
+    Fills invoice_item_taxes from invoice_items.json_taxes in keyset batches,
+    one transaction each. A batch's rows are replaced, so a partial or
+    repeated run never duplicates taxes. Yields (last_id, items, tax_rows)
+    after each committed batch.
+    """
+    items = InvoiceItem.__table__
+    taxes = InvoiceItemTax.__table__
+
+    last_id = 0
+    while True:
+        batch = db.session.execute(
+            select(items.c.id, items.c.invoice_id, items.c.json_taxes)
+            .where(items.c.id > last_id)
+            .order_by(items.c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return
+
+        item_ids = [row.id for row in batch]
+        tax_rows = []
+        for row in batch:
+            tax_rows.extend(tax_rows_for_item(row.id, row.invoice_id, row.json_taxes))
+
+        db.session.execute(delete(taxes).where(taxes.c.item_id.in_(item_ids)))
+        if tax_rows:
+            db.session.execute(insert(taxes), tax_rows)
+        db.session.commit()
+
+        last_id = item_ids[-1]
+        yield last_id, len(batch), len(tax_rows)
+
+
+def reprocess_stored_invoices(batch_size=200, workers=None, start_id=0):
+    """
+    Re-parses the stored original XML of every invoice (id > start_id) with
+    the current parser, in keyset batches parsed on the pool, and rewrites
+    header fields, line items, item taxes and rollups of each batch in one
+    transaction. Invoices whose XML no longer parses are left untouched.
+    Yields (last_id, reprocessed, failed) after each committed batch.
+    """
+    if workers is None:
+        workers = current_app.config.get('XML_PARSE_WORKERS', default_parse_workers())
+    threshold = current_app.config.get('XML_STREAMING_THRESHOLD', DEFAULT_STREAMING_THRESHOLD)
+    invoices_table = Invoice.__table__
+    items_table = InvoiceItem.__table__
+    taxes_table = InvoiceItemTax.__table__
+    
+    last_id = start_id
+    while True:
+        batch = db.session.execute(
+            select(invoices_table.c.id, invoices_table.c.xml_content, invoices_table.c.xml_codec)
+            .where(invoices_table.c.id > last_id, invoices_table.c.xml_content.isnot(None))
+            .order_by(invoices_table.c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        
+        ids = []
+        contents = []
+        failed = 0
+        for row in batch:
+            try:
+                contents.append(decompress_xml(row.xml_content, row.xml_codec))
+                ids.append(row.id)
+            except Exception as e:
+                logger.error(f"Cannot decompress stored XML of invoice {row.id}: {str(e)}")
+                failed += 1
+        del batch
+        
+        invoices = []
+        for invoice_id, data in zip(ids, _parse_many(contents, workers, threshold)):
+            if data:
+                invoices.append(dict(data, id=invoice_id))
+            else:
+                logger.error(f"Stored XML of invoice {invoice_id} no longer parses, left unchanged")
+                failed += 1
+        
+        if invoices:
+            invoice_ids = [data['id'] for data in invoices]
+            remove_invoices_from_rollups(invoice_ids)
+            db.session.execute(delete(taxes_table).where(taxes_table.c.invoice_id.in_(invoice_ids)))
+            db.session.execute(delete(items_table).where(items_table.c.invoice_id.in_(invoice_ids)))
+            # ORM bulk UPDATE by primary key (executemany)
+            db.session.execute(update(Invoice), [
+                dict({field: data.get(field) for field in REPROCESS_FIELDS}, id=data['id'])
+                for data in invoices
+            ])
+            _, tax_rows = _insert_invoice_items(invoices)
+            add_invoices_to_rollups(invoices, tax_rows)
+        db.session.commit()
         
-    except Exception as e:
-        logger.error(f"Error exporting to Excel: {e}")
-        raise
+        yield last_id, len(invoices), failed
+
+def _delete_invoice_chunk(rows):
+    """Deletes one chunk of invoice rows (by .id) in one transaction; returns the row counts."""
+    invoice_ids = [row.id for row in rows]
+    invoices_table = Invoice.__table__
+    items_table = InvoiceItem.__table__
+    taxes_table = InvoiceItemTax.__table__
+    
+    remove_invoices_from_rollups(invoice_ids)
+    counts = {
+        'taxes': db.session.execute(delete(taxes_table).where(taxes_table.c.invoice_id.in_(invoice_ids))).rowcount,
+        'items': db.session.execute(delete(items_table).where(items_table.c.invoice_id.in_(invoice_ids))).rowcount,
+        'invoices': db.session.execute(delete(invoices_table).where(invoices_table.c.id.in_(invoice_ids))).rowcount,
+    }
+    db.session.commit()
+    return counts
 
+def delete_invoices(invoice_ids=None, filters=None, chunk_size=None):
+    """
+    Set-based delete of invoices, their line items, item taxes and rollup
+    contributions: either the given ids or every invoice matching `filters`
+    (Core conditions, see export.build_export_filters).
+    Works in chunks of ids, each removed with one DELETE per table in its own
+    transaction, so locks stay short whatever the size of the range. A failure
+    leaves the chunks before it deleted (each one consistent) and is raised.
+    Nothing is cached per worker, so any worker accepts the deleted files
+    again right away.
+    Returns the rows deleted: {'invoices': n, 'items': n, 'taxes': n}.
+    """
+    if chunk_size is None:
+        chunk_size = current_app.config.get('XML_DELETE_CHUNK_SIZE', DEFAULT_DELETE_CHUNK_SIZE)
+    invoices_table = Invoice.__table__
+    columns = (invoices_table.c.id,)
+    totals = {'invoices': 0, 'items': 0, 'taxes': 0}
+    
+    if invoice_ids is not None:
+        ids = sorted(set(invoice_ids))
+        chunks = (
+            db.session.execute(select(*columns).where(invoices_table.c.id.in_(batch))).all()
+            for batch in (ids[start:start + chunk_size] for start in range(0, len(ids), chunk_size))
+        )
+    else:
+        def keyset_chunks():
+            last_id = 0
+            while True:
+                rows = db.session.execute(
+                    select(*columns)
+                    .where(*(filters or ()), invoices_table.c.id > last_id)
+                    .order_by(invoices_table.c.id)
+                    .limit(chunk_size)
+                ).all()
+                if not rows:
+                    return
+                last_id = rows[-1].id
+                yield rows
+        chunks = keyset_chunks()
+    
+    try:
+        for rows in chunks:
+            if not rows:
+                continue
+            with stage('xml', 'delete'):
+                counts = _delete_invoice_chunk(rows)
+            for key, value in counts.items():
+                totals[key] += value
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if totals['invoices']:
+            invalidate_invoice_count()
+    
+    logger.info(f"Deleted {totals['invoices']} invoices ({totals['items']} items, {totals['taxes']} item taxes)")
+    return totals
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""XML Module Storage - Compressed copies of the original XML files"""
+import logging
+import zlib
+from .parser import parse_xml_content
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # Optional: zlib is always available
+    zstandard = None
+
+CODECS = ('zstd', 'zlib')
+
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 6
+
+# Bytes read at a time when compressing a streamed upload
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def resolve_codec(name=None):
+    """'zstd' when requested (or 'auto') and installed, otherwise 'zlib'."""
+    name = (name or 'auto').lower()
+    if name in ('auto', 'zstd') and zstandard is not None:
+        return 'zstd'
+    if name == 'zstd':
+        logger.warning("zstandard is not installed, storing XML with zlib")
+    return 'zlib'
+
+
+def _compressor(codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(ZLIB_LEVEL)
+
+
+def compress_xml(content, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+    return zlib.compress(content, ZLIB_LEVEL)
+
+
+def compress_stream(stream, codec):
+    """Compresses a seekable stream chunk by chunk (pointer left at 0)."""
+    compressor = _compressor(codec)
+    parts = []
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+        parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    stream.seek(0)
+    return b''.join(parts)
+
+
+def decompress_xml(blob, codec):
+    """Original XML bytes of a stored blob."""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This XML was stored with zstd but the 'zstandard' package is not installed")
+        # Streamed frames may not record their size: decompress through a reader
+        return zstandard.ZstdDecompressor().decompressobj().decompress(blob)
+    if codec == 'zlib':
+        return zlib.decompress(blob)
+    raise ValueError(f"Unknown XML codec '{codec}'")
+
+
+def parse_and_pack(content, streaming_threshold=None, codec=None):
+    """
+    parse_xml_content plus the compressed original under 'xml_content' /
+    'xml_codec'. Top-level (picklable) so compression also runs on the pool.
+    """
+    data = parse_xml_content(content, streaming_threshold=streaming_threshold)
+    if data and codec:
+        data['xml_content'] = compress_xml(content, codec)
+        data['xml_codec'] = codec
+    return data
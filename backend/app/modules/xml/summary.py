@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""XML Module Summary - Pre-aggregated totals per month, issuer and receiver"""
+import logging
+import re
+from decimal import ROUND_HALF_UP, Decimal
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from app.extensions import db
+from .models import Invoice, InvoiceItemTax, InvoiceRollup, InvoiceTaxRollup
+
+logger = logging.getLogger(__name__)
+
+# Dimensions the summary can be grouped by (all of them form the rollup key)
+SUMMARY_DIMENSIONS = ('period', 'issuer_nit', 'receiver_nit')
+
+PERIOD_PATTERN = re.compile(r'^\d{4}-(0[1-9]|1[0-2])$')
+
+INVOICE_MEASURES = ('invoice_count', 'base_amount', 'tax_amount', 'total_amount')
+TAX_MEASURES = ('tax_count', 'amount')
+
+# Rollup rows written per executemany
+ROLLUP_BATCH_SIZE = 1000
+
+# Scales of the source columns: deltas are rounded like the stored values, so
+# deleting an invoice subtracts exactly what ingesting it added
+INVOICE_SCALE = Decimal('0.01')
+TAX_SCALE = Decimal('0.0001')
+
+
+def _period(issue_date):
+    return issue_date.strftime('%Y-%m') if issue_date else ''
+
+
+def _decimal(value, scale=None):
+    if value is None:
+        return Decimal(0)
+    value = value if isinstance(value, Decimal) else Decimal(str(value))
+    return value.quantize(scale, rounding=ROUND_HALF_UP) if scale is not None else value
+
+
+def rollup_key(issue_date, issuer_nit, receiver_nit):
+    """(period, issuer_nit, receiver_nit) with '' for missing values, as stored in the rollups."""
+    return (_period(issue_date), issuer_nit or '', receiver_nit or '')
+
+
+def add_invoice_deltas(totals, key, count, base_amount, tax_amount, total_amount):
+    current = totals.setdefault(key, [0, Decimal(0), Decimal(0), Decimal(0)])
+    current[0] += count
+    current[1] += _decimal(base_amount, INVOICE_SCALE)
+    current[2] += _decimal(tax_amount, INVOICE_SCALE)
+    current[3] += _decimal(total_amount, INVOICE_SCALE)
+
+
+def add_tax_deltas(taxes, key, tax_key, count, amount):
+    current = taxes.setdefault(key + (tax_key,), [0, Decimal(0)])
+    current[0] += count
+    current[1] += _decimal(amount, TAX_SCALE)
+
+
+def _upsert_increments(model, key_columns, measures, rows):
+    """
+    Adds each row's measures to the existing rollup row with the same key, or
+    inserts it. Uses the dialect's native upsert (MySQL ON DUPLICATE KEY
+    UPDATE, SQLite/PostgreSQL ON CONFLICT) so concurrent ingests never lose
+    increments. Rows are written in key order: two transactions touching
+    the same groups lock them in the same order instead of deadlocking.
+    """
+    table = model.__table__
+    rows = sorted(rows, key=lambda row: tuple(row[name] for name in key_columns))
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_duplicate_key_update({name: table.c[name] + stmt.inserted[name] for name in measures})
+    elif dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={name: table.c[name] + stmt.excluded[name] for name in measures}
+        )
+    else:
+        # Generic fallback: UPDATE, then INSERT when no row matched
+        for row in rows:
+            result = db.session.execute(
+                update(table)
+                .where(*(table.c[name] == row[name] for name in key_columns))
+                .values({name: table.c[name] + row[name] for name in measures})
+            )
+            if result.rowcount == 0:
+                db.session.execute(insert(table), [row])
+        return
+
+    for start in range(0, len(rows), ROLLUP_BATCH_SIZE):
+        db.session.execute(stmt, rows[start:start + ROLLUP_BATCH_SIZE])
+
+
+def _delete_emptied(model, key_columns, count_column, deltas):
+    """
+    Removes the rollup rows left without invoices (or taxes). Only the keys
+    whose count went down can be empty: they are looked up through the
+    group's unique key instead of scanning the unindexed count column.
+    """
+    keys = sorted(key for key, values in deltas.items() if values[0] < 0)
+    table = model.__table__
+    key_expr = tuple_(*(table.c[name] for name in key_columns))
+    for start in range(0, len(keys), ROLLUP_BATCH_SIZE):
+        db.session.execute(
+            delete(table).where(key_expr.in_(keys[start:start + ROLLUP_BATCH_SIZE]), table.c[count_column] <= 0)
+        )
+
+
+def apply_rollup_deltas(totals, taxes):
+    """
+    Applies accumulated deltas ({key: [measures]}) to both rollup tables in the
+    current transaction (the caller commits). Groups left without invoices
+    are removed.
+    """
+    invoice_key = SUMMARY_DIMENSIONS
+    tax_key = SUMMARY_DIMENSIONS + ('tax_key',)
+
+    if totals:
+        _upsert_increments(InvoiceRollup, invoice_key, INVOICE_MEASURES, [
+            dict(zip(invoice_key + INVOICE_MEASURES, key + tuple(values)))
+            for key, values in totals.items()
+        ])
+    if taxes:
+        _upsert_increments(InvoiceTaxRollup, tax_key, TAX_MEASURES, [
+            dict(zip(tax_key + TAX_MEASURES, key + tuple(values)))
+            for key, values in taxes.items()
+        ])
+
+    _delete_emptied(InvoiceRollup, invoice_key, 'invoice_count', totals)
+    _delete_emptied(InvoiceTaxRollup, tax_key, 'tax_count', taxes)
+
+
+def add_invoices_to_rollups(invoices, tax_rows):
+    """
+    Ingest hook. `invoices` are the inserted parse dicts with their new 'id';
+    `tax_rows` the invoice_item_taxes rows inserted for them.
+    """
+    totals = {}
+    taxes = {}
+    key_by_invoice = {}
+    for data in invoices:
+        key = rollup_key(data['issue_date'], data['issuer_nit'], data['receiver_nit'])
+        key_by_invoice[data['id']] = key
+        add_invoice_deltas(totals, key, 1, data['base_amount'], data['tax_amount'], data['total_amount'])
+
+    for row in tax_rows:
+        add_tax_deltas(taxes, key_by_invoice[row['invoice_id']], row['tax_key'], 1, row['amount'])
+
+    apply_rollup_deltas(totals, taxes)
+
+
+def remove_invoices_from_rollups(invoice_ids):
+    """Delete hook: subtracts the given invoices (still in the database) from the rollups."""
+    if not invoice_ids:
+        return
+
+    invoices = Invoice.__table__
+    item_taxes = InvoiceItemTax.__table__
+    totals = {}
+    taxes = {}
+    key_by_invoice = {}
+
+    for row in db.session.execute(
+        select(
+            invoices.c.id, invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit,
+            invoices.c.base_amount, invoices.c.tax_amount, invoices.c.total_amount
+        ).where(invoices.c.id.in_(invoice_ids))
+    ):
+        key = rollup_key(row.issue_date, row.issuer_nit, row.receiver_nit)
+        key_by_invoice[row.id] = key
+        add_invoice_deltas(totals, key, -1, -_decimal(row.base_amount), -_decimal(row.tax_amount), -_decimal(row.total_amount))
+
+    for row in db.session.execute(
+        select(item_taxes.c.invoice_id, item_taxes.c.tax_key, func.count(), func.sum(item_taxes.c.amount))
+        .where(item_taxes.c.invoice_id.in_(invoice_ids))
+        .group_by(item_taxes.c.invoice_id, item_taxes.c.tax_key)
+    ):
+        invoice_id, tax_key, count, amount = row
+        add_tax_deltas(taxes, key_by_invoice[invoice_id], tax_key, -count, -_decimal(amount))
+
+    apply_rollup_deltas(totals, taxes)
+
+
+def rebuild_rollups():
+    """
+    Recomputes both rollup tables from invoices and invoice_item_taxes in one
+    transaction. The database groups by day; days are folded into months here,
+    so the same SQL runs on MySQL and SQLite.
+    """
+    invoices = Invoice.__table__
+    item_taxes = InvoiceItemTax.__table__
+    totals = {}
+    taxes = {}
+
+    for row in db.session.execute(
+        select(
+            invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit, func.count(),
+            func.sum(invoices.c.base_amount), func.sum(invoices.c.tax_amount), func.sum(invoices.c.total_amount)
+        ).group_by(invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit)
+    ):
+        issue_date, issuer_nit, receiver_nit, count, base_amount, tax_amount, total_amount = row
+        add_invoice_deltas(totals, rollup_key(issue_date, issuer_nit, receiver_nit), count, base_amount, tax_amount, total_amount)
+
+    for row in db.session.execute(
+        select(
+            invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit, item_taxes.c.tax_key,
+            func.count(), func.sum(item_taxes.c.amount)
+        )
+        .select_from(item_taxes.join(invoices, item_taxes.c.invoice_id == invoices.c.id))
+        .group_by(invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit, item_taxes.c.tax_key)
+    ):
+        issue_date, issuer_nit, receiver_nit, tax_key, count, amount = row
+        add_tax_deltas(taxes, rollup_key(issue_date, issuer_nit, receiver_nit), tax_key, count, amount)
+
+    db.session.execute(delete(InvoiceTaxRollup.__table__))
+    db.session.execute(delete(InvoiceRollup.__table__))
+    apply_rollup_deltas(totals, taxes)
+    db.session.commit()
+
+    logger.info(f"Rebuilt summary rollups: {len(totals)} groups, {len(taxes)} tax groups")
+    return len(totals), len(taxes)
+
+
+def parse_summary_args(args):
+    """
+    build_summary() keyword arguments from a query string mapping.
+    Raises ValueError with a user-facing message on malformed input.
+    """
+    group_by = [name.strip() for name in (args.get('group_by', 'period') or '').split(',') if name.strip()]
+    unknown = [name for name in group_by if name not in SUMMARY_DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Unsupported group_by '{', '.join(unknown)}'. Use any of: {', '.join(SUMMARY_DIMENSIONS)}")
+
+    periods = {name: args.get(name) or None for name in ('period_from', 'period_to')}
+    if any(value and not PERIOD_PATTERN.match(value) for value in periods.values()):
+        raise ValueError("Invalid period, expected YYYY-MM")
+
+    return dict(
+        group_by=tuple(dict.fromkeys(group_by)),
+        issuer_nit=args.get('issuer_nit'),
+        receiver_nit=args.get('receiver_nit'),
+        **periods
+    )
+
+
+def summary_statements(group_by=('period',), period_from=None, period_to=None, issuer_nit=None, receiver_nit=None):
+    """(totals statement, per-tax statement) over the rollup tables; see assemble_summary()."""
+    invoice_table = InvoiceRollup.__table__
+    tax_table = InvoiceTaxRollup.__table__
+
+    def conditions(table):
+        where = []
+        if period_from:
+            where.append(table.c.period >= period_from)
+        if period_to:
+            where.append(table.c.period <= period_to)
+        if issuer_nit:
+            where.append(table.c.issuer_nit == issuer_nit)
+        if receiver_nit:
+            where.append(table.c.receiver_nit == receiver_nit)
+        return where
+
+    group_columns = [invoice_table.c[name] for name in group_by]
+    totals_stmt = (
+        select(*group_columns, *(func.sum(invoice_table.c[name]) for name in INVOICE_MEASURES))
+        .where(*conditions(invoice_table))
+        .group_by(*group_columns)
+        .order_by(*group_columns)
+    )
+    tax_group_columns = [tax_table.c[name] for name in group_by]
+    taxes_stmt = (
+        select(*tax_group_columns, tax_table.c.tax_key, func.sum(tax_table.c.amount))
+        .where(*conditions(tax_table))
+        .group_by(*tax_group_columns, tax_table.c.tax_key)
+        .order_by(tax_table.c.tax_key)
+    )
+    return totals_stmt, taxes_stmt
+
+
+def build_summary(group_by=('period',), period_from=None, period_to=None, issuer_nit=None, receiver_nit=None):
+    """
+    Totals and per-tax breakdown grouped by any subset of SUMMARY_DIMENSIONS,
+    read from the rollup tables only. Periods are 'YYYY-MM' strings (inclusive).
+    """
+    totals_stmt, taxes_stmt = summary_statements(group_by, period_from, period_to, issuer_nit, receiver_nit)
+    return assemble_summary(group_by, db.session.execute(totals_stmt).all(), db.session.execute(taxes_stmt).all())
+
+
+def assemble_summary(group_by, total_rows, tax_rows):
+    """The summary JSON from the rows of summary_statements()."""
+    rows = {}
+    for row in total_rows:
+        key = tuple(row[:len(group_by)])
+        entry = {name: (value or None) for name, value in zip(group_by, key)}
+        count, base_amount, tax_amount, total_amount = row[len(group_by):]
+        entry.update({
+            'invoice_count': int(count or 0),
+            'base_amount': _decimal(base_amount),
+            'tax_amount': _decimal(tax_amount),
+            'total_amount': _decimal(total_amount),
+            'taxes': {}
+        })
+        rows[key] = entry
+
+    for row in tax_rows:
+        key = tuple(row[:len(group_by)])
+        tax_key, amount = row[len(group_by):]
+        if key in rows:
+            rows[key]['taxes'][tax_key] = _decimal(amount)
+
+    # Grand totals are summed as Decimal, then everything is rendered as float
+    totals = {'invoice_count': 0, 'base_amount': Decimal(0), 'tax_amount': Decimal(0), 'total_amount': Decimal(0), 'taxes': {}}
+    for entry in rows.values():
+        for name in INVOICE_MEASURES:
+            totals[name] += entry[name]
+        for tax_key, amount in entry['taxes'].items():
+            totals['taxes'][tax_key] = totals['taxes'].get(tax_key, Decimal(0)) + amount
+
+    for entry in list(rows.values()) + [totals]:
+        for name in INVOICE_MEASURES[1:]:
+            entry[name] = float(entry[name])
+        entry['taxes'] = {tax_key: float(amount) for tax_key, amount in entry['taxes'].items()}
+
+    return {'group_by': list(group_by), 'rows': list(rows.values()), 'totals': totals}
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Schema - Database setup run once per deploy with `flask schema upgrade`
+
+Workers never touch the schema at boot. The upgrade command (run by the
+container before gunicorn starts):
+1. waits for the database to accept connections,
+2. creates missing tables from the models (db.create_all), and
+3. applies the SQL files of backend/migrations not yet recorded in
+   schema_migrations, in file name order, each followed by its data step
+   (DATA_MIGRATIONS) when it has one.
+
+Migrations are written for MySQL. Re-running a statement whose change is
+already there (column, index or table exists) is not an error, so databases
+migrated by hand before this command existed upgrade cleanly. On other
+databases (SQLite in development) the files are only recorded: create_all
+already builds the current schema from the models, but data steps run
+everywhere.
+"""
+import logging
+import os
+import re
+import time
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect, select, text
+from sqlalchemy.exc import OperationalError
+from .extensions import db
+
+logger = logging.getLogger(__name__)
+
+schema_cli = AppGroup('schema', help='Database schema commands.')
+
+# MySQL errors meaning "this change is already applied"
+ALREADY_APPLIED_ERRORS = {
+    1050,  # Table already exists
+    1060,  # Duplicate column name
+    1061,  # Duplicate key name
+    1091,  # Can't DROP; check that column/key exists
+}
+
+# Statements in migration files kept for people running them by hand
+SKIPPED_STATEMENTS = re.compile(r'^(DESCRIBE|SHOW|SELECT)\b', re.IGNORECASE)
+
+DOCSTRING_PATTERN = re.compile(r'^\s*""".*?"""', re.DOTALL)
+
+
+class SchemaMigration(db.Model):
+    """SQL migration files already applied to this database."""
+    __tablename__ = 'schema_migrations'
+
+    filename = db.Column(db.String(255), primary_key=True)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+def migrations_dir():
+    return current_app.config.get(
+        'MIGRATIONS_DIR', os.path.join(os.path.dirname(current_app.root_path), 'migrations')
+    )
+
+
+def migration_files():
+    directory = migrations_dir()
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name for name in os.listdir(directory) if name.endswith('.sql'))
+
+
+def read_statements(path):
+    """Executable statements of a migration file (header docstring, comments and DESCRIBEs removed)."""
+    with open(path, encoding='utf-8') as fh:
+        sql = DOCSTRING_PATTERN.sub('', fh.read(), count=1)
+    sql = '\n'.join(line for line in sql.splitlines() if not line.strip().startswith('--'))
+    statements = []
+    for statement in sql.split(';'):
+        statement = statement.strip()
+        if statement and not SKIPPED_STATEMENTS.match(statement):
+            statements.append(statement)
+    return statements
+
+
+def _backfill_item_taxes():
+    from .modules.xml.services import backfill_item_taxes
+    from .modules.xml.summary import rebuild_rollups
+
+    items = tax_rows = 0
+    for _, batch_items, batch_tax_rows in backfill_item_taxes():
+        items += batch_items
+        tax_rows += batch_tax_rows
+    groups, tax_groups = rebuild_rollups()
+    logger.info(f"Backfilled {tax_rows} item tax rows ({items} items), rebuilt {groups} + {tax_groups} rollup groups")
+
+
+# Python steps filling data for a migration file, run right after its SQL
+# (the file is recorded only once the step succeeded)
+DATA_MIGRATIONS = {
+    'backfill_invoice_item_taxes.sql': _backfill_item_taxes,
+}
+
+
+def _import_models():
+    # Registers every table in db.metadata
+    from .modules.xml import models as xml_models  # noqa: F401
+    from .modules.excel import models as excel_models  # noqa: F401
+
+
+def wait_for_database(timeout):
+    """Retries a trivial query until the database answers or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with db.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            return
+        except OperationalError as e:
+            if time.monotonic() >= deadline:
+                raise
+            logger.warning(f"Database not reachable yet ({str(e.orig)}), retrying")
+            time.sleep(2)
+
+
+def _error_code(error):
+    args = getattr(getattr(error, 'orig', None), 'args', ())
+    return args[0] if args and isinstance(args[0], int) else None
+
+
+def apply_migration(filename):
+    """Runs one migration file in MySQL, tolerating changes that are already applied."""
+    for statement in read_statements(os.path.join(migrations_dir(), filename)):
+        try:
+            db.session.execute(text(statement))
+        except OperationalError as e:
+            if _error_code(e) not in ALREADY_APPLIED_ERRORS:
+                raise
+            db.session.rollback()
+            logger.info(f"{filename}: already applied ({str(e.orig)})")
+
+
+def pending_migrations():
+    applied = set(db.session.execute(select(SchemaMigration.filename)).scalars())
+    return [name for name in migration_files() if name not in applied]
+
+
+def upgrade_schema():
+    """create_all plus pending SQL migrations. Returns the files applied (or recorded)."""
+    _import_models()
+    db.create_all()
+    if db.engine.dialect.name == 'sqlite':
+        from .modules.xml.search import ensure_sqlite_fts
+        if ensure_sqlite_fts():
+            logger.info("Built the invoice_items full-text index")
+
+    run_sql = db.engine.dialect.name == 'mysql'
+    done = []
+    for filename in pending_migrations():
+        if run_sql:
+            apply_migration(filename)
+        if filename in DATA_MIGRATIONS:
+            DATA_MIGRATIONS[filename]()
+        db.session.add(SchemaMigration(filename=filename))
+        db.session.commit()
+        done.append(filename)
+    return done
+
+
+@schema_cli.command('upgrade')
+@click.option('--wait', default=60, show_default=True, help='Seconds to wait for the database to come up.')
+def upgrade(wait):
+    """Creates missing tables and applies pending migrations (safe to re-run)."""
+    wait_for_database(wait)
+    done = upgrade_schema()
+    verb = 'Applied' if db.engine.dialect.name == 'mysql' else 'Recorded'
+    for filename in done:
+        click.echo(f"{verb} {filename}")
+    click.echo(f"Schema up to date ({len(done)} migrations {verb.lower()})")
+
+
+@schema_cli.command('status')
+def status():
+    """Lists migration files and whether they are applied."""
+    _import_models()
+    if not inspect(db.engine).has_table(SchemaMigration.__tablename__):
+        click.echo("schema_migrations does not exist: run `flask schema upgrade`")
+        return
+    pending = set(pending_migrations())
+    for filename in migration_files():
+        click.echo(f"{'pending' if filename in pending else 'applied'}  {filename}")
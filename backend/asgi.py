@@ -0,0 +1,8 @@
+"""
+ASGI Entry Point for the async serving mode
+Used by uvicorn: the read endpoints run on the event loop, every other
+endpoint is served by the same Flask application as wsgi.py
+"""
+from app.asgi import create_asgi_app
+
+app = create_asgi_app()
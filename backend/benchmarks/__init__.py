@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks - Standalone performance scripts, run from backend/ with `python -m benchmarks.<name>`"""
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: Verif / COMCON / folio rules of the Excel audit.
+
+Compares the row-wise reference rules (DataFrame.apply per row) with the
+vectorized apply_audit_rules() on synthetic ledgers, checks that both give
+identical frames and prints the timings.
+
+    cd backend && python -m benchmarks.bench_excel_rules --sizes 10000,100000,1000000
+"""
+import argparse
+import json
+import time
+import pandas as pd
+from app.modules.excel.services import (
+    apply_audit_rules, calculate_comcon, calculate_verif, extract_numeric_folio
+)
+from .generators import make_ledger
+
+
+def legacy_audit_rules(df):
+    """The original row-wise implementation, kept here as the baseline."""
+    df.dropna(how='all', inplace=True)
+    for col in ['Total', 'Impuesto']:
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0)
+    df['Base'] = df['Total'] - df['Impuesto']
+    df['Verif'] = df.apply(calculate_verif, axis=1)
+    df['Folio_Num'] = df['Folio'].apply(extract_numeric_folio)
+    df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+    df.sort_values(by=['Tipo', 'Fecha', 'Folio_Num'], inplace=True)
+    df['Diff'] = df.groupby('Tipo')['Folio_Num'].diff()
+    df['COMCON'] = df['Diff'].apply(calculate_comcon)
+    return df
+
+
+def _timed(func, df):
+    start = time.perf_counter()
+    result = func(df.copy())
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma separated row counts')
+    args = parser.parse_args()
+
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',')):
+        df = make_ledger(rows)
+        legacy, legacy_s = _timed(legacy_audit_rules, df)
+        vectorized, vectorized_s = _timed(apply_audit_rules, df)
+        pd.testing.assert_frame_equal(legacy, vectorized)
+
+        results.append({
+            'rows': rows,
+            'legacy_s': round(legacy_s, 3),
+            'vectorized_s': round(vectorized_s, 3),
+            'speedup': round(legacy_s / vectorized_s, 1) if vectorized_s else None,
+            'identical': True,
+        })
+        print(json.dumps(results[-1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks - Synthetic inputs: DIAN UBL 2.1 invoices and audit ledgers.
+
+Invoices carry the blocks a real DIAN file has (DIAN extensions, signature,
+parties with addresses, payment means, per-scheme tax totals, lines with
+their own taxes), so parsing cost and file size resemble production
+uploads. Everything is deterministic for a given seed.
+"""
+import io
+import random
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+
+NS_INVOICE = 'urn:oasis:names:specification:ubl:schema:xsd:Invoice-2'
+NS_ATTACHED = 'urn:oasis:names:specification:ubl:schema:xsd:AttachedDocument-2'
+NS_COMMON = (
+    'xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2" '
+    'xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2" '
+    'xmlns:ext="urn:oasis:names:specification:ubl:schema:xsd:CommonExtensionComponents-2" '
+    'xmlns:sts="dian:gov:co:facturaelectronica:Structures-2-1" '
+    'xmlns:ds="http://www.w3.org/2000/09/xmldsig#"'
+)
+
+# (scheme name, DIAN scheme id, percent, weight). Percent None = tax without rate
+TAX_MIXES = {
+    'iva19': [('IVA', '01', '19.00', 1)],
+    'standard': [('IVA', '01', '19.00', 8), ('IVA', '01', '5.00', 1), ('IVA', '01', '0.00', 1)],
+    'mixed': [
+        ('IVA', '01', '19.00', 6), ('IVA', '01', '5.00', 2), ('IVA', '01', '0.00', 1),
+        ('INC', '04', '8.00', 2), ('ICA', '03', None, 1),
+    ],
+}
+
+# Lines that carry two taxes (e.g. IVA + INC on restaurant items), per mix
+DOUBLE_TAX_RATIO = 0.1
+
+CENT = Decimal('0.01')
+
+PRODUCTS = (
+    'Gaseosa 400ml', 'Papas fritas 150g', 'Arroz 1kg', 'Aceite vegetal 1L', 'Servicio de transporte',
+    'Licencia software mensual', 'Tornillo hexagonal 1/4', 'Resma papel carta', 'Cafe tostado 500g',
+    'Mantenimiento preventivo', 'Cable UTP Cat6 305m', 'Honorarios profesionales',
+)
+
+REQUIRED_LEDGER_COLUMNS = ['Fecha', 'Folio', 'Tipo', 'Total', 'Impuesto']
+
+
+def _money(value):
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _tax_mix(tax_mix):
+    """A TAX_MIXES name or an explicit list of (name, scheme id, percent, weight)."""
+    if isinstance(tax_mix, str):
+        return TAX_MIXES[tax_mix]
+    return list(tax_mix)
+
+
+def _pick_taxes(rng, mix):
+    choices = [entry[:3] for entry in mix]
+    weights = [entry[3] for entry in mix]
+    taxes = [rng.choices(choices, weights)[0]]
+    if len(mix) > 1 and rng.random() < DOUBLE_TAX_RATIO:
+        other = rng.choices(choices, weights)[0]
+        if other[0] != taxes[0][0]:
+            taxes.append(other)
+    return taxes
+
+
+def _tax_amount(base, percent):
+    return _money(base * Decimal(percent) / 100) if percent is not None else _money(base * Decimal('0.0096'))
+
+
+def _subtotal(base, amount, name, scheme_id, percent):
+    percent_xml = f'<cbc:Percent>{percent}</cbc:Percent>' if percent is not None else ''
+    return (
+        '<cac:TaxSubtotal>'
+        f'<cbc:TaxableAmount currencyID="COP">{base}</cbc:TaxableAmount>'
+        f'<cbc:TaxAmount currencyID="COP">{amount}</cbc:TaxAmount>'
+        f'<cac:TaxCategory>{percent_xml}'
+        f'<cac:TaxScheme><cbc:ID>{scheme_id}</cbc:ID><cbc:Name>{name}</cbc:Name></cac:TaxScheme>'
+        '</cac:TaxCategory></cac:TaxSubtotal>'
+    )
+
+
+def _party(role, nit, name, city):
+    address = (
+        f'<cbc:ID>11001</cbc:ID><cbc:CityName>{city}</cbc:CityName>'
+        '<cbc:CountrySubentity>Bogota D.C.</cbc:CountrySubentity><cbc:CountrySubentityCode>11</cbc:CountrySubentityCode>'
+        '<cac:AddressLine><cbc:Line>Calle 100 # 10-20</cbc:Line></cac:AddressLine>'
+        '<cac:Country><cbc:IdentificationCode>CO</cbc:IdentificationCode>'
+        '<cbc:Name languageID="es">Colombia</cbc:Name></cac:Country>'
+    )
+    return (
+        f'<cac:{role}><cbc:AdditionalAccountID>1</cbc:AdditionalAccountID><cac:Party>'
+        f'<cac:PartyName><cbc:Name>{name}</cbc:Name></cac:PartyName>'
+        f'<cac:PhysicalLocation><cac:Address>{address}</cac:Address></cac:PhysicalLocation>'
+        f'<cac:PartyTaxScheme><cbc:RegistrationName>{name}</cbc:RegistrationName>'
+        f'<cbc:CompanyID schemeAgencyID="195" schemeID="7" schemeName="31">{nit}</cbc:CompanyID>'
+        f'<cbc:TaxLevelCode listName="48">R-99-PN</cbc:TaxLevelCode>'
+        f'<cac:RegistrationAddress>{address}</cac:RegistrationAddress>'
+        '<cac:TaxScheme><cbc:ID>01</cbc:ID><cbc:Name>IVA</cbc:Name></cac:TaxScheme></cac:PartyTaxScheme>'
+        f'<cac:PartyLegalEntity><cbc:RegistrationName>{name}</cbc:RegistrationName>'
+        f'<cbc:CompanyID schemeAgencyID="195" schemeID="7" schemeName="31">{nit}</cbc:CompanyID></cac:PartyLegalEntity>'
+        '<cac:Contact><cbc:Telephone>6015550000</cbc:Telephone>'
+        '<cbc:ElectronicMail>facturacion@example.co</cbc:ElectronicMail></cac:Contact>'
+        f'</cac:Party></cac:{role}>'
+    )
+
+
+def _extensions(rng, number):
+    """DIAN extensions and an XAdES signature: the bulky part of every real file."""
+    signature = ''.join(rng.choices('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/', k=2048))
+    return (
+        '<ext:UBLExtensions><ext:UBLExtension><ext:ExtensionContent><sts:DianExtensions>'
+        '<sts:InvoiceControl><sts:InvoiceAuthorization>18760000001</sts:InvoiceAuthorization>'
+        '<sts:AuthorizationPeriod><cbc:StartDate>2024-01-01</cbc:StartDate><cbc:EndDate>2025-12-31</cbc:EndDate></sts:AuthorizationPeriod>'
+        '<sts:AuthorizedInvoices><sts:Prefix>SETT</sts:Prefix><sts:From>1</sts:From><sts:To>5000000</sts:To></sts:AuthorizedInvoices>'
+        '</sts:InvoiceControl>'
+        '<sts:InvoiceSource><cbc:IdentificationCode listAgencyID="6" listAgencyName="United Nations Economic Commission for Europe" '
+        'listSchemeURI="urn:oasis:names:specification:ubl:codelist:gc:CountryIdentificationCode-2.1">CO</cbc:IdentificationCode></sts:InvoiceSource>'
+        '<sts:SoftwareProvider><sts:ProviderID schemeAgencyID="195" schemeID="4" schemeName="31">900373076</sts:ProviderID>'
+        '<sts:SoftwareID schemeAgencyID="195">56f2ae4e-9812-4fad-9255-08fcfcd5ccb0</sts:SoftwareID></sts:SoftwareProvider>'
+        f'<sts:QRCode>NumFac: {number} https://catalogo-vpfe.dian.gov.co/document/searchqr</sts:QRCode>'
+        '</sts:DianExtensions></ext:ExtensionContent></ext:UBLExtension>'
+        '<ext:UBLExtension><ext:ExtensionContent><ds:Signature Id="xmldsig">'
+        '<ds:SignedInfo><ds:CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+        '<ds:SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/></ds:SignedInfo>'
+        f'<ds:SignatureValue>{signature}</ds:SignatureValue>'
+        '</ds:Signature></ext:ExtensionContent></ext:UBLExtension></ext:UBLExtensions>'
+    )
+
+
+def make_invoice_xml(lines=10, seed=0, tax_mix='standard', uuid=None, issuer_nit=None, receiver_nit=None):
+    """
+    DIAN UBL 2.1 Invoice as bytes with `lines` invoice lines whose taxes are
+    drawn from `tax_mix` (a TAX_MIXES name or a list of
+    (name, scheme id, percent, weight)). Header totals and the per-scheme
+    TaxTotal blocks are consistent with the lines.
+    """
+    rng = random.Random(seed)
+    mix = _tax_mix(tax_mix)
+    number = f"SETT{seed + 1}"
+    uuid = uuid or '%096x' % rng.getrandbits(384)  # CUFE: SHA-384 hex
+    issuer_nit = issuer_nit or str(900000000 + rng.randrange(200))
+    receiver_nit = receiver_nit or str(800000000 + rng.randrange(2000))
+    issue_date = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+
+    line_xml = []
+    base_total = Decimal(0)
+    tax_groups = {}  # (name, scheme id, percent) -> [taxable, amount]
+    for position in range(1, lines + 1):
+        quantity = rng.randint(1, 24)
+        unit_price = _money(rng.uniform(500, 250000))
+        line_base = _money(unit_price * quantity)
+        base_total += line_base
+
+        taxes_xml = []
+        for name, scheme_id, percent in _pick_taxes(rng, mix):
+            amount = _tax_amount(line_base, percent)
+            group = tax_groups.setdefault((name, scheme_id, percent), [Decimal(0), Decimal(0)])
+            group[0] += line_base
+            group[1] += amount
+            taxes_xml.append(
+                f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{amount}</cbc:TaxAmount>'
+                f'{_subtotal(line_base, amount, name, scheme_id, percent)}</cac:TaxTotal>'
+            )
+
+        line_xml.append(
+            f'<cac:InvoiceLine><cbc:ID>{position}</cbc:ID>'
+            f'<cbc:InvoicedQuantity unitCode="94">{quantity}</cbc:InvoicedQuantity>'
+            f'<cbc:LineExtensionAmount currencyID="COP">{line_base}</cbc:LineExtensionAmount>'
+            '<cbc:FreeOfChargeIndicator>false</cbc:FreeOfChargeIndicator>'
+            f'{"".join(taxes_xml)}'
+            f'<cac:Item><cbc:Description>{rng.choice(PRODUCTS)}</cbc:Description>'
+            f'<cac:StandardItemIdentification><cbc:ID schemeID="999">{rng.randrange(10 ** 8)}</cbc:ID></cac:StandardItemIdentification></cac:Item>'
+            f'<cac:Price><cbc:PriceAmount currencyID="COP">{unit_price}</cbc:PriceAmount>'
+            '<cbc:BaseQuantity unitCode="94">1</cbc:BaseQuantity></cac:Price></cac:InvoiceLine>'
+        )
+
+    # Header: one TaxTotal per scheme, one TaxSubtotal per rate
+    header_taxes = []
+    tax_total = Decimal(0)
+    schemes = {}  # (name, scheme id) -> [subtotal XML list, amount]
+    for (name, scheme_id, percent), (taxable, amount) in tax_groups.items():
+        scheme = schemes.setdefault((name, scheme_id), [[], Decimal(0)])
+        scheme[0].append(_subtotal(taxable, amount, name, scheme_id, percent))
+        scheme[1] += amount
+    for (name, scheme_id), (subtotals, amount) in sorted(schemes.items(), key=lambda entry: entry[0][1]):
+        tax_total += amount
+        header_taxes.append(
+            f'<cac:TaxTotal><cbc:TaxAmount currencyID="COP">{amount}</cbc:TaxAmount>'
+            f'<cbc:RoundingAmount currencyID="COP">0.00</cbc:RoundingAmount>{"".join(subtotals)}</cac:TaxTotal>'
+        )
+    payable = base_total + tax_total
+
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="no"?><Invoice xmlns="{NS_INVOICE}" {NS_COMMON}>'
+        f'{_extensions(rng, number)}'
+        '<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID><cbc:CustomizationID>10</cbc:CustomizationID>'
+        '<cbc:ProfileID>DIAN 2.1: Factura Electrónica de Venta</cbc:ProfileID><cbc:ProfileExecutionID>1</cbc:ProfileExecutionID>'
+        f'<cbc:ID>{number}</cbc:ID>'
+        f'<cbc:UUID schemeID="1" schemeName="CUFE-SHA384">{uuid}</cbc:UUID>'
+        f'<cbc:IssueDate>{issue_date}</cbc:IssueDate><cbc:IssueTime>10:15:00-05:00</cbc:IssueTime>'
+        '<cbc:InvoiceTypeCode>01</cbc:InvoiceTypeCode><cbc:Note>Factura generada para pruebas de rendimiento</cbc:Note>'
+        f'<cbc:DocumentCurrencyCode>COP</cbc:DocumentCurrencyCode><cbc:LineCountNumeric>{lines}</cbc:LineCountNumeric>'
+        + _party('AccountingSupplierParty', issuer_nit, f'Proveedor {issuer_nit} SAS', 'Bogota')
+        + _party('AccountingCustomerParty', receiver_nit, f'Cliente {receiver_nit} Ltda', 'Medellin')
+        + f'<cac:PaymentMeans><cbc:ID>{rng.choice("12")}</cbc:ID>'
+        f'<cbc:PaymentMeansCode>{rng.choice(["10", "42", "48"])}</cbc:PaymentMeansCode>'
+        f'<cbc:PaymentDueDate>{issue_date}</cbc:PaymentDueDate></cac:PaymentMeans>'
+        + ''.join(header_taxes)
+        + '<cac:LegalMonetaryTotal>'
+        f'<cbc:LineExtensionAmount currencyID="COP">{base_total}</cbc:LineExtensionAmount>'
+        f'<cbc:TaxExclusiveAmount currencyID="COP">{base_total}</cbc:TaxExclusiveAmount>'
+        f'<cbc:TaxInclusiveAmount currencyID="COP">{payable}</cbc:TaxInclusiveAmount>'
+        f'<cbc:PayableAmount currencyID="COP">{payable}</cbc:PayableAmount></cac:LegalMonetaryTotal>'
+        + ''.join(line_xml)
+        + '</Invoice>'
+    )
+    return document.encode('utf-8')
+
+
+def make_attached_document(invoice_xml, seed=0):
+    """Wraps an Invoice in a DIAN AttachedDocument (invoice as CDATA, as the DIAN sends it)."""
+    inner = invoice_xml.decode('utf-8') if isinstance(invoice_xml, bytes) else invoice_xml
+    document = (
+        f'<?xml version="1.0" encoding="UTF-8" standalone="no"?><AttachedDocument xmlns="{NS_ATTACHED}" {NS_COMMON}>'
+        '<cbc:UBLVersionID>UBL 2.1</cbc:UBLVersionID><cbc:CustomizationID>Documentos adjuntos</cbc:CustomizationID>'
+        '<cbc:ProfileID>Factura Electrónica de Venta</cbc:ProfileID><cbc:ProfileExecutionID>1</cbc:ProfileExecutionID>'
+        f'<cbc:ID>AD{seed + 1}</cbc:ID><cbc:IssueDate>2024-01-01</cbc:IssueDate>'
+        '<cbc:DocumentType>Contenedor de Factura Electrónica</cbc:DocumentType>'
+        '<cac:Attachment><cac:ExternalReference><cbc:MimeCode>text/xml</cbc:MimeCode>'
+        '<cbc:EncodingCode>UTF-8</cbc:EncodingCode>'
+        f'<cbc:Description><![CDATA[{inner}]]></cbc:Description>'
+        '</cac:ExternalReference></cac:Attachment>'
+        '<cac:ParentDocumentLineReference><cbc:LineID>1</cbc:LineID><cac:DocumentReference>'
+        f'<cbc:ID>SETT{seed + 1}</cbc:ID><cbc:IssueDate>2024-01-01</cbc:IssueDate>'
+        '<cbc:DocumentType>ApplicationResponse</cbc:DocumentType>'
+        '<cac:ResultOfVerification><cbc:ValidatorID>Unidad Especial Dirección de Impuestos y Aduanas Nacionales</cbc:ValidatorID>'
+        '<cbc:ValidationResultCode>02</cbc:ValidationResultCode></cac:ResultOfVerification>'
+        '</cac:DocumentReference></cac:ParentDocumentLineReference></AttachedDocument>'
+    )
+    return document.encode('utf-8')
+
+
+def make_invoice_batch(count, lines=10, tax_mix='standard', attached_ratio=0.5, seed=0):
+    """
+    `count` distinct upload payloads as (filename, bytes); about
+    `attached_ratio` of them wrapped in an AttachedDocument.
+    """
+    rng = random.Random(seed)
+    batch = []
+    for index in range(count):
+        invoice_seed = seed * 1_000_000 + index
+        content = make_invoice_xml(lines=lines, seed=invoice_seed, tax_mix=tax_mix)
+        if rng.random() < attached_ratio:
+            batch.append((f"ad{invoice_seed}.xml", make_attached_document(content, seed=invoice_seed)))
+        else:
+            batch.append((f"fv{invoice_seed}.xml", content))
+    return batch
+
+
+def make_ledger(rows, seed=0):
+    """Synthetic ledger with REQUIRED_COLUMNS: jumps, duplicates, odd taxes and blanks included."""
+    rng = np.random.default_rng(seed)
+    steps = rng.choice([0, 1, 2, 5], size=rows, p=[0.02, 0.9, 0.05, 0.03])
+    folios = np.cumsum(steps) + 1000
+    prefixes = rng.choice(['SETT', 'FE-', '', 'F'], size=rows)
+    total = rng.integers(1000, 5_000_000, size=rows).astype(float)
+    tax = np.where(rng.random(rows) < 0.8, np.round(total * 0.19 / 1.19, 2), np.round(total * 0.05, 2))
+    tax[rng.random(rows) < 0.05] = 0
+
+    folio_values = pd.Series([f"{p}{n}" for p, n in zip(prefixes, folios)], dtype=object)
+    folio_values[rng.random(rows) < 0.01] = None
+    return pd.DataFrame({
+        'Fecha': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365, size=rows), unit='D'),
+        'Folio': folio_values,
+        'Tipo': rng.choice(['Emitida', 'Recibida'], size=rows),
+        'Total': total,
+        'Impuesto': tax,
+    })[REQUIRED_LEDGER_COLUMNS]
+
+
+def make_matching_ledger(invoices, seed=0, missing_ratio=0.02, mismatch_ratio=0.03, unknown_ratio=0.01):
+    """
+    Ledger of stored invoices (a DataFrame with invoice_number, issue_date,
+    total_amount and tax_amount) as an accountant would keep it: folios
+    written differently ('FE12' -> 'fe-12'), some invoices left out, some
+    totals off, some rows with folios the database does not have.
+    """
+    rng = np.random.default_rng(seed)
+    rows = len(invoices)
+    ledger = pd.DataFrame({
+        'Fecha': pd.to_datetime(invoices['issue_date']).to_numpy(),
+        'Folio': invoices['invoice_number'].str.lower().str.replace(r'^([a-z]+)', r'\1-', regex=True).to_numpy(),
+        'Tipo': 'Recibida',
+        'Total': invoices['total_amount'].astype(float).to_numpy(),
+        'Impuesto': invoices['tax_amount'].astype(float).to_numpy(),
+    })
+    ledger.loc[rng.random(rows) < mismatch_ratio, 'Total'] += 1000
+    ledger = ledger[rng.random(rows) >= missing_ratio]
+
+    unknown = ledger.sample(frac=unknown_ratio, random_state=seed).assign(
+        Folio=lambda df: [f'X{n}' for n in range(len(df))]
+    )
+    return pd.concat([ledger, unknown]).sample(frac=1, random_state=seed)[REQUIRED_LEDGER_COLUMNS]
+
+
+def ledger_bytes(df, file_format='xlsx'):
+    """A ledger DataFrame serialized as an upload: 'xlsx' (openpyxl) or 'csv'."""
+    buffer = io.BytesIO()
+    if file_format == 'csv':
+        df.to_csv(buffer, index=False)
+    elif file_format == 'xlsx':
+        df.to_excel(buffer, index=False, engine='openpyxl')
+    else:
+        raise ValueError(f"Unsupported ledger format '{file_format}'")
+    return buffer.getvalue()
@@ -0,0 +1,18 @@
+"""
+Database Migration: Result cache columns on excel_reports
+
+Run this SQL in your MySQL database. Each processed ledger is recorded in
+excel_reports with the SHA-256 of the uploaded file and the version of the
+audit rules, so re-uploading the same workbook reuses the stored result.
+"""
+
+-- Add cache columns to excel_reports table
+ALTER TABLE excel_reports
+ADD COLUMN content_hash VARCHAR(64) NULL,
+ADD COLUMN rules_version VARCHAR(20) NULL,
+ADD COLUMN result_id VARCHAR(32) NULL;
+
+CREATE INDEX ix_excel_reports_content_hash ON excel_reports (content_hash);
+
+-- Verify the change
+DESCRIBE excel_reports;
@@ -0,0 +1,25 @@
+"""
+Database Migration: Add claim columns to ingest_jobs table
+
+Run this SQL in your MySQL database. Job workers in any process claim queued
+rows through these columns; running jobs refresh locked_at as a heartbeat,
+and jobs whose worker stopped are queued again (or failed) once it goes stale.
+"""
+
+-- Add claim columns to ingest_jobs table
+ALTER TABLE ingest_jobs
+ADD COLUMN locked_by VARCHAR(64) NULL
+AFTER status;
+
+ALTER TABLE ingest_jobs
+ADD COLUMN locked_at DATETIME NULL
+AFTER locked_by;
+
+ALTER TABLE ingest_jobs
+ADD COLUMN attempts INT NULL DEFAULT 0
+AFTER locked_at;
+
+CREATE INDEX ix_ingest_jobs_status_created ON ingest_jobs (status, created_at);
+
+-- Verify the change
+DESCRIBE ingest_jobs;
@@ -0,0 +1,18 @@
+"""
+Database Migration: Add content_sha256 to invoices table
+
+Run this SQL in your MySQL database. Uploads store the SHA-256 of each
+ingested file; re-uploads of the same bytes are then skipped with one
+batched lookup, before any XML parsing. Existing invoices keep NULL and are
+still caught by the UUID check.
+"""
+
+-- Add content_sha256 column to invoices table
+ALTER TABLE invoices
+ADD COLUMN content_sha256 VARCHAR(64) NULL
+AFTER xml_content;
+
+CREATE INDEX ix_invoices_content_sha256 ON invoices (content_sha256);
+
+-- Verify the change
+DESCRIBE invoices;
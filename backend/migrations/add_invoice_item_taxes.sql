@@ -0,0 +1,29 @@
+"""
+Database Migration: Normalized invoice_item_taxes table
+
+Run this SQL in your MySQL database. New uploads fill the table directly;
+existing items are backfilled from invoice_items.json_taxes in batches
+(one transaction per batch, safe to re-run) by `flask schema upgrade`
+(backfill_invoice_item_taxes.sql), or by hand with:
+
+    flask xml backfill-taxes --batch-size 2000
+"""
+
+-- Create invoice_item_taxes table (one row per tax of each line item)
+CREATE TABLE IF NOT EXISTS invoice_item_taxes (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    item_id INT NOT NULL,
+    invoice_id INT NOT NULL,
+    scheme_name VARCHAR(100) NOT NULL,
+    percent DECIMAL(7, 3) NULL,
+    tax_key VARCHAR(120) NOT NULL,
+    amount DECIMAL(18, 4) NULL,
+    CONSTRAINT fk_invoice_item_taxes_item FOREIGN KEY (item_id) REFERENCES invoice_items (id),
+    CONSTRAINT fk_invoice_item_taxes_invoice FOREIGN KEY (invoice_id) REFERENCES invoices (id),
+    INDEX ix_invoice_item_taxes_item_id (item_id),
+    INDEX ix_invoice_item_taxes_invoice_id (invoice_id),
+    INDEX ix_invoice_item_taxes_tax_key (tax_key)
+);
+
+-- Verify the change
+DESCRIBE invoice_item_taxes;
@@ -0,0 +1,13 @@
+"""
+Database Migration: Composite index for keyset pagination of /api/xml/list
+
+Run this SQL in your MySQL database. The list endpoint pages with
+ORDER BY created_at DESC, id DESC and ?after=<created_at>,<id> cursors,
+which this index serves without scanning or sorting.
+"""
+
+-- Add composite (created_at, id) index to invoices table
+CREATE INDEX ix_invoices_created_at_id ON invoices (created_at, id);
+
+-- Verify the change
+SHOW INDEX FROM invoices;
@@ -0,0 +1,14 @@
+"""
+Database Migration: Covering index for /api/reconcile
+
+Run this SQL in your MySQL database. The reconciliation reads every invoice
+of the ledger's date range but only these columns (plus the primary key,
+which InnoDB keeps in every secondary index), so the range is answered from
+the index without touching the table rows.
+"""
+
+-- Add reconcile index to invoices table
+CREATE INDEX ix_invoices_reconcile ON invoices (issue_date, invoice_number, total_amount, tax_amount, issuer_nit, receiver_nit);
+
+-- Verify the change
+SHOW INDEX FROM invoices;
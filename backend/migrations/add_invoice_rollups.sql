@@ -0,0 +1,40 @@
+"""
+Database Migration: Summary rollup tables for /api/xml/summary
+
+Run this SQL in your MySQL database. `flask schema upgrade` then fills the
+tables from the existing invoices (backfill_invoice_item_taxes.sql); by hand,
+after invoice_item_taxes is backfilled:
+
+    flask xml rebuild-summary
+
+From then on uploads and deletes keep them up to date incrementally.
+"""
+
+-- Create invoice_rollups table (totals per month / issuer / receiver)
+CREATE TABLE IF NOT EXISTS invoice_rollups (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    period VARCHAR(7) NOT NULL DEFAULT '',
+    issuer_nit VARCHAR(50) NOT NULL DEFAULT '',
+    receiver_nit VARCHAR(50) NOT NULL DEFAULT '',
+    invoice_count INT NOT NULL DEFAULT 0,
+    base_amount DECIMAL(20, 2) NOT NULL DEFAULT 0,
+    tax_amount DECIMAL(20, 2) NOT NULL DEFAULT 0,
+    total_amount DECIMAL(20, 2) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_invoice_rollups_group UNIQUE (period, issuer_nit, receiver_nit)
+);
+
+-- Create invoice_tax_rollups table (item taxes per month / issuer / receiver / tax key)
+CREATE TABLE IF NOT EXISTS invoice_tax_rollups (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    period VARCHAR(7) NOT NULL DEFAULT '',
+    issuer_nit VARCHAR(50) NOT NULL DEFAULT '',
+    receiver_nit VARCHAR(50) NOT NULL DEFAULT '',
+    tax_key VARCHAR(120) NOT NULL,
+    tax_count INT NOT NULL DEFAULT 0,
+    amount DECIMAL(20, 4) NOT NULL DEFAULT 0,
+    CONSTRAINT uq_invoice_tax_rollups_group UNIQUE (period, issuer_nit, receiver_nit, tax_key)
+);
+
+-- Verify the change
+DESCRIBE invoice_rollups;
+DESCRIBE invoice_tax_rollups;
@@ -0,0 +1,23 @@
+"""
+Database Migration: Indexes for /api/xml/search
+
+Run this SQL in your MySQL database. Every search filter is served by an
+index: the NIT and payment form filters by composite (<column>, issue_date)
+indexes that also cover the date range and the issue_date ordering, amount
+ranges by total_amount, number prefixes by the existing invoice_number index,
+and ?q= by a FULLTEXT index on the line item descriptions.
+"""
+
+-- Add search indexes to invoices table
+CREATE INDEX ix_invoices_issue_date ON invoices (issue_date);
+CREATE INDEX ix_invoices_issuer_nit_issue_date ON invoices (issuer_nit, issue_date);
+CREATE INDEX ix_invoices_receiver_nit_issue_date ON invoices (receiver_nit, issue_date);
+CREATE INDEX ix_invoices_payment_form_issue_date ON invoices (payment_form, issue_date);
+CREATE INDEX ix_invoices_total_amount ON invoices (total_amount);
+
+-- Add full-text index to invoice_items table
+CREATE FULLTEXT INDEX ft_invoice_items_description ON invoice_items (description);
+
+-- Verify the change
+SHOW INDEX FROM invoices;
+SHOW INDEX FROM invoice_items;
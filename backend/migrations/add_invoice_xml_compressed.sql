@@ -0,0 +1,21 @@
+"""
+Database Migration: Store the original XML of invoices compressed
+
+Run this SQL in your MySQL database. invoices.xml_content becomes a binary
+column holding the uploaded file compressed with zstd (or zlib), and
+xml_codec records which one. The column was never filled before, so no data
+is converted. The ORM loads it only on request (GET /api/xml/<id>/xml and
+`flask xml reprocess`); listings and exports never read it.
+"""
+
+-- Compressed original XML (up to 4 GB per row)
+ALTER TABLE invoices
+MODIFY COLUMN xml_content LONGBLOB NULL;
+
+-- Codec of xml_content: 'zstd' | 'zlib' (NULL = not stored)
+ALTER TABLE invoices
+ADD COLUMN xml_codec VARCHAR(10) NULL
+AFTER xml_content;
+
+-- Verify the change
+DESCRIBE invoices;
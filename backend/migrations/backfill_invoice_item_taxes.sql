@@ -0,0 +1,16 @@
+"""
+Database Migration: Fill invoice_item_taxes and the summary rollups
+
+No schema change. `flask schema upgrade` runs the Python step registered for
+this file (app/schema.py DATA_MIGRATIONS): invoice_item_taxes is backfilled
+from invoice_items.json_taxes, then the rollup tables are rebuilt, so
+databases that existed before those tables export their tax columns and
+summarize their taxes. By hand, the same is:
+
+    flask xml backfill-taxes --batch-size 2000
+    flask xml rebuild-summary
+"""
+
+-- Verify the change
+SELECT COUNT(*) FROM invoice_item_taxes;
+SELECT COUNT(*) FROM invoice_tax_rollups;
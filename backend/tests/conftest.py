@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Test fixtures: the Flask app on a temporary SQLite database"""
+import io
+import pytest
+
+
+@pytest.fixture
+def database_url(tmp_path):
+    return 'sqlite:///' + str(tmp_path / 'test.db')
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, database_url):
+    monkeypatch.setenv('DATABASE_URL', database_url)
+    monkeypatch.setenv('METRICS_DIR', '')
+    monkeypatch.setenv('XML_JOBS_DIR', str(tmp_path / 'jobs'))
+    monkeypatch.setenv('EXCEL_RESULTS_DIR', str(tmp_path / 'excel_results'))
+    monkeypatch.setenv('XML_PARSE_WORKERS', '1')
+    # Async upload jobs run when a test calls process_queued_jobs
+    monkeypatch.setenv('XML_JOB_WORKERS', '0')
+    from app import create_app
+    from app.extensions import db
+    from app.schema import upgrade_schema
+
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        upgrade_schema()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def upload(client, files):
+    """POST /api/xml/upload of [(filename, bytes)]; returns the JSON body."""
+    response = client.post(
+        '/api/xml/upload',
+        data={'files': [(io.BytesIO(content), filename) for filename, content in files]},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def statuses(body):
+    return [(detail['filename'], detail['status']) for detail in body['details']]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""The async read endpoints (asgi.py) answer exactly like the Flask routes"""
+import pytest
+from starlette.testclient import TestClient
+from app.asgi import create_asgi_app
+from benchmarks.generators import make_attached_document, make_invoice_xml
+from .conftest import upload
+
+ORIGIN = 'http://localhost:5173'
+
+# Headers both modes must agree on (Server-Timing carries measured durations)
+COMPARED_HEADERS = (
+    'content-type', 'access-control-allow-origin', 'access-control-expose-headers',
+    'access-control-allow-credentials', 'vary',
+)
+
+REQUESTS = [
+    '/api/xml/list',
+    '/api/xml/list?per_page=2',
+    '/api/xml/list?per_page=2&page=2&count=0',
+    '/api/xml/list?include=items,taxes',
+    '/api/xml/list?include=nope',
+    '/api/xml/list?after=bad',
+    '/api/xml/search',
+    '/api/xml/search?q=proveedor&count=1',
+    '/api/xml/search?per_page=1&issuer_nit=900000001',
+    '/api/xml/search?date_from=tomorrow',
+    '/api/xml/summary',
+    '/api/xml/summary?group_by=issuer_nit,period',
+    '/api/xml/summary?group_by=colour',
+    '/api/xml/1',
+    '/api/xml/3',
+    '/api/xml/999',
+]
+
+
+@pytest.fixture
+def clients(app, client):
+    invoices = [make_invoice_xml(lines=3, seed=seed, tax_mix='mixed', issuer_nit='900000001') for seed in range(3)]
+    invoices.append(make_attached_document(make_invoice_xml(lines=2, seed=3), seed=3))
+    upload(client, [(f'{index}.xml', content) for index, content in enumerate(invoices)])
+
+    with TestClient(create_asgi_app(app)) as asgi_client:
+        yield client, asgi_client
+
+
+@pytest.mark.parametrize('origin', [None, ORIGIN])
+@pytest.mark.parametrize('path', REQUESTS)
+def test_same_response_in_both_modes(clients, path, origin):
+    flask_client, asgi_client = clients
+    headers = {'Origin': origin} if origin else {}
+
+    expected = flask_client.get(path, headers=headers)
+    response = asgi_client.get(path, headers=headers)
+
+    assert response.status_code == expected.status_code
+    assert response.content == expected.data
+    for name in COMPARED_HEADERS:
+        assert response.headers.get(name) == expected.headers.get(name), name
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""apply_audit_rules (vectorized) gives the same frame as the row-wise reference rules"""
+import numpy as np
+import pandas as pd
+import pytest
+from app.modules.excel import services
+from app.modules.excel.services import apply_audit_rules, extract_numeric_folio, extract_numeric_folios
+from benchmarks.bench_excel_rules import legacy_audit_rules
+from benchmarks.generators import make_ledger
+
+
+def _ledger(rows):
+    return pd.DataFrame(rows, columns=['Fecha', 'Folio', 'Tipo', 'Total', 'Impuesto'])
+
+
+# Base == 0 with and without tax, non-19% taxes, NaN / empty / digitless
+# folios, duplicates, jumps and negative diffs (a later date, a lower folio)
+EDGE_CASES = _ledger([
+    ['2024-01-01', 'FE-10', 'Emitida', 119.0, 19.0],
+    ['2024-01-02', 'FE-11', 'Emitida', 0.0, 0.0],
+    ['2024-01-03', 'FE-11', 'Emitida', 50.0, 50.0],
+    ['2024-01-04', 'FE-15', 'Emitida', 105.0, 5.0],
+    ['2024-01-05', 'FE-3', 'Emitida', 'abc', 19.0],
+    ['2024-01-06', np.nan, 'Emitida', 119.0, 19.0],
+    ['2024-01-07', None, 'Emitida', 119.0, None],
+    ['2024-01-08', 'SIN FOLIO', 'Emitida', 119.0, 19.0],
+    ['2024-01-01', '7', 'Recibida', 119.0, 19.0],
+    ['2024-01-01', 7, 'Recibida', 119.0, 19.0],
+    ['2024-01-02', 8.0, 'Recibida', 238.0, 38.0],
+    ['bad date', 'R-2', 'Recibida', -119.0, -19.0],
+    [None, None, None, None, None],
+])
+
+# Non-ASCII digits: Python's \d (the reference) matches them, RE2's does not
+NON_ASCII = _ledger([
+    ['2024-01-01', 'FE-٣', 'Emitida', 119.0, 19.0],
+    ['2024-01-02', 'FE-4', 'Emitida', 119.0, 19.0],
+    ['2024-01-03', 'Nº 5', 'Emitida', 119.0, 19.0],
+    ['2024-01-04', 'FE-７', 'Emitida', 119.0, 19.0],
+])
+
+# Folios longer than int64: the reference keeps Python ints
+INT64_OVERFLOW = _ledger([
+    ['2024-01-01', 'FE-1', 'Emitida', 119.0, 19.0],
+    ['2024-01-02', 'FE-99999999999999999999', 'Emitida', 119.0, 19.0],
+    ['2024-01-03', 'FE-100000000000000000000', 'Emitida', 119.0, 19.0],
+])
+
+LEDGERS = {
+    'edge_cases': EDGE_CASES,
+    'non_ascii': NON_ASCII,
+    'int64_overflow': INT64_OVERFLOW,
+    'generated': make_ledger(2000, seed=3),
+}
+
+
+@pytest.fixture(params=['pyarrow', 'str.replace'])
+def folio_path(request, monkeypatch):
+    pytest.importorskip('pyarrow')
+    if request.param == 'str.replace':
+        monkeypatch.setattr(services, '_folio_digits_arrow', lambda values: None)
+    return request.param
+
+
+@pytest.mark.parametrize('name', LEDGERS)
+def test_same_frame_as_row_wise_rules(folio_path, name):
+    ledger = LEDGERS[name]
+    expected = legacy_audit_rules(ledger.copy())
+    pd.testing.assert_frame_equal(apply_audit_rules(ledger.copy()), expected)
+
+
+def test_edge_cases_reach_every_outcome():
+    df = apply_audit_rules(EDGE_CASES.copy())
+    assert set(df['Verif']) == {'OK', 'CHECK'}
+    assert set(df['COMCON']) == {'START', 'OK', 'DUPLICATE', 'JUMP DETECTED', 'ERROR'}
+    # Base == 0: OK without tax, CHECK with it
+    assert list(df.loc[df['Base'] == 0, 'Verif']) == ['OK', 'CHECK']
+
+
+@pytest.mark.parametrize('name', ['non_ascii', 'int64_overflow'])
+def test_folio_numbers_match_scalar_version(folio_path, name):
+    folios = LEDGERS[name]['Folio']
+    assert list(extract_numeric_folios(folios)) == [extract_numeric_folio(folio) for folio in folios]
+
+
+def test_arrow_path_declines_what_it_cannot_parse():
+    pytest.importorskip('pyarrow')
+    for name in ('non_ascii', 'int64_overflow'):
+        assert services._folio_digits_arrow(LEDGERS[name]['Folio'].astype(str)) is None
+    assert list(services._folio_digits_arrow(pd.Series(['FE-10', 'x', '0012']))) == [10, 0, 12]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""/api/xml/bulk-delete and re-import of the deleted files"""
+import os
+import subprocess
+import sys
+from benchmarks.generators import make_invoice_batch
+from .conftest import statuses, upload
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Another worker: its own process and app on the same database
+BULK_DELETE_IN_OTHER_PROCESS = """
+import json
+from app import create_app
+response = create_app().test_client().post('/api/xml/bulk-delete', json={'date_from': '2000-01-01'})
+print(json.dumps(response.get_json()))
+"""
+
+
+def test_bulk_delete_by_ids_and_filters(client):
+    upload(client, make_invoice_batch(4, lines=2, seed=1))
+    ids = [item['id'] for item in client.get('/api/xml/list').get_json()['items']]
+
+    response = client.post('/api/xml/bulk-delete', json={'ids': ids[:1]})
+    assert response.status_code == 200
+    assert response.get_json()['deleted']['invoices'] == 1
+
+    response = client.post('/api/xml/bulk-delete', json={'date_from': '2000-01-01'})
+    assert response.get_json()['deleted']['invoices'] == 3
+    assert client.get('/api/xml/list').get_json()['items'] == []
+
+    assert client.post('/api/xml/bulk-delete', json={}).status_code == 400
+    assert client.post('/api/xml/bulk-delete', json={'ids': ['1']}).status_code == 400
+    assert client.post('/api/xml/bulk-delete', json={'date_from': '2024-13-01'}).status_code == 400
+
+
+def test_files_deleted_by_another_worker_can_be_uploaded_again(client, database_url):
+    batch = make_invoice_batch(3, lines=2, seed=2)
+    assert {status for _, status in statuses(upload(client, batch))} == {'success'}
+    assert {status for _, status in statuses(upload(client, batch))} == {'skipped'}
+
+    env = dict(os.environ, DATABASE_URL=database_url, METRICS_DIR='')
+    result = subprocess.run(
+        [sys.executable, '-c', BULK_DELETE_IN_OTHER_PROCESS],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    assert '"invoices": 3' in result.stdout
+
+    # This worker saw the files as stored a moment ago: they must be accepted now
+    assert {status for _, status in statuses(upload(client, batch))} == {'success'}
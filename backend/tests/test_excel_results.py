@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Processed ledgers kept server-side: /api/excel/process and /api/excel/results"""
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+import pytest
+from app.modules.excel import results, services
+from app.modules.excel.results import MAX_PER_PAGE
+from benchmarks.generators import make_ledger
+
+ROWS = 120
+
+
+def _csv(rows=ROWS, seed=0):
+    return make_ledger(rows, seed=seed).to_csv(index=False).encode('utf-8')
+
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    # The in-process LRU and hash index outlive the app of each test
+    monkeypatch.setattr(results, '_frames', OrderedDict())
+    monkeypatch.setattr(results, '_frames_bytes', 0)
+    monkeypatch.setattr(results, '_hash_index', OrderedDict())
+
+
+def _process(client, content, query=''):
+    response = client.post(
+        f'/api/excel/process{query}',
+        data={'file': (io.BytesIO(content), 'ledger.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def _get(client, path, status=200):
+    response = client.get(path)
+    assert response.status_code == status, response.get_json()
+    return response
+
+
+def _ndjson(client, result_id, query=''):
+    response = _get(client, f'/api/excel/results/{result_id}?format=ndjson{query}')
+    assert response.mimetype == 'application/x-ndjson'
+    return [json.loads(line) for line in response.data.decode('utf-8').splitlines()]
+
+
+def test_process_returns_first_page_and_summary(client):
+    body = _process(client, _csv(), '?per_page=50')
+    assert (body['total'], body['page'], body['per_page'], body['pages']) == (ROWS, 1, 50, 3)
+    assert len(body['data']) == 50
+    assert body['summary']['processed_rows'] == ROWS
+    assert sum(body['summary']['verif'].values()) == ROWS
+    assert _get(client, f"/api/excel/results/{body['result_id']}/summary").get_json() == body['summary']
+
+
+@pytest.mark.parametrize('per_page, expected', [('0', 1), ('-5', 1), (str(MAX_PER_PAGE + 1), MAX_PER_PAGE)])
+def test_per_page_is_clamped(client, per_page, expected):
+    body = _process(client, _csv(), f'?per_page={per_page}')
+    assert body['per_page'] == expected
+    page = _get(client, f"/api/excel/results/{body['result_id']}?per_page={per_page}").get_json()
+    assert page['per_page'] == expected
+
+
+def test_pages_cover_every_row_once(client):
+    result_id = _process(client, _csv())['result_id']
+    rows = _ndjson(client, result_id)
+    assert len(rows) == ROWS
+
+    paged = []
+    for page in range(1, 5):
+        body = _get(client, f'/api/excel/results/{result_id}?page={page}&per_page=40').get_json()
+        assert body['pages'] == 3
+        paged += body['data']
+    assert paged == rows
+
+
+def test_filter_keeps_rows_with_any_status(client):
+    result_id = _process(client, _csv())['result_id']
+    rows = _ndjson(client, result_id)
+    expected = [row for row in rows if row['Verif'] == 'CHECK' or row['COMCON'] == 'JUMP DETECTED']
+    assert expected and len(expected) < ROWS
+
+    assert _ndjson(client, result_id, '&filter=CHECK|JUMP DETECTED') == expected
+    body = _get(client, f'/api/excel/results/{result_id}?filter=CHECK| JUMP DETECTED&per_page=5&page=2').get_json()
+    assert body['total'] == len(expected)
+    assert body['data'] == expected[5:10]
+    assert _get(client, f'/api/excel/results/{result_id}?filter=NOPE').get_json()['total'] == 0
+
+
+@pytest.mark.parametrize('result_id', ['0' * 32, 'g' * 32, 'ABC'])
+def test_unknown_result_is_404(client, result_id):
+    _get(client, f'/api/excel/results/{result_id}', status=404)
+    _get(client, f'/api/excel/results/{result_id}/summary', status=404)
+
+
+def test_lru_keeps_the_most_recent_frames(app, client):
+    first = _process(client, _csv(seed=1))['result_id']
+    # Room for one frame of this size, not two
+    app.config['EXCEL_CACHE_MAX_BYTES'] = results._frames_bytes * 3 // 2
+    second = _process(client, _csv(seed=2))['result_id']
+    assert list(results._frames) == [second]
+
+    # Evicted frames are read back from disk (and become the most recent one)
+    assert _get(client, f'/api/excel/results/{first}?per_page=1').get_json()['total'] == ROWS
+    assert list(results._frames) == [first]
+
+
+def test_expired_results_are_purged(app, client):
+    old = _process(client, _csv(seed=1))['result_id']
+    past = time.time() - app.config['EXCEL_RESULT_TTL'] - 1
+    with app.app_context():
+        paths = results._paths(old)
+    for path in paths:
+        os.utime(path, (past, past))
+
+    _process(client, _csv(seed=2))
+    assert not any(os.path.exists(path) for path in paths)
+    results._frames.clear()
+    _get(client, f'/api/excel/results/{old}', status=404)
+
+
+def test_same_bytes_reuse_the_stored_result(client):
+    content = _csv()
+    first = _process(client, content)
+    assert first['cached'] is False
+
+    second = _process(client, content, '?per_page=10')
+    assert second['cached'] is True
+    assert second['result_id'] == first['result_id']
+    assert second['summary'] == first['summary']
+    assert second['data'] == first['data'][:10]
+
+    # Another file is computed
+    assert _process(client, _csv(seed=5))['cached'] is False
+
+
+def test_rules_version_change_misses_the_cache(client, monkeypatch):
+    content = _csv()
+    first = _process(client, content)
+    monkeypatch.setattr(services, 'RULES_VERSION', 'next')
+    second = _process(client, content)
+    assert second['cached'] is False
+    assert second['result_id'] != first['result_id']
+    assert _process(client, content)['result_id'] == second['result_id']
+
+
+def test_deleted_result_files_miss_the_cache(app, client):
+    content = _csv()
+    first = _process(client, content)
+    with app.app_context():
+        for path in results._paths(first['result_id']):
+            os.remove(path)
+
+    second = _process(client, content)
+    assert second['cached'] is False
+    assert second['result_id'] != first['result_id']
+    assert second['summary'] == first['summary']
+
+
+@pytest.mark.parametrize('disk, cached', [(True, True), (False, False)])
+def test_other_workers_find_results_through_excel_reports(app, client, monkeypatch, disk, cached):
+    app.config['EXCEL_CACHE_DISK'] = disk
+    content = _csv()
+    first = _process(client, content)
+    # A worker that never saw this file: empty in-process index
+    monkeypatch.setattr(results, '_hash_index', OrderedDict())
+
+    second = _process(client, content)
+    assert second['cached'] is cached
+    assert (second['result_id'] == first['result_id']) == cached
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Async uploads (/api/xml/upload?async=1): jobs claimed from the ingest_jobs table"""
+import io
+import json
+import os
+import shutil
+import zipfile
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app.extensions import db
+from app.modules.xml import jobs
+from app.modules.xml.models import IngestJob
+from benchmarks.generators import make_invoice_xml
+
+
+def _queue(client, files):
+    response = client.post(
+        '/api/xml/upload?async=1',
+        data={'files': [(io.BytesIO(content), filename) for filename, content in files]},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 202, response.get_json()
+    return response.get_json()['job_id']
+
+
+def _job(client, job_id):
+    response = client.get(f'/api/xml/jobs/{job_id}')
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def _set(app, job_id, **values):
+    with app.app_context():
+        db.session.execute(update(IngestJob.__table__).where(IngestJob.__table__.c.id == job_id).values(**values))
+        db.session.commit()
+
+
+def test_queued_job_is_claimed_and_run(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=2, seed=11)), ('bad.xml', b'<Invoice/>')])
+    assert _job(client, job_id)['status'] == 'queued'
+
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert (job['status'], job['uploaded'], job['errors'], job['attempts']) == ('done', 1, 1, 1)
+    assert [detail['filename'] for detail in job['details']] == ['a.xml', 'bad.xml']
+    assert not os.path.exists(os.path.join(app.config['XML_JOBS_DIR'], job_id))
+
+    # Nothing left to claim
+    assert jobs.process_queued_jobs(app) == 0
+
+
+def test_job_claimed_once(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=12))])
+    with app.app_context():
+        assert jobs.claim_next_job() == job_id
+        assert jobs.claim_next_job() is None
+
+
+def test_stale_running_job_is_queued_again(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=13))])
+    # A worker claimed it and died: no heartbeat since
+    _set(app, job_id, status='running', locked_by='gone:1', attempts=1,
+         locked_at=datetime.utcnow() - timedelta(seconds=app.config['XML_JOB_STALE_AFTER'] + 1))
+
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert (job['status'], job['uploaded'], job['attempts']) == ('done', 1, 2)
+
+
+def test_running_job_with_fresh_heartbeat_is_left_alone(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=14))])
+    _set(app, job_id, status='running', locked_by='busy:1', attempts=1, locked_at=datetime.utcnow())
+
+    assert jobs.process_queued_jobs(app) == 0
+    assert _job(client, job_id)['status'] == 'running'
+
+
+def test_stale_job_fails_after_max_attempts(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=15))])
+    _set(app, job_id, status='running', locked_by='gone:1', attempts=jobs.MAX_JOB_ATTEMPTS, locked_at=None)
+
+    assert jobs.process_queued_jobs(app) == 0
+    job = _job(client, job_id)
+    assert (job['status'], job['error_msg']) == ('failed', jobs.LOST_WORKER_MSG)
+
+
+def test_job_without_files_fails(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=16))])
+    shutil.rmtree(os.path.join(app.config['XML_JOBS_DIR'], job_id))
+
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert (job['status'], job['error_msg']) == ('failed', jobs.LOST_FILES_MSG)
+
+
+def test_failed_job_is_recorded_when_processing_raises(app, client, monkeypatch):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=17))])
+
+    def broken(entries):
+        raise RuntimeError('database went away')
+        yield
+
+    monkeypatch.setattr(jobs, 'process_xml_uploads', broken)
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert (job['status'], job['error_msg']) == ('failed', 'database went away')
+
+
+def test_unrecorded_outcome_keeps_the_files(app, client, monkeypatch):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=18))])
+
+    def unavailable(job_id, **values):
+        raise RuntimeError('database went away')
+
+    monkeypatch.setattr(jobs, '_save_progress', unavailable)
+    assert jobs.process_queued_jobs(app) == 1
+    # Still 'running' until its heartbeat goes stale, then it runs again from the kept files
+    assert _job(client, job_id)['status'] == 'running'
+    assert os.path.exists(os.path.join(app.config['XML_JOBS_DIR'], job_id, jobs.MANIFEST_NAME))
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, content in members:
+            archive.writestr(name, content)
+    return buffer.getvalue()
+
+
+def _invoice_count(client):
+    return client.get('/api/xml/list?count=1').get_json()['total']
+
+
+def test_requeued_job_resumes_after_recorded_files(app, client):
+    job_id = _queue(client, [(f'{seed}.xml', make_invoice_xml(lines=1, seed=seed)) for seed in (20, 21, 22)])
+    # The first run recorded 20.xml, then its worker died
+    _set(app, job_id, status='running', locked_by='gone:1', attempts=1, locked_at=None, processed=1, uploaded=1,
+         details=json.dumps([{'filename': '20.xml', 'status': 'success', 'msg': 'Saved'}]))
+
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert (job['status'], job['processed'], job['uploaded'], job['skipped']) == ('done', 3, 3, 0)
+    assert [detail['filename'] for detail in job['details']] == ['20.xml', '21.xml', '22.xml']
+    # 20.xml was not read again
+    assert _invoice_count(client) == 2
+
+
+def test_requeued_job_resumes_inside_an_archive(app, client):
+    archive = _zip([('a.xml', make_invoice_xml(lines=1, seed=23)), ('b.xml', make_invoice_xml(lines=1, seed=24))])
+    job_id = _queue(client, [('batch.zip', archive), ('c.xml', make_invoice_xml(lines=1, seed=25))])
+    _set(app, job_id, status='running', locked_by='gone:1', attempts=1, locked_at=None,
+         details=json.dumps([{'filename': 'batch.zip/a.xml', 'status': 'success', 'msg': 'Saved'}]))
+
+    assert jobs.process_queued_jobs(app) == 1
+    job = _job(client, job_id)
+    assert [(detail['filename'], detail['status']) for detail in job['details']] == [
+        ('batch.zip/a.xml', 'success'), ('batch.zip/b.xml', 'success'), ('c.xml', 'success')
+    ]
+    assert _invoice_count(client) == 2
+
+
+def test_claim_does_not_recover_stale_jobs(app, client):
+    job_id = _queue(client, [('a.xml', make_invoice_xml(lines=1, seed=26))])
+    _set(app, job_id, status='running', locked_by='gone:1', attempts=1, locked_at=None)
+
+    with app.app_context():
+        assert jobs.claim_next_job() is None
+        assert jobs.recover_stale_jobs() == (1, 0)
+        assert jobs.claim_next_job() == job_id
+
+
+def test_async_upload_is_synchronous_without_jobs_dir(app, client):
+    app.config['XML_JOBS_DIR'] = None
+    response = client.post(
+        '/api/xml/upload?async=1',
+        data={'files': [(io.BytesIO(make_invoice_xml(lines=1, seed=27)), 'a.xml')]},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200
+    assert response.get_json()['uploaded'] == 1
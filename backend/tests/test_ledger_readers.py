@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Ledger readers: CSV headers as people write them"""
+import io
+import pytest
+from app.modules.excel import readers
+from app.modules.excel.readers import REQUIRED_COLUMNS, read_ledger
+
+PADDED_CSV = (
+    ' Fecha ; Folio ;Tipo ; Total;Impuesto ;Notas\n'
+    '2024-01-05;0012;Recibida;119;19;x\n'
+    '2024-01-06;FE-2;Emitida;238;38;y\n'
+).encode('utf-8')
+
+
+@pytest.fixture(params=['pyarrow', 'pandas'])
+def csv_engine(request, monkeypatch):
+    if request.param == 'pandas':
+        monkeypatch.setattr(readers, '_read_csv_arrow', lambda *args: None)
+    return request.param
+
+
+def test_padded_headers_are_read(csv_engine):
+    df = read_ledger(io.BytesIO(PADDED_CSV), 'ledger.csv')
+    assert list(df.columns) == REQUIRED_COLUMNS
+    assert list(df['Folio']) == ['0012', 'FE-2']
+    assert list(df['Total']) == [119, 238]
+
+
+def test_missing_column_is_a_value_error(csv_engine):
+    with pytest.raises(ValueError, match='Missing required columns: Impuesto'):
+        read_ledger(io.BytesIO(b'Fecha,Folio,Tipo,Total\n2024-01-05,1,Recibida,119\n'), 'ledger.csv')
+
+
+def test_malformed_row_is_a_value_error():
+    # pyarrow rejects rows with extra cells (pandas' usecols ignores them)
+    content = b'Fecha,Folio,Tipo,Total,Impuesto\n2024-01-05,1,Recibida,119,19,extra,cells\n'
+    with pytest.raises(ValueError):
+        read_ledger(io.BytesIO(content), 'ledger.csv')
+
+
+@pytest.mark.parametrize('content, status', [
+    (PADDED_CSV, 200),
+    (b'Fecha,Folio,Tipo,Total\n2024-01-05,1,Recibida,119\n', 400),
+    (b'Fecha,Folio,Tipo,Total,Impuesto\n2024-01-05,1,Recibida,119,19,extra,cells\n', 400),
+])
+def test_process_endpoint_status(client, content, status):
+    response = client.post(
+        '/api/excel/process',
+        data={'file': (io.BytesIO(content), 'ledger.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == status, response.get_json()
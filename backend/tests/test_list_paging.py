@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Paging arguments of /api/xml/list"""
+import pytest
+from app.modules.xml.queries import DEFAULT_PER_PAGE, MAX_PER_PAGE, parse_list_args
+from benchmarks.generators import make_invoice_xml
+from .conftest import upload
+
+
+@pytest.mark.parametrize('args, per_page', [
+    ({}, DEFAULT_PER_PAGE),
+    ({'per_page': '5'}, 5),
+    ({'per_page': '0'}, 1),
+    ({'per_page': '-3'}, 1),
+    ({'per_page': '100000'}, MAX_PER_PAGE),
+    ({'per_page': 'many'}, DEFAULT_PER_PAGE),
+])
+def test_per_page_is_clamped(args, per_page):
+    assert parse_list_args(args)['per_page'] == per_page
+
+
+def test_page_is_at_least_one():
+    assert parse_list_args({'page': '-2'})['page'] == 1
+
+
+def test_non_positive_per_page_still_pages(client):
+    upload(client, [(f'{seed}.xml', make_invoice_xml(lines=1, seed=seed)) for seed in range(2)])
+
+    body = client.get('/api/xml/list?per_page=0').get_json()
+    assert (len(body['items']), body['has_more'], body['pages']) == (1, True, 2)
+
+    body = client.get('/api/xml/list?after=' + body['next_cursor'] + '&per_page=0').get_json()
+    assert (len(body['items']), body['has_more']) == (1, False)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Golden files of the DIAN invoice parser
+
+tests/golden/<name>.xml are UBL 2.1 Invoice and AttachedDocument samples
+(from benchmarks/generators.py, some with fields removed); <name>.json is
+what the previous (XPath per field) parser returned for them, with
+issue_date as an ISO string. Both parsing modes must still return it.
+"""
+import io
+import json
+import os
+import pytest
+from app.modules.xml.parser import parse_xml_invoice, parse_xml_invoice_stream
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+CASES = sorted(name[:-len('.xml')] for name in os.listdir(GOLDEN_DIR) if name.endswith('.xml'))
+
+
+def _jsonable(result):
+    if result is not None and result['issue_date'] is not None:
+        result = dict(result, issue_date=result['issue_date'].isoformat())
+    return result
+
+
+def _golden(name):
+    with open(os.path.join(GOLDEN_DIR, name + '.xml'), 'rb') as fh:
+        content = fh.read()
+    with open(os.path.join(GOLDEN_DIR, name + '.json'), encoding='utf-8') as fh:
+        return content, json.load(fh)
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_parse_xml_invoice(name):
+    content, expected = _golden(name)
+    assert _jsonable(parse_xml_invoice(content)) == expected
+
+
+@pytest.mark.parametrize('name', CASES)
+def test_parse_xml_invoice_stream(name):
+    content, expected = _golden(name)
+    assert _jsonable(parse_xml_invoice_stream(io.BytesIO(content))) == expected
+
+
+def test_golden_cases_cover_both_document_types():
+    assert any(name.startswith('invoice') for name in CASES)
+    assert any(name.startswith('attached') for name in CASES)
+
+
+@pytest.mark.parametrize('parse', [parse_xml_invoice, parse_xml_invoice_stream])
+def test_malformed_input_returns_none(parse):
+    assert parse(b'this is not xml') is None
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Ledger reconciliation (/api/reconcile): one-to-one matching and reported rows"""
+import io
+import pandas as pd
+from openpyxl import Workbook
+from app.modules.excel.readers import read_ledger
+from app.modules.reconcile.services import INVOICE_COLUMNS, MATCHED, match_ledger, normalize_folios, prepare_ledger
+
+HEADER = ['Fecha', 'Folio', 'Tipo', 'Total', 'Impuesto']
+
+CSV_WITH_BLANK_LINES = (
+    'Fecha,Folio,Tipo,Total,Impuesto\n'
+    '2024-01-05,FE-1,Recibida,100,19\n'
+    '\n'
+    '2024-01-06,"FE-2",Recibida,200,38\n'
+    '\r\n'
+    '\n'
+    '2024-01-07,FE-3,"Recibida\nen caja",300,57\n'
+    '2024-01-08,FE-4,Recibida,400,76\n'
+).encode('utf-8')
+
+
+def _xlsx(rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    buffer = io.BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+def test_repeated_folios_are_all_paired():
+    # Same folio, date and amounts on both sides: one pair per matching round
+    count = 12
+    ledger = prepare_ledger(pd.DataFrame(
+        {'Fecha': ['2024-03-01'] * count, 'Folio': ['FE-7'] * count, 'Tipo': ['Recibida'] * count,
+         'Total': [119.0] * count, 'Impuesto': [19.0] * count},
+        index=pd.RangeIndex(2, count + 2, name='row')
+    ))
+    candidates = pd.DataFrame({
+        'invoice_id': range(1, count + 1), 'invoice_number': ['FE7'] * count,
+        'issuer_nit': [str(900000000 + n) for n in range(count)], 'receiver_nit': ['800000000'] * count,
+        'issue_date': pd.to_datetime(['2024-03-01'] * count), 'total_amount': [119.0] * count,
+        'tax_amount': [19.0] * count,
+    }, columns=INVOICE_COLUMNS)
+    candidates['key'] = normalize_folios(candidates['invoice_number']).to_numpy()
+
+    report = match_ledger(ledger, candidates)
+    assert (report['status'] == MATCHED).sum() == count
+    assert sorted(report['invoice_id']) == list(range(1, count + 1))
+
+
+def test_csv_rows_keep_their_line_numbers():
+    df = read_ledger(io.BytesIO(CSV_WITH_BLANK_LINES), 'ledger.csv')
+    assert list(df.index) == [2, 4, 7, 8]
+    assert list(df['Folio']) == ['FE-1', 'FE-2', 'FE-3', 'FE-4']
+
+
+def test_xlsx_rows_keep_their_sheet_numbers():
+    content = _xlsx([
+        [None], HEADER, ['2024-01-05', 'FE-1', 'Recibida', 100, 19], [None],
+        ['2024-01-06', 'FE-2', 'Recibida', 200, 38],
+    ])
+    df = read_ledger(io.BytesIO(content), 'ledger.xlsx')
+    assert list(df.index) == [3, 5]
+
+
+def test_report_rows_are_spreadsheet_rows(client):
+    response = client.post(
+        '/api/reconcile',
+        data={'file': (io.BytesIO(CSV_WITH_BLANK_LINES), 'ledger.csv')},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 200, response.get_json()
+    body = response.get_json()
+    assert body['summary']['ledger_rows'] == 4
+    assert [row['row'] for row in body['rows']['missing_in_db']] == [2, 4, 7, 8]
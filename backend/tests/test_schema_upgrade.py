@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""`flask schema upgrade` on a database that predates invoice_item_taxes"""
+from sqlalchemy import delete
+from app.extensions import db
+from app.modules.xml.export import discover_tax_keys
+from app.modules.xml.models import InvoiceItemTax, InvoiceRollup, InvoiceTaxRollup
+from app.schema import SchemaMigration, upgrade_schema
+from benchmarks.generators import make_invoice_xml
+from .conftest import upload
+
+
+def test_upgrade_backfills_item_taxes_and_rollups(app, client):
+    upload(client, [(f'{seed}.xml', make_invoice_xml(lines=4, seed=seed, tax_mix='mixed')) for seed in range(3)])
+    expected_summary = client.get('/api/xml/summary').get_json()
+    with app.app_context():
+        expected_keys = discover_tax_keys()
+        assert expected_keys
+
+        # Items only carry json_taxes, as before the normalized tables existed
+        for model in (InvoiceItemTax, InvoiceRollup, InvoiceTaxRollup):
+            db.session.execute(delete(model))
+        db.session.execute(delete(SchemaMigration).where(SchemaMigration.filename == 'backfill_invoice_item_taxes.sql'))
+        db.session.commit()
+        assert discover_tax_keys() == []
+
+        assert upgrade_schema() == ['backfill_invoice_item_taxes.sql']
+        assert discover_tax_keys() == expected_keys
+
+    assert client.get('/api/xml/summary').get_json() == expected_summary
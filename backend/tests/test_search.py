@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Filtered invoice search (/api/xml/search)"""
+import re
+import pytest
+from benchmarks.generators import make_invoice_xml
+from .conftest import statuses, upload
+
+
+def _invoice(seed, issuer_nit, issue_date, payment, description=None):
+    """Generated invoice SETT<seed + 1> with the given header fields (issue_date None: no IssueDate)."""
+    content = make_invoice_xml(lines=2, seed=seed, issuer_nit=issuer_nit, receiver_nit='800000001').decode('utf-8')
+    date_element = f'<cbc:IssueDate>{issue_date}</cbc:IssueDate>' if issue_date else ''
+    content = re.sub(r'<cbc:IssueDate>[^<]*</cbc:IssueDate>', date_element, content, count=1)
+    content = re.sub(r'<cac:PaymentMeans><cbc:ID>\d</cbc:ID>', f'<cac:PaymentMeans><cbc:ID>{payment}</cbc:ID>', content)
+    if description:
+        content = re.sub(r'<cac:Item><cbc:Description>[^<]*', f'<cac:Item><cbc:Description>{description}', content, count=1)
+    return f'SETT{seed + 1}.xml', content.encode('utf-8')
+
+
+INVOICES = [
+    _invoice(0, '900000001', '2024-01-10', 1, 'Tornillo galvanizado 1/4'),   # SETT1
+    _invoice(9, '900000001', '2024-02-10', 2),                               # SETT10
+    _invoice(8, '900000002', '2024-03-10', 1),                               # SETT9
+    _invoice(90, '900000002', None, 2),                                      # SETT91
+    _invoice(91, '900000003', None, 1),                                      # SETT92
+]
+
+# Newest issue_date first, undated invoices last (newest id first)
+ALL = ['SETT9', 'SETT10', 'SETT1', 'SETT92', 'SETT91']
+
+
+@pytest.fixture
+def invoices(client):
+    body = upload(client, INVOICES)
+    assert [status for _, status in statuses(body)] == ['success'] * len(INVOICES)
+    return {item['invoice_number']: item for item in client.get('/api/xml/list').get_json()['items']}
+
+
+def _search(client, query='', status=200):
+    response = client.get(f'/api/xml/search?{query}')
+    assert response.status_code == status, response.get_json()
+    return response.get_json()
+
+
+def _numbers(client, query=''):
+    return [item['invoice_number'] for item in _search(client, query)['items']]
+
+
+def test_no_filter_orders_dated_then_undated(client, invoices):
+    assert _numbers(client) == ALL
+    assert _search(client, 'count=1')['total'] == len(ALL)
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('issuer_nit=900000001', ['SETT10', 'SETT1']),
+    ('issuer_nit=900000002', ['SETT9', 'SETT91']),
+    ('receiver_nit=800000001', ALL),
+    ('receiver_nit=800000009', []),
+    ('date_from=2024-02-01', ['SETT9', 'SETT10']),
+    ('date_to=2024-02-10', ['SETT10', 'SETT1']),
+    ('date_from=2024-02-01&date_to=2024-02-28', ['SETT10']),
+    ('payment_form=Contado', ['SETT9', 'SETT1', 'SETT92']),
+    ('payment_form=Crédito&issuer_nit=900000002', ['SETT91']),
+])
+def test_filters(client, invoices, query, expected):
+    assert _numbers(client, query) == expected
+
+
+@pytest.mark.parametrize('prefix, expected', [
+    ('SETT9', ['SETT9', 'SETT92', 'SETT91']),   # Prefix ending in 9
+    ('SETT1', ['SETT10', 'SETT1']),
+    ('sett1', ['SETT10', 'SETT1']),             # Case-insensitive, as on MySQL
+    ('SETT10', ['SETT10']),
+    ('SETT%', []),                              # LIKE wildcards are literal
+    ('SETT_', []),
+])
+def test_number_prefix(client, invoices, prefix, expected):
+    assert _numbers(client, f'number={prefix}') == expected
+
+
+def test_total_range(client, invoices):
+    totals = sorted((item['total_amount'], number) for number, item in invoices.items())
+    low, high = totals[1][0], totals[3][0]
+    expected = {number for total, number in totals[1:4]}
+
+    assert set(_numbers(client, f'min_total={low}&max_total={high}')) == expected
+    assert set(_numbers(client, f'min_total={totals[-1][0]}')) == {totals[-1][1]}
+    assert set(_numbers(client, f'max_total={totals[0][0]}')) == {totals[0][1]}
+
+
+def test_item_text_follows_inserts_and_deletes(client, invoices):
+    assert _numbers(client, 'q=galvanizado') == ['SETT1']
+    assert _numbers(client, 'q=GALVAN tornillo') == ['SETT1']   # Word prefixes, every word
+    assert _numbers(client, 'q=galvanizado cemento') == []
+
+    # Delete trigger: the deleted items leave the index
+    assert client.delete(f"/api/xml/{invoices['SETT1']['id']}").status_code == 200
+    assert _numbers(client, 'q=galvanizado') == []
+
+    # Insert trigger: items of a new upload are indexed
+    upload(client, [_invoice(40, '900000004', '2024-04-01', 1, 'Perno galvanizado 3/8')])
+    assert _numbers(client, 'q=galvanizado') == ['SETT41']
+
+
+def test_keyset_paging_crosses_into_undated(client, invoices):
+    seen = []
+    cursors = []
+    query = 'per_page=2'
+    while True:
+        body = _search(client, query)
+        seen += [item['invoice_number'] for item in body['items']]
+        if not body['has_more']:
+            break
+        cursors.append(body['next_cursor'])
+        query = f"per_page=2&after={body['next_cursor']}"
+    assert seen == ALL
+    # Second page ends on the first undated invoice: its cursor has no date
+    assert cursors == ['2024-02-10,' + str(invoices['SETT10']['id']), ',' + str(invoices['SETT92']['id'])]
+
+    assert _numbers(client, f"after=,{invoices['SETT92']['id']}") == ['SETT91']
+    assert _numbers(client, f"after=2024-01-10,{invoices['SETT1']['id']}") == ['SETT92', 'SETT91']
+
+
+@pytest.mark.parametrize('query', [
+    'date_from=2024-13-01',
+    'date_to=10/02/2024',
+    'min_total=abc',
+    'max_total=1,5',
+    'q=ab',
+    'after=yesterday',
+    'after=2024-01-10,x',
+])
+def test_bad_arguments(client, query):
+    assert 'error' in _search(client, query, status=400)
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""/api/xml/summary rollups stay equal to a GROUP BY over the source tables"""
+from collections import defaultdict
+from decimal import Decimal
+from sqlalchemy import select
+from app.extensions import db
+from app.modules.xml.models import Invoice, InvoiceItemTax, InvoiceRollup, InvoiceTaxRollup
+from benchmarks.generators import make_invoice_xml
+from .conftest import statuses, upload
+
+GROUP_BY = 'period,issuer_nit,receiver_nit'
+
+# Two issuers and two receivers, so deletes empty some groups and not others
+BATCH = [
+    (f'{seed}.xml', make_invoice_xml(lines=3, seed=seed, tax_mix='mixed',
+                                     issuer_nit=str(900000001 + seed % 2), receiver_nit=str(800000001 + seed % 3 // 2)))
+    for seed in range(8)
+]
+
+
+def _expected(app):
+    """The summary rows computed straight from invoices and invoice_item_taxes."""
+    invoices = Invoice.__table__
+    item_taxes = InvoiceItemTax.__table__
+    rows = defaultdict(lambda: {'invoice_count': 0, 'base_amount': Decimal(0), 'tax_amount': Decimal(0),
+                                'total_amount': Decimal(0), 'taxes': defaultdict(Decimal)})
+    with app.app_context():
+        for row in db.session.execute(select(
+            invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit,
+            invoices.c.base_amount, invoices.c.tax_amount, invoices.c.total_amount
+        )):
+            entry = rows[(row.issue_date.strftime('%Y-%m'), row.issuer_nit, row.receiver_nit)]
+            entry['invoice_count'] += 1
+            for name in ('base_amount', 'tax_amount', 'total_amount'):
+                entry[name] += Decimal(str(getattr(row, name)))
+
+        for row in db.session.execute(
+            select(invoices.c.issue_date, invoices.c.issuer_nit, invoices.c.receiver_nit,
+                   item_taxes.c.tax_key, item_taxes.c.amount)
+            .select_from(item_taxes.join(invoices, item_taxes.c.invoice_id == invoices.c.id))
+        ):
+            rows[(row.issue_date.strftime('%Y-%m'), row.issuer_nit, row.receiver_nit)]['taxes'][row.tax_key] += Decimal(str(row.amount))
+
+    return {
+        key: {'invoice_count': entry['invoice_count'],
+              **{name: float(entry[name]) for name in ('base_amount', 'tax_amount', 'total_amount')},
+              'taxes': {tax_key: float(amount) for tax_key, amount in entry['taxes'].items()}}
+        for key, entry in rows.items()
+    }
+
+
+def _summary(client):
+    response = client.get(f'/api/xml/summary?group_by={GROUP_BY}')
+    assert response.status_code == 200
+    return {
+        (row['period'], row['issuer_nit'], row['receiver_nit']):
+            {name: value for name, value in row.items() if name not in GROUP_BY.split(',')}
+        for row in response.get_json()['rows']
+    }
+
+
+def _assert_consistent(app, client):
+    expected = _expected(app)
+    assert _summary(client) == expected
+    # Emptied groups are removed, not left behind with zero counts
+    with app.app_context():
+        assert db.session.query(InvoiceRollup).count() == len(expected)
+        assert db.session.query(InvoiceRollup).filter(InvoiceRollup.invoice_count <= 0).count() == 0
+        assert db.session.query(InvoiceTaxRollup).filter(InvoiceTaxRollup.tax_count <= 0).count() == 0
+
+
+def test_rollups_follow_ingest_delete_and_reingest(app, client):
+    assert {status for _, status in statuses(upload(client, BATCH))} == {'success'}
+    _assert_consistent(app, client)
+
+    items = client.get('/api/xml/list').get_json()['items']
+    by_issuer = defaultdict(list)
+    for item in items:
+        by_issuer[item['issuer_nit']].append(item['id'])
+
+    # Single delete, then a bulk delete that empties every group of one issuer
+    assert client.delete(f"/api/xml/{by_issuer['900000001'][0]}").status_code == 200
+    _assert_consistent(app, client)
+    response = client.post('/api/xml/bulk-delete', json={'ids': by_issuer['900000002']})
+    assert response.status_code == 200
+    _assert_consistent(app, client)
+
+    # Re-ingest: the deleted files come back, the others are duplicates
+    assert {status for _, status in statuses(upload(client, BATCH))} == {'success', 'skipped'}
+    _assert_consistent(app, client)
+    assert sum(row['invoice_count'] for row in _summary(client).values()) == len(BATCH)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""Content-hash duplicate pre-filter of /api/xml/upload"""
+from benchmarks.generators import make_invoice_xml
+from .conftest import statuses, upload
+
+
+def test_reupload_is_skipped_before_parsing(client):
+    invoice = make_invoice_xml(lines=2, seed=1)
+    assert statuses(upload(client, [('a.xml', invoice)])) == [('a.xml', 'success')]
+
+    body = upload(client, [('a.xml', invoice)])
+    assert statuses(body) == [('a.xml', 'skipped')]
+    assert body['details'][0]['msg'] == 'File already uploaded (same content)'
+
+
+def test_copies_in_one_upload_get_the_first_copy_outcome(client):
+    invoice = make_invoice_xml(lines=2, seed=2)
+    bad = b'<Invoice>not a DIAN invoice</Invoice>'
+    body = upload(client, [('a.xml', invoice), ('a2.xml', invoice), ('bad.xml', bad), ('bad2.xml', bad)])
+    assert statuses(body) == [('a.xml', 'success'), ('a2.xml', 'skipped'), ('bad.xml', 'error'), ('bad2.xml', 'error')]
+    assert body['details'][2]['msg'] == body['details'][3]['msg']
+
+
+def test_deleted_invoice_can_be_uploaded_again(client):
+    invoice = make_invoice_xml(lines=2, seed=3)
+    upload(client, [('a.xml', invoice)])
+    invoice_id = client.get('/api/xml/list').get_json()['items'][0]['id']
+    assert client.delete(f'/api/xml/{invoice_id}').status_code == 200
+
+    assert statuses(upload(client, [('a.xml', invoice)])) == [('a.xml', 'success')]
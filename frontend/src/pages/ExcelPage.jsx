@@ -4,27 +4,64 @@ import FileUpload from '../components/ui/FileUpload';
 import DataTable from '../components/ui/DataTable';
 
 
+const PER_PAGE = 500;
+
+const STATUS_FILTERS = [
+    { label: "All rows", value: "" },
+    { label: "Issues (CHECK / JUMP / DUPLICATE)", value: "CHECK|JUMP DETECTED|DUPLICATE" },
+    { label: "Verif CHECK", value: "CHECK" },
+    { label: "Jumps", value: "JUMP DETECTED" },
+    { label: "Duplicates", value: "DUPLICATE" },
+];
+
 export default function ExcelPage() {
     const [data, setData] = useState([]);
     const [summary, setSummary] = useState(null);
+    const [resultId, setResultId] = useState(null);
+    const [page, setPage] = useState(1);
+    const [totalPages, setTotalPages] = useState(0);
+    const [filter, setFilter] = useState("");
     const [loading, setLoading] = useState(false);
     const [error, setError] = useState(null);
 
+    // Rows stay on the server; only the requested page is fetched
+    const fetchPage = async (id, p, statusFilter) => {
+        setLoading(true);
+        setError(null);
+        try {
+            const params = new URLSearchParams({ page: p, per_page: PER_PAGE });
+            if (statusFilter) params.set('filter', statusFilter);
+            const res = await axios.get(`/api/excel/results/${id}?${params.toString()}`);
+            setData(res.data.data);
+            setPage(res.data.page);
+            setTotalPages(res.data.pages);
+        } catch (err) {
+            setError(err.response?.data?.error || "Error loading results");
+        } finally {
+            setLoading(false);
+        }
+    };
+
     const handleUpload = async (file) => {
         setLoading(true);
         setError(null);
         setData([]);
         setSummary(null);
+        setResultId(null);
+        setFilter("");
 
         const formData = new FormData();
         formData.append('file', file);
 
         try {
-            const res = await axios.post('/api/excel/process', formData, {
+            const res = await axios.post(`/api/excel/process?per_page=${PER_PAGE}`, formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
+            setResultId(res.data.result_id);
             setData(res.data.data);
             setSummary(res.data.summary);
+            setPage(res.data.page);
+            setTotalPages(res.data.pages);
         } catch (err) {
             setError(err.response?.data?.error || "Error processing file");
         } finally {
@@ -32,6 +69,32 @@ export default function ExcelPage() {
         }
     };
 
+    const handleFilterChange = (value) => {
+        setFilter(value);
+        if (resultId) fetchPage(resultId, 1, value);
+    };
+
+    const handleDownload = async () => {
+        try {
+            const params = new URLSearchParams({ format: 'ndjson' });
+            if (filter) params.set('filter', filter);
+            const response = await axios.get(`/api/excel/results/${resultId}?${params.toString()}`, {
+                responseType: 'blob'
+            });
+
+            const url = window.URL.createObjectURL(new Blob([response.data]));
+            const link = document.createElement('a');
+            link.href = url;
+            link.setAttribute('download', `excel_result_${resultId}.ndjson`);
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            window.URL.revokeObjectURL(url);
+        } catch (err) {
+            setError(err.response?.data?.error || "Error downloading results");
+        }
+    };
+
     const columns = [
         { header: "Tipo", accessor: "Tipo" },
         { header: "Fecha", accessor: "Fecha" },
@@ -83,14 +146,20 @@ export default function ExcelPage() {
                 <div className="lg:col-span-1 space-y-6">
                     <div className="bg-slate-800/50 p-6 rounded-2xl border border-slate-800">
                         <h3 className="text-lg font-semibold text-white mb-4">Input Data</h3>
-                        <FileUpload onUpload={handleUpload} accept=".xlsx, .xls" label="Upload .xlsx" />
+                        <FileUpload onUpload={handleUpload} accept=".xlsx, .xls, .csv" label="Upload .xlsx / .csv" />
 
                         {loading && <p className="text-indigo-400 mt-4 animate-pulse">Processing...</p>}
                         {error && <p className="text-red-400 mt-4 bg-red-400/10 p-3 rounded">{error}</p>}
                         {summary && (
-                            <div className="mt-6 p-4 bg-emerald-500/10 border border-emerald-500/20 rounded-lg">
+                            <div className="mt-6 p-4 bg-emerald-500/10 border border-emerald-500/20 rounded-lg space-y-2">
                                 <p className="text-emerald-400 font-medium">Success!</p>
                                 <p className="text-sm text-emerald-500/80">Processed {summary.processed_rows} rows.</p>
+                                <p className="text-sm text-slate-400">
+                                    Verif: {Object.entries(summary.verif || {}).map(([k, v]) => `${k} ${v}`).join(' · ')}
+                                </p>
+                                <p className="text-sm text-slate-400">
+                                    COMCON: {Object.entries(summary.comcon || {}).map(([k, v]) => `${k} ${v}`).join(' · ')}
+                                </p>
                             </div>
                         )}
                     </div>
@@ -104,12 +173,51 @@ export default function ExcelPage() {
                     </div>
                 </div>
 
-                <div className="lg:col-span-2">
+                <div className="lg:col-span-2 space-y-4">
+                    {resultId && (
+                        <div className="flex flex-wrap items-center justify-between gap-2">
+                            <select
+                                value={filter}
+                                onChange={(e) => handleFilterChange(e.target.value)}
+                                className="px-3 py-2 bg-slate-800 text-slate-300 rounded border border-slate-700"
+                            >
+                                {STATUS_FILTERS.map((f) => (
+                                    <option key={f.value} value={f.value}>{f.label}</option>
+                                ))}
+                            </select>
+                            <button onClick={handleDownload} className="px-4 py-2 text-sm text-indigo-400 hover:text-indigo-300">
+                                Download (NDJSON)
+                            </button>
+                        </div>
+                    )}
+
                     <DataTable
                         columns={columns}
                         data={data}
                         getRowClassName={getRowClassName}
                     />
+
+                    {resultId && totalPages > 1 && (
+                        <div className="flex justify-center gap-2">
+                            <button
+                                disabled={page <= 1 || loading}
+                                onClick={() => fetchPage(resultId, page - 1, filter)}
+                                className="px-4 py-2 bg-slate-800 text-slate-300 rounded hover:bg-slate-700 disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
+                            >
+                                Previous
+                            </button>
+                            <span className="px-4 py-2 text-slate-400">
+                                Page {page} of {totalPages}
+                            </span>
+                            <button
+                                disabled={page >= totalPages || loading}
+                                onClick={() => fetchPage(resultId, page + 1, filter)}
+                                className="px-4 py-2 bg-slate-800 text-slate-300 rounded hover:bg-slate-700 disabled:opacity-50 disabled:cursor-not-allowed transition-colors"
+                            >
+                                Next
+                            </button>
+                        </div>
+                    )}
                 </div>
             </div>
         </div>
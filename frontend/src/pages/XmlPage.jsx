@@ -41,15 +41,35 @@ export default function XmlPage() {
         fetchInvoices();
     }, []);
 
+    const pollJob = async (jobId) => {
+        // Background ingestion: poll progress until the job finishes
+        while (true) {
+            const res = await axios.get(`/api/xml/jobs/${jobId}`);
+            setUploadStats(res.data);
+            if (res.data.status === 'done' || res.data.status === 'failed') {
+                return res.data;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1500));
+        }
+    };
+
     const handleUpload = async (files) => {
         const formData = new FormData();
         files.forEach(f => formData.append('files', f));
 
         try {
-            const res = await axios.post('/api/xml/upload', formData, {
+            const res = await axios.post('/api/xml/upload?async=1', formData, {
                 headers: { 'Content-Type': 'multipart/form-data' }
             });
-            setUploadStats(res.data);
+            if (res.status === 202) {
+                const job = await pollJob(res.data.job_id);
+                if (job.status === 'failed') {
+                    alert(`Error al procesar el lote: ${job.error_msg || ''}`);
+                }
+            } else {
+                // Server without background jobs: the upload was processed synchronously
+                setUploadStats(res.data);
+            }
             fetchInvoices(1); // Refresh list
         } catch (err) {
             console.error(err);
@@ -77,6 +97,17 @@ export default function XmlPage() {
         }
     };
 
+    const handleView = async (invoiceId) => {
+        // The list only carries summaries; load items and taxes on demand
+        try {
+            const res = await axios.get(`/api/xml/${invoiceId}`);
+            setSelectedInvoice(res.data);
+        } catch (err) {
+            console.error(err);
+            alert(err.response?.data?.error || "Error al cargar la factura");
+        }
+    };
+
     const handleDelete = async (invoiceId, invoiceNumber) => {
         const confirmed = window.confirm(
             `¿Estás seguro de eliminar la factura ${invoiceNumber || invoiceId}?\n\nEsta acción no se puede deshacer.`
@@ -156,7 +187,7 @@ export default function XmlPage() {
             render: (r) => (
                 <div className="flex gap-2">
                     <button
-                        onClick={() => setSelectedInvoice(r)}
+                        onClick={() => handleView(r.id)}
                         className="p-2 bg-primary-100 dark:bg-primary-900/30 hover:bg-primary-200 dark:hover:bg-primary-800/50 text-primary-700 dark:text-primary-400 rounded-lg transition-colors"
                         title="Ver factura"
                     >
@@ -224,6 +255,11 @@ export default function XmlPage() {
                     <span className="text-xs text-slate-600 dark:text-slate-500 uppercase mb-2">Estado de Carga</span>
                     {uploadStats ? (
                         <div className="space-y-1">
+                            {uploadStats.status && uploadStats.status !== 'done' && (
+                                <p className="text-primary-600 dark:text-primary-400 text-xs animate-pulse">
+                                    Procesando {uploadStats.processed} archivos...
+                                </p>
+                            )}
                             <p className="text-emerald-600 dark:text-emerald-500 flex items-center gap-2 text-sm">
                                 <CheckCircle size={14} /> {uploadStats.uploaded} cargadas
                             </p>
@@ -247,7 +283,7 @@ export default function XmlPage() {
                         <h3 className="text-lg font-semibold text-slate-900 dark:text-slate-100 mb-4">
                             Cargar XMLs
                         </h3>
-                        <FileUpload onUpload={handleUpload} accept=".xml" multiple={true} label="Subir lotes" />
+                        <FileUpload onUpload={handleUpload} accept=".xml,.zip,.tar.gz,.tgz" multiple={true} label="Subir lotes" />
                     </div>
                 </div>
 